@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Cache settings of a CodeBuild project.
+
+"codebuild_cache.py evaluate" is the program of an external data
+source.  It only reads: the query (the same keys as the environment
+below) comes on stdin and the cache the project has now is printed as
+JSON, so a plan shows whether the project drifted from CACHE_TYPE and
+CACHE_MODES.
+
+"codebuild_cache.py write" runs from the provisioner and sets the
+project cache with UpdateProject.  A project already holding the cache
+is left alone.
+"""
+
+import json
+import os
+import sys
+
+import boto3
+
+CACHE_TYPES = ["NO_CACHE", "S3", "LOCAL"]
+
+CACHE_MODES = [
+    "LOCAL_DOCKER_LAYER_CACHE",
+    "LOCAL_SOURCE_CACHE"
+]
+
+
+def _env(key, default=None):
+
+    value = os.environ.get(key)
+
+    if value in [None, ""]:
+        return default
+
+    return value
+
+
+def _required(key):
+
+    value = _env(key)
+
+    if value is None:
+        raise Exception(f"{key} is required")
+
+    return value
+
+
+def _get_cache(client, project_name):
+
+    projects = client.batch_get_projects(names=[project_name])["projects"]
+
+    if not projects:
+        raise Exception(f"codebuild project {project_name} not found")
+
+    return projects[0].get("cache") or {"type": "NO_CACHE"}
+
+
+def _get_desired_cache():
+
+    cache_type = _required("CACHE_TYPE")
+    cache_modes = [_mode for _mode in _env("CACHE_MODES", "").split(",") if _mode]
+
+    if cache_type not in CACHE_TYPES:
+        raise Exception(f"CACHE_TYPE {cache_type} needs to be one of {CACHE_TYPES}")
+
+    unknown_modes = set(cache_modes) - set(CACHE_MODES)
+
+    if unknown_modes:
+        raise Exception(f"CACHE_MODES {sorted(unknown_modes)} need to be in {CACHE_MODES}")
+
+    if cache_type == "S3":
+        return {"type": "S3",
+                "location": _required("CACHE_LOCATION")}
+
+    if cache_type == "LOCAL":
+        return {"type": "LOCAL",
+                "modes": sorted(cache_modes)}
+
+    return {"type": "NO_CACHE"}
+
+
+def _normalize(cache):
+
+    normalized = {"type": cache.get("type", "NO_CACHE")}
+
+    if normalized["type"] == "S3":
+        normalized["location"] = cache.get("location", "")
+
+    if normalized["type"] == "LOCAL":
+        normalized["modes"] = sorted(cache.get("modes") or [])
+
+    return normalized
+
+
+def evaluate():
+
+    query = json.load(sys.stdin)
+    os.environ.update({key: str(value) for key, value in query.items()})
+
+    client = boto3.client("codebuild")
+    current = _normalize(_get_cache(client, _required("PROJECT_NAME")))
+
+    # the external data source only takes string values
+    json.dump({"current": json.dumps(current, sort_keys=True),
+               "in_sync": str(current == _get_desired_cache()).lower()},
+              sys.stdout)
+
+
+def write():
+
+    project_name = _required("PROJECT_NAME")
+    desired = _get_desired_cache()
+
+    client = boto3.client("codebuild")
+
+    if _normalize(_get_cache(client, project_name)) == desired:
+        print(f"{project_name}: cache {desired} already set")
+        return
+
+    client.update_project(name=project_name,
+                          cache=desired)
+
+    print(f"{project_name}: cache set to {desired}")
+
+
+if __name__ == "__main__":
+    try:
+        if sys.argv[1:] == ["evaluate"]:
+            evaluate()
+        else:
+            write()
+    except Exception as e:
+        print(f"codebuild cache failed: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,32 @@
+# Cache settings of a CodeBuild project
+# Set with UpdateProject whenever the project drifts from them
+
+locals {
+  cache_config = {
+    AWS_DEFAULT_REGION = var.aws_default_region
+    PROJECT_NAME       = var.project_name
+    CACHE_TYPE         = var.cache_type
+    CACHE_MODES        = var.cache_modes
+    CACHE_LOCATION     = var.cache_location
+  }
+}
+
+# read only evaluation of the project cache on every plan
+data "external" "cache" {
+  program = ["python3", "${path.module}/codebuild_cache.py", "evaluate"]
+  query   = local.cache_config
+}
+
+# replaced, and so written, when the settings change or the project
+# no longer holds them - e.g. after aws_codebuild applied the project
+resource "terraform_data" "cache" {
+  triggers_replace = [
+    local.cache_config,
+    data.external.cache.result.in_sync == "true" ? "in_sync" : data.external.cache.result.current
+  ]
+
+  provisioner "local-exec" {
+    command     = "python3 ${path.module}/codebuild_cache.py write"
+    environment = local.cache_config
+  }
+}
@@ -0,0 +1,19 @@
+output "project_name" {
+  description = "Name of the CodeBuild project"
+  value       = var.project_name
+}
+
+output "cache_type" {
+  description = "Cache type set on the project"
+  value       = var.cache_type
+}
+
+output "cache_modes" {
+  description = "Comma separated local cache modes set on the project"
+  value       = var.cache_modes
+}
+
+output "cache_location" {
+  description = "Location of the S3 cache"
+  value       = var.cache_location
+}
@@ -0,0 +1,43 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "project_name" {
+  description = "Name of the CodeBuild project"
+  type        = string
+}
+
+variable "cache_type" {
+  description = "NO_CACHE, S3 or LOCAL"
+  type        = string
+
+  validation {
+    condition     = contains(["NO_CACHE", "S3", "LOCAL"], var.cache_type)
+    error_message = "cache_type needs to be NO_CACHE, S3 or LOCAL"
+  }
+}
+
+variable "cache_modes" {
+  description = "Comma separated local cache modes for cache_type LOCAL"
+  type        = string
+  default     = ""
+
+  validation {
+    condition     = alltrue([for mode in compact(split(",", var.cache_modes)) : contains(["LOCAL_DOCKER_LAYER_CACHE", "LOCAL_SOURCE_CACHE"], mode)])
+    error_message = "cache_modes need to be LOCAL_DOCKER_LAYER_CACHE or LOCAL_SOURCE_CACHE"
+  }
+}
+
+variable "cache_location" {
+  description = "Bucket (and optional prefix) of the cache for cache_type S3"
+  type        = string
+  default     = ""
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
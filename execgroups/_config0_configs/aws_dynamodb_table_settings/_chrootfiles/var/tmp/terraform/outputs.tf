@@ -0,0 +1,24 @@
+output "table_name" {
+  description = "Name of the DynamoDB table"
+  value       = terraform_data.table_settings.output.table_name
+}
+
+output "billing_mode" {
+  description = "Billing mode of the table"
+  value       = terraform_data.table_settings.output.billing_mode
+}
+
+output "ttl_attribute" {
+  description = "Attribute items expire on"
+  value       = terraform_data.table_settings.output.ttl_attribute
+}
+
+output "index_names" {
+  description = "Global secondary indexes managed on the table"
+  value       = terraform_data.table_settings.output.index_names
+}
+
+output "settings_sha" {
+  description = "SHA256 of the settings last applied"
+  value       = terraform_data.table_settings.output.settings_sha
+}
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Capacity mode, TTL and global secondary indexes of an existing
+DynamoDB table.
+
+The table itself is created by aws_dynamodb.  This brings it to the
+desired settings with UpdateTable/UpdateTimeToLive, one change at a
+time since DynamoDB only allows one index creation per UpdateTable:
+
+- BILLING_MODE PAY_PER_REQUEST or PROVISIONED (READ_CAPACITY and
+  WRITE_CAPACITY)
+- TTL_ATTRIBUTE enables TTL on that attribute
+- INDEXES_HASH creates the listed global secondary indexes that do not
+  exist yet
+
+Existing indexes that are not listed are left in place.
+
+Runs as a local-exec provisioner, so the executor needs python3 with
+boto3 - without it the apply fails rather than skipping the settings.
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+
+def _env(key, default=None):
+
+    value = os.environ.get(key)
+
+    if value in [None, ""]:
+        return default
+
+    return value
+
+
+def _get_indexes():
+
+    if not _env("INDEXES_HASH"):
+        return []
+
+    indexes = json.loads(base64.b64decode(_env("INDEXES_HASH")).decode())
+
+    if not isinstance(indexes, list):
+        raise Exception("INDEXES_HASH needs to be a base64 encoded list of indexes")
+
+    for index in indexes:
+        if not index.get("name") or not index.get("hash_key"):
+            raise Exception(f"index {index} needs a name and a hash_key")
+
+    return indexes
+
+
+def _get_throughput():
+
+    return {"ReadCapacityUnits": int(_env("READ_CAPACITY", 5)),
+            "WriteCapacityUnits": int(_env("WRITE_CAPACITY", 5))}
+
+
+def _wait_active(client, table_name, index_name=None):
+
+    timeout = time.time() + int(_env("WAIT_TIMEOUT", 1800))
+
+    while time.time() < timeout:
+        table = client.describe_table(TableName=table_name)["Table"]
+
+        statuses = [table["TableStatus"]]
+        statuses.extend([index["IndexStatus"] for index in table.get("GlobalSecondaryIndexes", [])
+                         if not index_name or index["IndexName"] == index_name])
+
+        if set(statuses) == {"ACTIVE"}:
+            return table
+
+        time.sleep(10)
+
+    raise Exception(f"table {table_name} not active after {_env('WAIT_TIMEOUT', 1800)} seconds")
+
+
+def _set_billing_mode(client, table_name, table, billing_mode):
+
+    current = table.get("BillingModeSummary", {}).get("BillingMode", "PROVISIONED")
+
+    update_kwargs = {"TableName": table_name,
+                     "BillingMode": billing_mode}
+
+    if billing_mode == "PROVISIONED":
+        throughput = _get_throughput()
+        provisioned = table.get("ProvisionedThroughput", {})
+
+        if current == billing_mode and \
+                provisioned.get("ReadCapacityUnits") == throughput["ReadCapacityUnits"] and \
+                provisioned.get("WriteCapacityUnits") == throughput["WriteCapacityUnits"]:
+            return table
+
+        update_kwargs["ProvisionedThroughput"] = throughput
+
+        # indexes of a provisioned table need their own throughput
+        if table.get("GlobalSecondaryIndexes") and current != billing_mode:
+            update_kwargs["GlobalSecondaryIndexUpdates"] = [{"Update": {"IndexName": index["IndexName"],
+                                                                        "ProvisionedThroughput": throughput}}
+                                                            for index in table["GlobalSecondaryIndexes"]]
+    elif current == billing_mode:
+        return table
+
+    print(f"table {table_name}: billing mode {current} -> {billing_mode}")
+    client.update_table(**update_kwargs)
+
+    return _wait_active(client, table_name)
+
+
+def _create_index(client, table_name, index, billing_mode):
+
+    key_schema = [{"AttributeName": index["hash_key"], "KeyType": "HASH"}]
+    attributes = [{"AttributeName": index["hash_key"], "AttributeType": index.get("hash_key_type", "S")}]
+
+    if index.get("range_key"):
+        key_schema.append({"AttributeName": index["range_key"], "KeyType": "RANGE"})
+        attributes.append({"AttributeName": index["range_key"], "AttributeType": index.get("range_key_type", "S")})
+
+    create = {"IndexName": index["name"],
+              "KeySchema": key_schema,
+              "Projection": {"ProjectionType": index.get("projection", "ALL")}}
+
+    if billing_mode == "PROVISIONED":
+        create["ProvisionedThroughput"] = _get_throughput()
+
+    print(f"table {table_name}: creating index {index['name']}")
+
+    client.update_table(TableName=table_name,
+                        AttributeDefinitions=attributes,
+                        GlobalSecondaryIndexUpdates=[{"Create": create}])
+
+    return _wait_active(client, table_name, index_name=index["name"])
+
+
+def _set_ttl(client, table_name, ttl_attribute):
+
+    ttl = client.describe_time_to_live(TableName=table_name)["TimeToLiveDescription"]
+
+    if ttl.get("TimeToLiveStatus") in ["ENABLED", "ENABLING"]:
+        if ttl.get("AttributeName") == ttl_attribute:
+            return
+
+        raise Exception(f"table {table_name} has ttl on {ttl.get('AttributeName')} - "
+                        f"disable it before moving ttl to {ttl_attribute}")
+
+    print(f"table {table_name}: enabling ttl on {ttl_attribute}")
+
+    client.update_time_to_live(TableName=table_name,
+                               TimeToLiveSpecification={"Enabled": True,
+                                                        "AttributeName": ttl_attribute})
+
+
+def run():
+
+    table_name = _env("TABLE_NAME")
+    billing_mode = _env("BILLING_MODE", "PAY_PER_REQUEST")
+
+    if billing_mode not in ["PAY_PER_REQUEST", "PROVISIONED"]:
+        raise Exception(f"BILLING_MODE {billing_mode} needs to be PAY_PER_REQUEST or PROVISIONED")
+
+    if boto3 is None:
+        raise Exception("boto3 is not installed - the executor needs python3 with boto3")
+
+    client = boto3.client("dynamodb")
+
+    table = _wait_active(client, table_name)
+    table = _set_billing_mode(client, table_name, table, billing_mode)
+
+    existing = [index["IndexName"] for index in table.get("GlobalSecondaryIndexes", [])]
+
+    for index in _get_indexes():
+        if index["name"] in existing:
+            continue
+        table = _create_index(client, table_name, index, billing_mode)
+
+    if _env("TTL_ATTRIBUTE"):
+        _set_ttl(client, table_name, _env("TTL_ATTRIBUTE"))
+
+    print(f"table {table_name}: {billing_mode}, "
+          f"indexes {', '.join(index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])) or 'none'}, "
+          f"ttl {_env('TTL_ATTRIBUTE') or 'unchanged'}")
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except Exception as e:
+        print(f"table settings failed: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,44 @@
+# Capacity mode, TTL and global secondary indexes of an existing DynamoDB table
+# Changes are applied in place with UpdateTable, so the table and its items are kept
+
+locals {
+  settings_sha = sha256(jsonencode({
+    billing_mode   = var.billing_mode
+    read_capacity  = var.read_capacity
+    write_capacity = var.write_capacity
+    ttl_attribute  = var.ttl_attribute
+    indexes_hash   = var.indexes_hash
+  }))
+
+  index_names = var.indexes_hash == "" ? [] : [for index in jsondecode(base64decode(var.indexes_hash)) : index.name]
+}
+
+resource "terraform_data" "table_settings" {
+  # re-apply only when the desired settings change
+  triggers_replace = [
+    var.table_name,
+    local.settings_sha
+  ]
+
+  input = {
+    table_name    = var.table_name
+    billing_mode  = var.billing_mode
+    ttl_attribute = var.ttl_attribute
+    index_names   = local.index_names
+    settings_sha  = local.settings_sha
+  }
+
+  provisioner "local-exec" {
+    command = "python3 ${path.module}/table_settings.py"
+
+    environment = {
+      TABLE_NAME         = var.table_name
+      BILLING_MODE       = var.billing_mode
+      READ_CAPACITY      = var.read_capacity
+      WRITE_CAPACITY     = var.write_capacity
+      TTL_ATTRIBUTE      = var.ttl_attribute
+      INDEXES_HASH       = var.indexes_hash
+      AWS_DEFAULT_REGION = var.aws_default_region
+    }
+  }
+}
@@ -0,0 +1,51 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "table_name" {
+  description = "Name of the existing DynamoDB table"
+  type        = string
+}
+
+variable "billing_mode" {
+  description = "PAY_PER_REQUEST or PROVISIONED"
+  type        = string
+  default     = "PAY_PER_REQUEST"
+
+  validation {
+    condition     = contains(["PAY_PER_REQUEST", "PROVISIONED"], var.billing_mode)
+    error_message = "billing_mode needs to be PAY_PER_REQUEST or PROVISIONED"
+  }
+}
+
+variable "read_capacity" {
+  description = "Read capacity units of the table and its indexes when PROVISIONED"
+  type        = number
+  default     = 5
+}
+
+variable "write_capacity" {
+  description = "Write capacity units of the table and its indexes when PROVISIONED"
+  type        = number
+  default     = 5
+}
+
+variable "ttl_attribute" {
+  description = "Epoch seconds attribute items expire on - empty leaves TTL unchanged"
+  type        = string
+  default     = ""
+}
+
+variable "indexes_hash" {
+  description = "Base64 encoded JSON list of global secondary indexes (name, hash_key, range_key, projection)"
+  type        = string
+  default     = ""
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
@@ -0,0 +1,14 @@
+output "table_name" {
+  description = "Name of the DynamoDB table holding the item"
+  value       = terraform_data.upsert.output.table_name
+}
+
+output "item_key" {
+  description = "JSON encoded hash key value of the item"
+  value       = terraform_data.upsert.output.key
+}
+
+output "item_sha" {
+  description = "SHA256 of the item last upserted"
+  value       = terraform_data.upsert.output.item_sha
+}
@@ -0,0 +1,24 @@
+# AWS Provider Configuration
+# Configures the AWS provider with region
+
+provider "aws" {
+  # Region where AWS resources will be created
+  region = var.aws_default_region
+
+  # no taggable resources - the item is written by upsert_item.py
+}
+
+# Terraform Version Configuration
+# Specifies the required Terraform and provider versions
+terraform {
+  # Minimum Terraform version required
+  required_version = ">= 1.1.0"
+
+  # Required providers with version constraints
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws" # AWS provider source
+      version = "~> 5.0"        # Compatible with AWS provider v5.x
+    }
+  }
+}
\ No newline at end of file
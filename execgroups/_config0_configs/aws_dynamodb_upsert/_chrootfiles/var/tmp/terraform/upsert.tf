@@ -0,0 +1,37 @@
+# Partial upsert of a DynamoDB item
+# Only attributes that differ from the stored item are written, guarded by a version attribute
+
+locals {
+  item     = jsondecode(base64decode(var.item_hash))
+  key      = nonsensitive(local.item[var.hash_key])
+  item_sha = nonsensitive(sha256(var.item_hash))
+}
+
+resource "terraform_data" "upsert" {
+  # re-run the upsert only when the desired item changes
+  triggers_replace = [
+    var.table_name,
+    var.hash_key,
+    local.item_sha
+  ]
+
+  input = {
+    table_name = var.table_name
+    hash_key   = var.hash_key
+    key        = jsonencode(local.key)
+    item_sha   = local.item_sha
+  }
+
+  provisioner "local-exec" {
+    command = "python3 ${path.module}/upsert_item.py"
+
+    environment = {
+      TABLE_NAME         = var.table_name
+      HASH_KEY           = var.hash_key
+      ITEM_HASH          = var.item_hash
+      VERSION_ATTRIBUTE  = var.version_attribute
+      MAX_RETRIES        = var.max_retries
+      AWS_DEFAULT_REGION = var.aws_default_region
+    }
+  }
+}
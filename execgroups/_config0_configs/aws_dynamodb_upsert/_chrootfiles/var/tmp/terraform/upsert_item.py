@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Partial upsert of a DynamoDB item.
+
+Reads the stored item, diffs it against the desired item and issues a
+conditional UpdateItem that only SETs the attributes that changed.
+The version attribute is set to the sha256 of the written item's other
+attributes (a string, as the stacks write it) and the write is
+conditional on the version read, so concurrent upserts retry against
+the latest item instead of clobbering each other.
+
+The names of the attributes written from the desired item are kept in
+MANAGED_ATTRIBUTE.  An attribute that was written by an earlier upsert
+and is no longer in the desired item is REMOVEd.  Other attributes on
+the stored item are left untouched (e.g. values written back by the CI
+lambdas).  An item without MANAGED_ATTRIBUTE (written by a put) has
+nothing removed on its first upsert.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# names of the attributes written from the desired item
+MANAGED_ATTRIBUTE = "managed_attributes"
+
+
+def _get_desired_item():
+
+    item = json.loads(base64.b64decode(os.environ["ITEM_HASH"]).decode())
+
+    if not isinstance(item, dict):
+        raise Exception("ITEM_HASH needs to be a base64 encoded dynamodb item")
+
+    return item
+
+
+def _get_changes(desired, current, hash_key, version_attribute):
+    """
+    Attributes to SET and attribute names to REMOVE so the stored item
+    matches the desired item.
+    """
+    changes = {}
+    managed = sorted(_key for _key in desired if _key not in [hash_key, version_attribute, MANAGED_ATTRIBUTE])
+
+    for _key in managed:
+        if current.get(_key) == desired[_key]:
+            continue
+
+        changes[_key] = desired[_key]
+
+    previous = current.get(MANAGED_ATTRIBUTE, {}).get("SS", [])
+    removes = sorted(_key for _key in previous if _key not in managed and _key in current)
+
+    # an empty string set cannot be stored
+    if managed and sorted(previous) != managed:
+        changes[MANAGED_ATTRIBUTE] = {"SS": managed}
+
+    return changes, removes
+
+
+def _get_next_version(current, changes, removes, version_attribute):
+    """
+    sha256 of the item as it is after the update, without the version
+    attribute.
+    """
+    item = dict(current, **changes)
+
+    for _key in removes + [version_attribute]:
+        item.pop(_key, None)
+
+    return hashlib.sha256(json.dumps(item, sort_keys=True).encode()).hexdigest()
+
+
+def _update_item(client, table_name, hash_key, key_value, changes, removes,
+                 version_attribute, version, next_version, exists):
+
+    names = {"#ver": version_attribute}
+
+    values = {":next": {"S": next_version}}
+
+    set_expressions = ["#ver = :next"]
+    remove_expressions = []
+
+    for _index, (_key, _value) in enumerate(sorted(changes.items())):
+        names[f"#a{_index}"] = _key
+        values[f":v{_index}"] = _value
+        set_expressions.append(f"#a{_index} = :v{_index}")
+
+    for _index, _key in enumerate(removes):
+        names[f"#r{_index}"] = _key
+        remove_expressions.append(f"#r{_index}")
+
+    # only names used by the expressions may be passed
+    if not exists:
+        names["#hk"] = hash_key
+        condition = "attribute_not_exists(#hk)"
+    elif version is None:
+        names["#hk"] = hash_key
+        condition = "attribute_exists(#hk) AND attribute_not_exists(#ver)"
+    else:
+        # compared as read, so items from before the string version
+        # are still updated
+        condition = "#ver = :expected"
+        values[":expected"] = version
+
+    update_expression = f"SET {', '.join(set_expressions)}"
+
+    if remove_expressions:
+        update_expression += f" REMOVE {', '.join(remove_expressions)}"
+
+    client.update_item(TableName=table_name,
+                       Key={hash_key: key_value},
+                       UpdateExpression=update_expression,
+                       ConditionExpression=condition,
+                       ExpressionAttributeNames=names,
+                       ExpressionAttributeValues=values)
+
+
+def run():
+
+    table_name = os.environ["TABLE_NAME"]
+    hash_key = os.environ.get("HASH_KEY", "_id")
+    version_attribute = os.environ.get("VERSION_ATTRIBUTE", "settings_version")
+    max_retries = int(os.environ.get("MAX_RETRIES", 5))
+
+    desired = _get_desired_item()
+
+    if hash_key not in desired:
+        raise Exception(f"hash_key {hash_key} missing from item")
+
+    key_value = desired[hash_key]
+    client = boto3.client("dynamodb")
+
+    for attempt in range(max_retries + 1):
+
+        current = client.get_item(TableName=table_name,
+                                  Key={hash_key: key_value},
+                                  ConsistentRead=True).get("Item", {})
+
+        changes, removes = _get_changes(desired,
+                                        current,
+                                        hash_key,
+                                        version_attribute)
+
+        version = current.get(version_attribute)
+
+        if current and not changes and not removes:
+            print(f"item {key_value} unchanged at {version_attribute} {list(version.values())[0] if version else None}")
+            return
+
+        next_version = _get_next_version(current,
+                                         changes,
+                                         removes,
+                                         version_attribute)
+
+        try:
+            _update_item(client,
+                         table_name,
+                         hash_key,
+                         key_value,
+                         changes,
+                         removes,
+                         version_attribute,
+                         version,
+                         next_version,
+                         bool(current))
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+            print(f"item {key_value} changed during upsert - retry {attempt + 1}/{max_retries}")
+            time.sleep(min(2 ** attempt, 10) * random.uniform(0.5, 1.0))
+            continue
+
+        print(f"item {key_value} updated {len(changes)} attribute(s): {', '.join(sorted(changes))}"
+              f"{' - removed ' + ', '.join(removes) if removes else ''}")
+        return
+
+    raise Exception(f"item {key_value} kept changing - gave up after {max_retries} retries")
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except Exception as e:
+        print(f"upsert failed: {e}", file=sys.stderr)
+        sys.exit(1)
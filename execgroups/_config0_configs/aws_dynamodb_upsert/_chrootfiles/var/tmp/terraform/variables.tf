@@ -0,0 +1,34 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "table_name" {
+  description = "Name of the DynamoDB table holding the item"
+  type        = string
+}
+
+variable "hash_key" {
+  description = "Hash key attribute of the table"
+  type        = string
+  default     = "_id"
+}
+
+variable "item_hash" {
+  description = "Base64 encoded JSON of the DynamoDB item in attribute value format"
+  type        = string
+  sensitive   = true
+}
+
+variable "version_attribute" {
+  description = "String attribute set to a sha256 of the item's other attributes on every write and used as the write condition"
+  type        = string
+  default     = "settings_version"
+}
+
+variable "max_retries" {
+  description = "Retries when the item changes between the read and the conditional write"
+  type        = number
+  default     = 5
+}
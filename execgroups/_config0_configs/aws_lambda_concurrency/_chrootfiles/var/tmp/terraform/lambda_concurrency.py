@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Concurrency and published alias of a Lambda function.
+
+"lambda_concurrency.py evaluate" is the program of an external data
+source.  It only reads: the query (the same keys as the environment
+below) comes on stdin and the state of the function is printed as
+JSON, so a plan shows whether the function drifted from the settings
+or $LATEST changed since the version behind ALIAS_NAME was published.
+
+"lambda_concurrency.py write" runs from the provisioner.  It sets
+SnapStart on $LATEST, publishes a version when $LATEST differs from
+the version behind ALIAS_NAME, points the alias at it and sets the
+provisioned concurrency of the alias and the reserved concurrency of
+the function.  Settings the function already has are left alone.
+"""
+
+import json
+import os
+import sys
+
+import boto3
+
+# configuration a published version keeps - $LATEST differing in any
+# of them needs a new version
+VERSION_KEYS = [
+    "CodeSha256",
+    "Runtime",
+    "Handler",
+    "Role",
+    "MemorySize",
+    "Timeout",
+    "Environment",
+    "Layers",
+    "VpcConfig",
+    "ImageConfigResponse",
+    "EphemeralStorage"
+]
+
+
+def _env(key, default=None):
+
+    value = os.environ.get(key)
+
+    if value in [None, ""]:
+        return default
+
+    return value
+
+
+def _required(key):
+
+    value = _env(key)
+
+    if value is None:
+        raise Exception(f"{key} is required")
+
+    return value
+
+
+def _get_desired():
+
+    desired = {
+        "alias_name": _env("ALIAS_NAME"),
+        "provisioned": int(_env("PROVISIONED_CONCURRENCY", 0)),
+        "reserved": int(_env("RESERVED_CONCURRENCY")) if _env("RESERVED_CONCURRENCY") else None,
+        "snap_start": _env("SNAP_START", "false").lower() == "true"
+    }
+
+    if (desired["provisioned"] or desired["snap_start"]) and not desired["alias_name"]:
+        raise Exception("provisioned concurrency and SnapStart need ALIAS_NAME")
+
+    if desired["provisioned"] and desired["snap_start"]:
+        raise Exception("SnapStart and provisioned concurrency can not be used together")
+
+    return desired
+
+
+def _get_version_config(config):
+
+    version_config = {key: config.get(key) for key in VERSION_KEYS}
+    version_config["SnapStart"] = (config.get("SnapStart") or {}).get("ApplyOn", "None")
+
+    return version_config
+
+
+def _get_alias(client, function_name, alias_name):
+
+    try:
+        return client.get_alias(FunctionName=function_name,
+                                Name=alias_name)
+    except client.exceptions.ResourceNotFoundException:
+        return None
+
+
+def _get_provisioned(client, function_name, alias_name):
+
+    try:
+        config = client.get_provisioned_concurrency_config(FunctionName=function_name,
+                                                           Qualifier=alias_name)
+    except (client.exceptions.ProvisionedConcurrencyConfigNotFoundException,
+            client.exceptions.ResourceNotFoundException):
+        return 0
+
+    return config["RequestedProvisionedConcurrentExecutions"]
+
+
+def _get_current(client, function_name, alias_name):
+
+    latest = client.get_function_configuration(FunctionName=function_name)
+
+    current = {
+        "package_type": latest.get("PackageType", "Zip"),
+        "snap_start": (latest.get("SnapStart") or {}).get("ApplyOn") == "PublishedVersions",
+        "reserved": client.get_function_concurrency(FunctionName=function_name).get("ReservedConcurrentExecutions")
+    }
+
+    if not alias_name:
+        return current, latest
+
+    alias = _get_alias(client, function_name, alias_name)
+    current["version"] = alias["FunctionVersion"] if alias else None
+    current["published"] = False
+
+    if alias:
+        version = client.get_function_configuration(FunctionName=function_name,
+                                                    Qualifier=alias["FunctionVersion"])
+        current["published"] = _get_version_config(version) == _get_version_config(latest)
+
+    current["provisioned"] = _get_provisioned(client, function_name, alias_name)
+
+    return current, latest
+
+
+def _in_sync(current, desired):
+
+    if current["snap_start"] != desired["snap_start"]:
+        return False
+
+    if desired["reserved"] is not None and current["reserved"] != desired["reserved"]:
+        return False
+
+    if not desired["alias_name"]:
+        return True
+
+    return current["published"] and current["provisioned"] == desired["provisioned"]
+
+
+def evaluate():
+
+    query = json.load(sys.stdin)
+    os.environ.update({key: str(value) for key, value in query.items()})
+
+    client = boto3.client("lambda")
+    current = _get_current(client, _required("FUNCTION_NAME"), _env("ALIAS_NAME"))[0]
+
+    # the external data source only takes string values
+    json.dump({"current": json.dumps(current, sort_keys=True),
+               "in_sync": str(_in_sync(current, _get_desired())).lower()},
+              sys.stdout)
+
+
+def write():
+
+    function_name = _required("FUNCTION_NAME")
+    desired = _get_desired()
+    alias_name = desired["alias_name"]
+
+    client = boto3.client("lambda")
+    current = _get_current(client, function_name, alias_name)[0]
+
+    if desired["snap_start"] and current["package_type"] == "Image":
+        raise Exception(f"{function_name} is a container image function - SnapStart does not support container images")
+
+    if current["snap_start"] != desired["snap_start"]:
+        client.update_function_configuration(FunctionName=function_name,
+                                             SnapStart={"ApplyOn": "PublishedVersions" if desired["snap_start"] else "None"})
+        client.get_waiter("function_updated_v2").wait(FunctionName=function_name)
+        print(f"{function_name}: snap_start set to {desired['snap_start']}")
+
+    if desired["reserved"] is not None and current["reserved"] != desired["reserved"]:
+        client.put_function_concurrency(FunctionName=function_name,
+                                        ReservedConcurrentExecutions=desired["reserved"])
+        print(f"{function_name}: reserved concurrency set to {desired['reserved']}")
+
+    if not alias_name:
+        return
+
+    # SnapStart changes $LATEST, so the state is read again
+    current, latest = _get_current(client, function_name, alias_name)
+
+    if not current["published"]:
+        version = client.publish_version(FunctionName=function_name,
+                                         CodeSha256=latest["CodeSha256"])["Version"]
+
+        # SnapStart versions are active once their snapshot is taken
+        client.get_waiter("published_version_active").wait(FunctionName=function_name,
+                                                           Qualifier=version)
+
+        if current["version"]:
+            client.update_alias(FunctionName=function_name,
+                                Name=alias_name,
+                                FunctionVersion=version)
+        else:
+            client.create_alias(FunctionName=function_name,
+                                Name=alias_name,
+                                FunctionVersion=version)
+
+        print(f"{function_name}: published version {version} as {alias_name}")
+
+    if current["provisioned"] == desired["provisioned"]:
+        return
+
+    if desired["provisioned"]:
+        client.put_provisioned_concurrency_config(FunctionName=function_name,
+                                                  Qualifier=alias_name,
+                                                  ProvisionedConcurrentExecutions=desired["provisioned"])
+    else:
+        client.delete_provisioned_concurrency_config(FunctionName=function_name,
+                                                     Qualifier=alias_name)
+
+    print(f"{function_name}: provisioned concurrency of {alias_name} set to {desired['provisioned']}")
+
+
+if __name__ == "__main__":
+    try:
+        if sys.argv[1:] == ["evaluate"]:
+            evaluate()
+        else:
+            write()
+    except Exception as e:
+        print(f"lambda concurrency failed: {e}", file=sys.stderr)
+        sys.exit(1)
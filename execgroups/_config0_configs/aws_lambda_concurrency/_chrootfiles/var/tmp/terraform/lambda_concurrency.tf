@@ -0,0 +1,34 @@
+# Concurrency and published alias of a Lambda function
+# Set whenever the function drifts from them or $LATEST changed since
+# the version behind the alias was published
+
+locals {
+  concurrency_config = {
+    AWS_DEFAULT_REGION      = var.aws_default_region
+    FUNCTION_NAME           = var.function_name
+    ALIAS_NAME              = var.alias_name
+    PROVISIONED_CONCURRENCY = tostring(var.provisioned_concurrency)
+    RESERVED_CONCURRENCY    = var.reserved_concurrency == null ? "" : tostring(var.reserved_concurrency)
+    SNAP_START              = tostring(var.snap_start)
+  }
+}
+
+# read only evaluation of the function on every plan
+data "external" "concurrency" {
+  program = ["python3", "${path.module}/lambda_concurrency.py", "evaluate"]
+  query   = local.concurrency_config
+}
+
+# replaced, and so written, when the settings change or the function
+# no longer matches them - e.g. after py_lambda deployed new code
+resource "terraform_data" "concurrency" {
+  triggers_replace = [
+    local.concurrency_config,
+    data.external.concurrency.result.in_sync == "true" ? "in_sync" : data.external.concurrency.result.current
+  ]
+
+  provisioner "local-exec" {
+    command     = "python3 ${path.module}/lambda_concurrency.py write"
+    environment = local.concurrency_config
+  }
+}
@@ -0,0 +1,24 @@
+output "function_name" {
+  description = "Name of the Lambda function"
+  value       = var.function_name
+}
+
+output "alias_name" {
+  description = "Alias of the published version"
+  value       = var.alias_name
+}
+
+output "invoke_name" {
+  description = "Name callers invoke the function by - qualified with the alias when there is one"
+  value       = var.alias_name == "" ? var.function_name : "${var.function_name}:${var.alias_name}"
+}
+
+output "provisioned_concurrency" {
+  description = "Provisioned concurrency of the alias"
+  value       = var.provisioned_concurrency
+}
+
+output "snap_start" {
+  description = "Whether SnapStart is on for published versions"
+  value       = var.snap_start
+}
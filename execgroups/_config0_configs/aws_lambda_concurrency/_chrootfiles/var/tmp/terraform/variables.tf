@@ -0,0 +1,50 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "function_name" {
+  description = "Name of the Lambda function"
+  type        = string
+}
+
+variable "alias_name" {
+  description = "Alias of the published version - required by provisioned_concurrency and snap_start, empty publishes no version"
+  type        = string
+  default     = ""
+}
+
+variable "provisioned_concurrency" {
+  description = "Provisioned concurrency of the alias - 0 sets none"
+  type        = number
+  default     = 0
+
+  validation {
+    condition     = var.provisioned_concurrency >= 0
+    error_message = "provisioned_concurrency needs to be 0 or more"
+  }
+}
+
+variable "reserved_concurrency" {
+  description = "Reserved concurrency of the function - null leaves it as it is"
+  type        = number
+  default     = null
+
+  validation {
+    condition     = var.reserved_concurrency == null ? true : var.reserved_concurrency >= 0
+    error_message = "reserved_concurrency needs to be 0 or more"
+  }
+}
+
+variable "snap_start" {
+  description = "SnapStart on published versions - not supported for container image functions"
+  type        = bool
+  default     = false
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
@@ -0,0 +1,9 @@
+output "buckets" {
+  description = "Names of the S3 buckets managed by this execution"
+  value       = join(",", sort(keys(aws_s3_bucket.default)))
+}
+
+output "arns_hash" {
+  description = "Base64 encoded JSON map of bucket name to ARN"
+  value       = base64encode(jsonencode({ for name, bucket in aws_s3_bucket.default : name => bucket.arn }))
+}
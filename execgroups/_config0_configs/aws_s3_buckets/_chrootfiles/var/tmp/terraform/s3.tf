@@ -0,0 +1,104 @@
+locals {
+  # bucket name -> bucket spec
+  buckets = { for bucket in jsondecode(base64decode(var.buckets_hash)) : bucket.bucket => bucket }
+
+  lifecycle_buckets = { for name, bucket in local.buckets : name => bucket if tostring(try(bucket.enable_lifecycle, "false")) == "true" }
+  private_buckets   = { for name, bucket in local.buckets : name => bucket if try(bucket.acl, "private") == "private" }
+  acl_buckets       = { for name, bucket in local.buckets : name => bucket if try(bucket.acl, "private") != "private" }
+  versioned_buckets = { for name, bucket in local.buckets : name => bucket if tostring(try(bucket.versioning, "false")) == "true" }
+
+  # existing buckets to adopt, limited to the buckets of this execution
+  import_buckets = toset([for name in split(",", var.import_buckets) : trimspace(name) if contains(keys(local.buckets), trimspace(name))])
+}
+
+# adopt buckets previously created one per execution - an import of a
+# bucket that is already in the state is a no-op
+import {
+  for_each = local.import_buckets
+  to       = aws_s3_bucket.default[each.key]
+  id       = each.key
+}
+
+resource "aws_s3_bucket" "default" {
+  for_each = local.buckets
+
+  bucket        = each.key
+  force_destroy = tostring(try(each.value.force_destroy, "true")) == "true"
+  tags          = merge(var.cloud_tags, try(each.value.tags, {}))
+}
+
+resource "aws_s3_bucket_server_side_encryption_configuration" "default" {
+  for_each = local.buckets
+
+  bucket = aws_s3_bucket.default[each.key].id
+
+  rule {
+    apply_server_side_encryption_by_default {
+      sse_algorithm     = try(each.value.sse_algorithm, "AES256")
+      kms_master_key_id = try(each.value.kms_key_id, "") != "" ? each.value.kms_key_id : null
+    }
+    bucket_key_enabled = try(each.value.sse_algorithm, "AES256") == "aws:kms"
+  }
+}
+
+# only buckets asking for versioning are managed, so adopted buckets keep
+# the versioning they were created with
+resource "aws_s3_bucket_versioning" "default" {
+  for_each = local.versioned_buckets
+
+  bucket = aws_s3_bucket.default[each.key].id
+
+  versioning_configuration {
+    status = "Enabled"
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "default" {
+  for_each = local.private_buckets
+
+  bucket                  = aws_s3_bucket.default[each.key].id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_ownership_controls" "default" {
+  for_each = local.acl_buckets
+
+  bucket = aws_s3_bucket.default[each.key].id
+
+  rule {
+    object_ownership = "BucketOwnerPreferred"
+  }
+}
+
+resource "aws_s3_bucket_acl" "default" {
+  for_each = local.acl_buckets
+
+  bucket = aws_s3_bucket.default[each.key].id
+  acl    = each.value.acl
+
+  depends_on = [aws_s3_bucket_ownership_controls.default]
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "default" {
+  for_each = local.lifecycle_buckets
+
+  bucket = aws_s3_bucket.default[each.key].id
+
+  rule {
+    id     = "expire"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = tonumber(try(each.value.expire_days, 1))
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
@@ -0,0 +1,22 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "buckets_hash" {
+  description = "Base64 encoded JSON list of bucket specs (bucket, acl, enable_lifecycle, expire_days, force_destroy, versioning, sse_algorithm, kms_key_id, tags)"
+  type        = string
+}
+
+variable "import_buckets" {
+  description = "Comma separated names of existing buckets to import instead of creating them"
+  type        = string
+  default     = ""
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
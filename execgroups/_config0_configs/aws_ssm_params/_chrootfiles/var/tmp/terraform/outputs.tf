@@ -0,0 +1,9 @@
+output "ssm_keys" {
+  description = "Names of the SSM parameters managed by this execution"
+  value       = join(",", sort([for ssm_param in aws_ssm_parameter.default : ssm_param.name]))
+}
+
+output "ssm_versions_hash" {
+  description = "Base64 encoded JSON map of SSM parameter name to version"
+  value       = base64encode(jsonencode({ for ssm_param in aws_ssm_parameter.default : ssm_param.name => ssm_param.version }))
+}
@@ -0,0 +1,15 @@
+locals {
+  # map of ssm key -> value written in a single execution
+  ssm_params = jsondecode(base64decode(var.ssm_params_hash))
+}
+
+resource "aws_ssm_parameter" "default" {
+  # keys are not secret - only the values are
+  for_each = nonsensitive(toset(keys(local.ssm_params)))
+
+  name      = each.value
+  type      = var.ssm_type
+  value     = local.ssm_params[each.value]
+  overwrite = true
+  tags      = var.cloud_tags
+}
@@ -0,0 +1,23 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "ssm_params_hash" {
+  description = "Base64 encoded JSON map of SSM parameter name to value"
+  type        = string
+  sensitive   = true
+}
+
+variable "ssm_type" {
+  description = "Type of the SSM parameters"
+  type        = string
+  default     = "SecureString"
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
@@ -27,11 +27,31 @@ resource "aws_iam_role_policy" "step_function_policy" {
           "lambda:InvokeFunction"
         ]
         Effect = "Allow"
+        # unqualified and through an alias
+        Resource = concat(
+          values(local.lambda_function_arns),
+          [for arn in values(local.lambda_function_arns) : "${arn}:*"]
+        )
+      },
+      {
+        # EXPRESS webhook processing starts the build tracking child
+        Action = [
+          "states:StartExecution"
+        ]
+        Effect = "Allow"
+        Resource = [
+          "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:stateMachine:${var.ci_environment}-${var.step_function_name}-build"
+        ]
+      },
+      {
+        # coalescing keys
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ]
+        Effect = "Allow"
         Resource = [
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.process_webhook}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.pkgcode_to_s3}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.trigger_codebuild}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.check_codebuild}"
+          "arn:aws:dynamodb:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:table/${var.runs_table}"
         ]
       }
     ]
@@ -6,4 +6,9 @@ output "role_arn" {
 output "arn" {
   description = "ARN of the Step Function state machine"
   value       = aws_sfn_state_machine.sfn_state_machine.arn
+}
+
+output "build_tracking_arn" {
+  description = "ARN of the STANDARD build tracking state machine - empty unless workflow_type is EXPRESS"
+  value       = local.express_enabled ? aws_sfn_state_machine.build_tracking[0].arn : ""
 }
\ No newline at end of file
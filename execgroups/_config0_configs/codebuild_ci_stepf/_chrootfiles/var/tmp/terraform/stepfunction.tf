@@ -1,90 +1,339 @@
-resource "aws_sfn_state_machine" "sfn_state_machine" {
-  name     = "${var.ci_environment}-${var.step_function_name}"
-  role_arn = aws_iam_role.default.arn
-  tags     = var.cloud_tags
+locals {
+  lambda_arn_prefix = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}"
 
-  definition = jsonencode({
-    Comment = "The state machine processes webhook from code repo, executes codebuild, and checks results"
-    StartAt = "ProcessWebhook"
-    States = {
-      ProcessWebhook = {
-        Type     = "Task"
-        Resource = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.process_webhook}"
-        Next     = "ChkProcessWebhook"
-      }
-      ChkProcessWebhook = {
-        Type = "Choice"
-        Choices = [
-          {
-            Variable      = "$.continue"
-            BooleanEquals = true
-            Next          = "PkgCodeToS3"
-          }
-        ]
-        Default = "Done"
-      }
-      PkgCodeToS3 = {
-        Type      = "Task"
-        Resource  = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.pkgcode_to_s3}"
-        Next      = "ChkPkgCodeToS3"
-        InputPath = "$.body"
-      }
-      ChkPkgCodeToS3 = {
-        Type = "Choice"
-        Choices = [
-          {
-            Variable      = "$.continue"
-            BooleanEquals = true
-            Next          = "TriggerCodebuild"
-          }
-        ]
-        Default = "Done"
+  # lambdas with an alias (lambda_aliases_hash, function name suffix to
+  # alias) are invoked through it, so their provisioned concurrency and
+  # SnapStart versions serve the invocations
+  lambda_aliases = jsondecode(var.lambda_aliases_hash == "" ? "{}" : base64decode(var.lambda_aliases_hash))
+
+  lambda_function_arns = { for name in [var.process_webhook, var.pkgcode_to_s3, var.trigger_codebuild, var.check_codebuild] : name => "${local.lambda_arn_prefix}-${name}" }
+
+  lambda_arns = { for name, arn in local.lambda_function_arns : name => lookup(local.lambda_aliases, name, "") == "" ? arn : "${arn}:${local.lambda_aliases[name]}" }
+
+  # pushes to the same trigger_id + branch inside the window collapse into
+  # the execution of the newest push
+  coalesce_enabled = var.coalesce_window_seconds > 0
+
+  # order of a push - the time its webhook arrived, i.e. the start of the
+  # execution that received it (passed on as coalesce_received_at by the
+  # EXPRESS parent), in epoch milliseconds
+  coalesce_order = join(" ", [
+    "{% (",
+    "$received := $exists($states.input.coalesce_received_at) ? $states.input.coalesce_received_at : $states.context.Execution.StartTime;",
+    "$now := $toMillis($states.context.State.EnteredTime);",
+    "$merge([$states.input, {'coalesce': $merge([$states.input.coalesce, {",
+    "'order': $string($toMillis($received)),",
+    "'expire_at': $string($floor($now / 1000) + ${var.coalesce_window_seconds + var.coalesce_ttl_seconds})",
+    "}])}])",
+    ") %}"
+  ])
+
+  # seconds of WaitCodebuildBackoff - the numeric suggestion of
+  # check-codebuild or a doubling backoff, rounded and bounded
+  check_wait_seconds = join(" ", [
+    "{% (",
+    "$suggested := $states.input.next_wait_seconds;",
+    "$wait := $type($suggested) = 'number' ? $suggested : ${var.check_wait_min_seconds} * $power(2, $check_count);",
+    "$round($min([$max([$wait, ${var.check_wait_min_seconds}]), ${var.check_wait_max_seconds}]))",
+    ") %}"
+  ])
+
+  states = {
+    ProcessWebhook = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.process_webhook]
+      Next     = "ChkProcessWebhook"
+    }
+    ChkProcessWebhook = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable      = "$.continue"
+          BooleanEquals = true
+          Next          = local.coalesce_enabled ? "ChkCoalesceKey" : "PkgCodeToS3"
+        }
+      ]
+      Default = "Done"
+    }
+    PkgCodeToS3 = {
+      Type      = "Task"
+      Resource  = local.lambda_arns[var.pkgcode_to_s3]
+      Next      = "ChkPkgCodeToS3"
+      InputPath = "$.body"
+    }
+    ChkPkgCodeToS3 = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable      = "$.continue"
+          BooleanEquals = true
+          Next          = "TriggerCodebuild"
+        }
+      ]
+      Default = "Done"
+    }
+    TriggerCodebuild = {
+      Type      = "Task"
+      Resource  = local.lambda_arns[var.trigger_codebuild]
+      Next      = "ChkTriggerCodebuild"
+      InputPath = "$.body"
+    }
+    ChkTriggerCodebuild = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable      = "$.continue"
+          BooleanEquals = true
+          Next          = "WaitCodebuildCheck"
+        }
+      ]
+      Default = "Done"
+    }
+    WaitCodebuildCheck = {
+      Type    = "Wait"
+      Seconds = 30
+      Next    = "CheckCodebuild"
+      Comment = "Wait to Check CodeBuild completion"
+      Assign = {
+        check_count = 0
       }
-      TriggerCodebuild = {
-        Type      = "Task"
-        Resource  = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.trigger_codebuild}"
-        Next      = "ChkTriggerCodebuild"
-        InputPath = "$.body"
+    }
+    CheckCodebuild = {
+      Type      = "Task"
+      Resource  = local.lambda_arns[var.check_codebuild]
+      Next      = "ChkCheckCodebuild"
+      InputPath = "$.body"
+    }
+    ChkCheckCodebuild = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable      = "$.continue"
+          BooleanEquals = true
+          Next          = "WaitCodebuildBackoff"
+        }
+      ]
+      Default = "Done"
+    }
+    # check-codebuild may suggest the next wait (next_wait_seconds) from
+    # the elapsed time and the project's build history.  Without a
+    # numeric suggestion the wait doubles from check_wait_min_seconds on
+    # every check.  Both are rounded and kept within the bounds.
+    WaitCodebuildBackoff = {
+      Type          = "Wait"
+      QueryLanguage = "JSONata"
+      Comment       = "Wait before the next check"
+      Seconds       = local.check_wait_seconds
+      Assign = {
+        check_count = "{% $check_count + 1 %}"
       }
-      ChkTriggerCodebuild = {
-        Type = "Choice"
-        Choices = [
-          {
-            Variable      = "$.continue"
-            BooleanEquals = true
-            Next          = "WaitCodebuildCheck"
-          }
-        ]
-        Default = "Done"
+      Next = "CheckCodebuild"
+    }
+    Done = {
+      Type = "Pass"
+      End  = true
+    }
+  }
+
+  coalesce_states = {
+    ChkCoalesceKey = {
+      Type = "Choice"
+      Choices = [
+        {
+          And = [
+            {
+              Variable  = var.coalesce_trigger_id_path
+              IsPresent = true
+            },
+            {
+              Variable  = var.coalesce_branch_path
+              IsPresent = true
+            }
+          ]
+          Next = "CoalesceKey"
+        }
+      ]
+      Default = "PkgCodeToS3"
+    }
+    CoalesceKey = {
+      Type = "Pass"
+      Parameters = {
+        "key.$"          = "States.Format('coalesce#{}#{}', ${var.coalesce_trigger_id_path}, ${var.coalesce_branch_path})"
+        "execution_id.$" = "$$.Execution.Id"
       }
-      WaitCodebuildCheck = {
-        Type    = "Wait"
-        Seconds = 30
-        Next    = "CheckCodebuild"
-        Comment = "Wait to Check CodeBuild completion"
+      ResultPath = "$.coalesce"
+      Next       = "CoalesceOrder"
+    }
+    CoalesceOrder = {
+      Type          = "Pass"
+      QueryLanguage = "JSONata"
+      Output        = local.coalesce_order
+      Next          = "CoalesceRegister"
+    }
+    # the push that arrived last owns the key - a push that arrived
+    # earlier but registers later fails the condition and is superseded
+    CoalesceRegister = {
+      Type     = "Task"
+      Resource = "arn:aws:states:::dynamodb:putItem"
+      Parameters = {
+        TableName = var.runs_table
+        Item = merge({
+          (var.runs_hash_key) = { "S.$" = "$.coalesce.key" }
+          execution_id        = { "S.$" = "$.coalesce.execution_id" }
+          trigger_id          = { "S.$" = var.coalesce_trigger_id_path }
+          branch              = { "S.$" = var.coalesce_branch_path }
+          arrival_order       = { "N.$" = "$.coalesce.order" }
+          type                = { S = "coalesce" }
+          }, {
+          for name, value in { (var.runs_ttl_attribute) = { "N.$" = "$.coalesce.expire_at" } } :
+          name => value if name != ""
+        })
+        ConditionExpression = "attribute_not_exists(#order) OR #order < :order"
+        ExpressionAttributeNames = {
+          "#order" = "arrival_order"
+        }
+        ExpressionAttributeValues = {
+          ":order" = { "N.$" = "$.coalesce.order" }
+        }
       }
-      CheckCodebuild = {
-        Type      = "Task"
-        Resource  = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.ci_environment}-${var.check_codebuild}"
-        Next      = "ChkCheckCodebuild"
-        InputPath = "$.body"
+      ResultPath = null
+      Next       = "CoalesceWindow"
+      Catch = [
+        {
+          ErrorEquals = ["DynamoDB.ConditionalCheckFailedException"]
+          ResultPath  = "$.coalesce_error"
+          Next        = "Superseded"
+        },
+        {
+          ErrorEquals = ["States.ALL"]
+          ResultPath  = "$.coalesce_error"
+          Next        = "PkgCodeToS3"
+        }
+      ]
+    }
+    CoalesceWindow = {
+      Type    = "Wait"
+      Seconds = var.coalesce_window_seconds
+      Next    = "CoalesceCheck"
+      Comment = "Wait for newer pushes to the same branch"
+    }
+    CoalesceCheck = {
+      Type     = "Task"
+      Resource = "arn:aws:states:::dynamodb:getItem"
+      Parameters = {
+        TableName      = var.runs_table
+        ConsistentRead = true
+        Key = {
+          (var.runs_hash_key) = { "S.$" = "$.coalesce.key" }
+        }
       }
-      ChkCheckCodebuild = {
-        Type = "Choice"
-        Choices = [
-          {
-            Variable      = "$.continue"
-            BooleanEquals = true
-            Next          = "CheckCodebuild"
-          }
-        ]
-        Default = "Done"
+      ResultSelector = {
+        "execution_id.$" = "$.Item.execution_id.S"
       }
-      Done = {
-        Type = "Pass"
-        End  = true
+      ResultPath = "$.coalesce.latest"
+      Next       = "ChkCoalesce"
+      Catch = [
+        {
+          ErrorEquals = ["States.ALL"]
+          ResultPath  = "$.coalesce_error"
+          Next        = "PkgCodeToS3"
+        }
+      ]
+    }
+    ChkCoalesce = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable         = "$.coalesce.latest.execution_id"
+          StringEqualsPath = "$.coalesce.execution_id"
+          Next             = "PkgCodeToS3"
+        }
+      ]
+      Default = "Superseded"
+    }
+    Superseded = {
+      Type    = "Succeed"
+      Comment = "A newer push to the same branch builds instead"
+    }
+  }
+}
+
+locals {
+  # coalesce states are only added when enabled
+  definition_states = merge(concat(
+    [local.states],
+    [for states in [local.coalesce_states] : states if local.coalesce_enabled]
+  )...)
+
+  # EXPRESS only runs ProcessWebhook and hands everything after it to a
+  # STANDARD build tracking child, which can wait on builds for hours
+  express_enabled = var.workflow_type == "EXPRESS"
+
+  build_tracking_states = { for name, state in local.definition_states : name => state if name != "ProcessWebhook" }
+
+  express_states = {
+    ProcessWebhook = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.process_webhook]
+      Next     = "ChkStartBuildTracking"
+    }
+    ChkStartBuildTracking = {
+      Type = "Choice"
+      Choices = [
+        {
+          Variable      = "$.continue"
+          BooleanEquals = true
+          Next          = "StartBuildTracking"
+        }
+      ]
+      Default = "Done"
+    }
+    # fire and forget - the express execution ends once the child starts.
+    # The child orders coalesced pushes by when this execution started.
+    StartBuildTracking = {
+      Type          = "Task"
+      QueryLanguage = "JSONata"
+      Resource      = "arn:aws:states:::states:startExecution"
+      Arguments = {
+        StateMachineArn = one(aws_sfn_state_machine.build_tracking[*].arn)
+        Input           = "{% $merge([$states.input, {'coalesce_received_at': $states.context.Execution.StartTime}]) %}"
       }
+      End = true
     }
+    Done = {
+      Type = "Pass"
+      End  = true
+    }
+  }
+}
+
+resource "aws_sfn_state_machine" "sfn_state_machine" {
+  name     = "${var.ci_environment}-${var.step_function_name}"
+  role_arn = aws_iam_role.default.arn
+  type     = var.workflow_type
+  tags     = var.cloud_tags
+
+  definition = jsonencode({
+    Comment = "The state machine processes webhook from code repo, executes codebuild, and checks results"
+    StartAt = "ProcessWebhook"
+    States = merge(concat(
+      [for states in [local.definition_states] : states if !local.express_enabled],
+      [for states in [local.express_states] : states if local.express_enabled]
+    )...)
   })
 }
 
+resource "aws_sfn_state_machine" "build_tracking" {
+  count = local.express_enabled ? 1 : 0
+
+  name     = "${var.ci_environment}-${var.step_function_name}-build"
+  role_arn = aws_iam_role.default.arn
+  type     = "STANDARD"
+  tags     = var.cloud_tags
+
+  definition = jsonencode({
+    Comment = "Started by the express webhook state machine - executes codebuild and checks results"
+    StartAt = "ChkProcessWebhook"
+    States  = local.build_tracking_states
+  })
+}
@@ -39,6 +39,77 @@ variable "trigger_codebuild" {
   default     = "trigger-codebuild"
 }
 
+variable "lambda_aliases_hash" {
+  description = "Base64 encoded JSON map of lambda function name suffix to the alias the state machine invokes - unlisted functions are invoked unqualified"
+  type        = string
+  default     = ""
+}
+
+variable "check_wait_min_seconds" {
+  description = "First and lowest wait between checks"
+  type        = number
+  default     = 10
+}
+
+variable "check_wait_max_seconds" {
+  description = "Highest wait between checks"
+  type        = number
+  default     = 120
+}
+
+variable "coalesce_window_seconds" {
+  description = "Seconds a push waits for newer pushes to the same trigger_id and branch - 0 disables coalescing"
+  type        = number
+  default     = 0
+}
+
+variable "coalesce_trigger_id_path" {
+  description = "JSONPath of the trigger id in the ProcessWebhook output"
+  type        = string
+  default     = "$.body.trigger_id"
+}
+
+variable "coalesce_branch_path" {
+  description = "JSONPath of the branch in the ProcessWebhook output"
+  type        = string
+  default     = "$.body.branch"
+}
+
+variable "coalesce_ttl_seconds" {
+  description = "Seconds a coalescing key is kept after its window"
+  type        = number
+  default     = 86400
+}
+
+variable "runs_ttl_attribute" {
+  description = "Epoch seconds TTL attribute of the runs table set on coalescing keys - empty sets none"
+  type        = string
+  default     = "expire_at"
+}
+
+variable "runs_table" {
+  description = "DynamoDB table holding the coalescing keys"
+  type        = string
+  default     = "ci-shared-runs"
+}
+
+variable "runs_hash_key" {
+  description = "Hash key attribute of the runs table"
+  type        = string
+  default     = "_id"
+}
+
+variable "workflow_type" {
+  description = "STANDARD, or EXPRESS to process webhooks in an express workflow that starts a STANDARD build tracking child"
+  type        = string
+  default     = "STANDARD"
+
+  validation {
+    condition     = contains(["STANDARD", "EXPRESS"], var.workflow_type)
+    error_message = "workflow_type needs to be STANDARD or EXPRESS"
+  }
+}
+
 variable "cloud_tags" {
   description = "Additional tags as a map to apply to all resources"
   type        = map(string)
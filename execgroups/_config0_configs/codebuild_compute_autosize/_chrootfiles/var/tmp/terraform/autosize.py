@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Compute type autosizing for a CodeBuild project.
+
+Reads the recent builds of a project from the runs table and
+recommends the next smaller or larger compute type:
+
+- upsize when the p90 build duration crosses UPSIZE_P90_SECONDS,
+  builds time out, or the out of memory failure rate crosses OOM_RATE
+- downsize when the p90 build duration is under DOWNSIZE_P90_SECONDS
+  and no build ran out of memory
+
+"autosize.py evaluate" is the program of an external data source.  It
+only reads: the query (the same keys as the environment below) comes on
+stdin and the recommendation is printed as JSON, so a plan shows
+whether anything would change.
+
+"autosize.py write" runs from the provisioner when the recommendation
+changed.  It writes the recommendation to the settings item, and with
+MODE=apply compute_type too so the next triggered build uses it.  An
+item already holding the recommendation is left alone.  Writes are
+conditional on the settings version read.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+COMPUTE_TYPES = [
+    "BUILD_GENERAL1_SMALL",
+    "BUILD_GENERAL1_MEDIUM",
+    "BUILD_GENERAL1_LARGE",
+    "BUILD_GENERAL1_XLARGE",
+    "BUILD_GENERAL1_2XLARGE"
+]
+
+OOM_PATTERN = re.compile(r"out of memory|\boom\b|exit (status|code) 137|\bkilled\b", re.IGNORECASE)
+
+
+def _env(key, default=None):
+
+    value = os.environ.get(key)
+
+    if value in [None, ""]:
+        return default
+
+    return value
+
+
+def _sort_key(timestamp):
+
+    # epoch numbers sort before iso strings
+    try:
+        return 0, float(timestamp or 0), ""
+    except (TypeError, ValueError):
+        return 1, 0.0, str(timestamp)
+
+
+def _required(key):
+
+    value = _env(key)
+
+    if value is None:
+        raise Exception(f"{key} is required")
+
+    return value
+
+
+def _get_runs(dynamodb, trigger_id):
+
+    table = dynamodb.Table(_required("RUNS_TABLE"))
+    key_attribute = _required("RUNS_KEY_ATTRIBUTE")
+
+    if _env("RUNS_INDEX"):
+        query_kwargs = {"IndexName": _env("RUNS_INDEX"),
+                        "KeyConditionExpression": Key(key_attribute).eq(trigger_id)}
+        call = table.query
+    else:
+        query_kwargs = {"FilterExpression": Attr(key_attribute).eq(trigger_id)}
+        call = table.scan
+
+    runs = []
+
+    while True:
+        results = call(**query_kwargs)
+        runs.extend(results.get("Items", []))
+
+        if not results.get("LastEvaluatedKey"):
+            break
+
+        query_kwargs["ExclusiveStartKey"] = results["LastEvaluatedKey"]
+
+    timestamp_attribute = _required("TIMESTAMP_ATTRIBUTE")
+    runs = sorted(runs, key=lambda run: _sort_key(run.get(timestamp_attribute)))
+
+    return runs[-int(_env("LOOKBACK", 30)):]
+
+
+def _percentile(values, percentile):
+
+    values = sorted(values)
+    index = max(int(math.ceil(percentile / 100.0 * len(values))) - 1, 0)
+
+    return values[index]
+
+
+def _recommend(current, runs, build_timeout):
+
+    duration_attribute = _required("DURATION_ATTRIBUTE")
+    status_attribute = _required("STATUS_ATTRIBUTE")
+    message_attribute = _required("STATUS_MESSAGE_ATTRIBUTE")
+
+    durations = []
+    oom_failures = 0
+    timeouts = 0
+
+    for run in runs:
+        if run.get(duration_attribute) not in [None, ""]:
+            durations.append(float(run[duration_attribute]))
+
+        status = str(run.get(status_attribute, "")).lower()
+
+        if status in ["timed_out", "timeout"]:
+            timeouts += 1
+        elif status in ["failed", "fault"] and OOM_PATTERN.search(str(run.get(message_attribute, ""))):
+            oom_failures += 1
+
+    # runs without any of the configured attributes point at a wrong
+    # attribute name rather than at missing history
+    if runs and not durations and not any(run.get(status_attribute) for run in runs):
+        raise Exception(f"none of {len(runs)} run(s) has {duration_attribute} or {status_attribute}")
+
+    if len(durations) < int(_env("MIN_SAMPLES", 5)):
+        return None, f"only {len(durations)} build(s) with a duration"
+
+    p90 = _percentile(durations, 90)
+    oom_rate = oom_failures / float(len(runs))
+
+    index = COMPUTE_TYPES.index(current) if current in COMPUTE_TYPES else 0
+    min_index = COMPUTE_TYPES.index(_env("MIN_COMPUTE_TYPE", COMPUTE_TYPES[0]))
+    max_index = COMPUTE_TYPES.index(_env("MAX_COMPUTE_TYPE", COMPUTE_TYPES[2]))
+
+    summary = f"p90 {int(p90)}s, {oom_failures} oom, {timeouts} timeout(s) over {len(runs)} build(s)"
+
+    if oom_rate >= float(_env("OOM_RATE", 0.1)) or timeouts or p90 >= float(_env("UPSIZE_P90_SECONDS", 900)) or \
+            (build_timeout and p90 >= 0.8 * build_timeout):
+        return COMPUTE_TYPES[min(index + 1, max_index)], f"upsize - {summary}"
+
+    if not oom_failures and p90 <= float(_env("DOWNSIZE_P90_SECONDS", 180)):
+        return COMPUTE_TYPES[max(index - 1, min_index)], f"downsize - {summary}"
+
+    return COMPUTE_TYPES[min(max(index, min_index), max_index)], f"keep - {summary}"
+
+
+def _is_current(settings, recommended, apply):
+
+    if settings.get("compute_type_recommended", {}).get("S") != recommended:
+        return False
+
+    return not apply or settings.get("compute_type", {}).get("S") == recommended
+
+
+def _write_back(client, settings, recommended, reason, apply):
+
+    settings_table = _required("SETTINGS_TABLE")
+    version_attribute = _env("VERSION_ATTRIBUTE", "settings_version")
+    version = settings.get(version_attribute)
+
+    names = {"#ver": version_attribute,
+             "#rec": "compute_type_recommended",
+             "#reason": "compute_type_reason",
+             "#at": "compute_type_evaluated_at"}
+
+    values = {":rec": {"S": recommended},
+              ":reason": {"S": reason},
+              ":at": {"N": str(int(time.time()))}}
+
+    set_expressions = ["#ver = :next", "#rec = :rec", "#reason = :reason", "#at = :at"]
+
+    item = dict(settings,
+                compute_type_recommended=values[":rec"],
+                compute_type_reason=values[":reason"],
+                compute_type_evaluated_at=values[":at"])
+
+    if apply:
+        names["#ct"] = "compute_type"
+        set_expressions.append("#ct = :rec")
+        item["compute_type"] = values[":rec"]
+
+    # sha256 of the item as written, the string version the stacks write
+    item.pop(version_attribute, None)
+    values[":next"] = {"S": hashlib.sha256(json.dumps(item, sort_keys=True).encode()).hexdigest()}
+
+    if version:
+        condition = "#ver = :expected"
+        values[":expected"] = version
+    else:
+        condition = "attribute_not_exists(#ver)"
+
+    client.update_item(TableName=settings_table,
+                       Key={"_id": settings["_id"]},
+                       UpdateExpression=f"SET {', '.join(set_expressions)}",
+                       ConditionExpression=condition,
+                       ExpressionAttributeNames=names,
+                       ExpressionAttributeValues=values)
+
+
+def _get_settings(client, trigger_id):
+
+    settings = client.get_item(TableName=_required("SETTINGS_TABLE"),
+                               Key={"_id": {"S": trigger_id}},
+                               ConsistentRead=True).get("Item")
+
+    if not settings:
+        raise Exception(f"settings item {trigger_id} not found")
+
+    return settings
+
+
+def evaluate():
+    """
+    Recommendation for the external data source - reads only.
+    """
+    # the query has the same keys as the environment of the write step
+    os.environ.update({key: str(value) for key, value in json.load(sys.stdin).items()})
+
+    trigger_id = _required("TRIGGER_ID")
+
+    client = boto3.client("dynamodb", region_name=_env("AWS_DEFAULT_REGION"))
+    dynamodb = boto3.resource("dynamodb", region_name=_env("AWS_DEFAULT_REGION"))
+
+    settings = _get_settings(client, trigger_id)
+    current = settings.get("compute_type", {}).get("S", COMPUTE_TYPES[0])
+
+    try:
+        # build_timeout is stored in minutes
+        build_timeout = float(settings.get("build_timeout", {}).get("S")) * 60
+    except (TypeError, ValueError):
+        build_timeout = None
+
+    recommended, reason = _recommend(current, _get_runs(dynamodb, trigger_id), build_timeout)
+
+    # too few samples keeps whatever the item holds
+    if not recommended:
+        recommended = settings.get("compute_type_recommended", {}).get("S", "")
+
+    json.dump({"current": current,
+               "recommended": recommended,
+               "reason": reason},
+              sys.stdout)
+
+
+def write():
+
+    trigger_id = _required("TRIGGER_ID")
+    recommended = _env("RECOMMENDED")
+    reason = _env("REASON", "")
+    apply = _env("MODE", "recommend") == "apply"
+
+    if not recommended:
+        print(f"{trigger_id}: nothing to write ({reason})")
+        return
+
+    client = boto3.client("dynamodb")
+
+    for attempt in range(int(_env("MAX_RETRIES", 5)) + 1):
+
+        settings = _get_settings(client, trigger_id)
+
+        if _is_current(settings, recommended, apply):
+            print(f"{trigger_id}: {recommended} already on the settings item")
+            return
+
+        try:
+            _write_back(client, settings, recommended, reason, apply)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            print(f"settings item {trigger_id} changed during autosize - retry {attempt + 1}")
+            time.sleep(min(2 ** attempt, 10))
+            continue
+
+        print(f"{trigger_id}: {recommended} ({reason}){' applied' if apply else ''}")
+        return
+
+    raise Exception(f"settings item {trigger_id} kept changing - gave up")
+
+
+if __name__ == "__main__":
+    try:
+        if sys.argv[1:] == ["evaluate"]:
+            evaluate()
+        else:
+            write()
+    except Exception as e:
+        print(f"autosize failed: {e}", file=sys.stderr)
+        sys.exit(1)
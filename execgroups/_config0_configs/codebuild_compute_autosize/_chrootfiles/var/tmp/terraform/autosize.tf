@@ -0,0 +1,67 @@
+# Compute type autosizing from build history
+# The recommendation (and with mode "apply" the compute_type) is written to the settings item
+
+locals {
+  autosize_config = {
+    AWS_DEFAULT_REGION       = var.aws_default_region
+    TRIGGER_ID               = var.trigger_id
+    MODE                     = var.mode
+    SETTINGS_TABLE           = var.settings_table
+    RUNS_TABLE               = var.runs_table
+    RUNS_INDEX               = var.runs_index
+    RUNS_KEY_ATTRIBUTE       = var.runs_key_attribute
+    DURATION_ATTRIBUTE       = var.duration_attribute
+    STATUS_ATTRIBUTE         = var.status_attribute
+    STATUS_MESSAGE_ATTRIBUTE = var.status_message_attribute
+    TIMESTAMP_ATTRIBUTE      = var.timestamp_attribute
+    VERSION_ATTRIBUTE        = var.version_attribute
+    LOOKBACK                 = tostring(var.lookback)
+    MIN_SAMPLES              = tostring(var.min_samples)
+    UPSIZE_P90_SECONDS       = tostring(var.upsize_p90_seconds)
+    DOWNSIZE_P90_SECONDS     = tostring(var.downsize_p90_seconds)
+    OOM_RATE                 = tostring(var.oom_rate)
+    MIN_COMPUTE_TYPE         = var.min_compute_type
+    MAX_COMPUTE_TYPE         = var.max_compute_type
+  }
+}
+
+# read only evaluation of the build history on every plan
+data "external" "recommendation" {
+  program = ["python3", "${path.module}/autosize.py", "evaluate"]
+  query   = local.autosize_config
+}
+
+# only replaced, and so only written, when the recommendation changes
+resource "terraform_data" "autosize" {
+  triggers_replace = [
+    var.trigger_id,
+    var.mode,
+    data.external.recommendation.result.recommended
+  ]
+
+  # the reason changes with every build and is not a trigger
+  input = data.external.recommendation.result.reason
+
+  provisioner "local-exec" {
+    command = "python3 ${path.module}/autosize.py write"
+
+    environment = merge(local.autosize_config, {
+      RECOMMENDED = data.external.recommendation.result.recommended
+      REASON      = self.input
+    })
+  }
+}
+
+# read back what was written to the settings item
+data "aws_dynamodb_table_item" "settings" {
+  table_name = var.settings_table
+  key        = jsonencode({ _id = { S = var.trigger_id } })
+
+  projection_expression = "compute_type, compute_type_recommended, compute_type_reason"
+
+  depends_on = [terraform_data.autosize]
+}
+
+locals {
+  settings = jsondecode(data.aws_dynamodb_table_item.settings.item)
+}
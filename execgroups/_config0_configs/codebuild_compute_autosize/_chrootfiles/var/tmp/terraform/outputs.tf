@@ -0,0 +1,19 @@
+output "compute_type" {
+  description = "compute_type on the settings item after the run"
+  value       = try(local.settings.compute_type.S, "")
+}
+
+output "compute_type_recommended" {
+  description = "Recommended compute type"
+  value       = try(local.settings.compute_type_recommended.S, "")
+}
+
+output "compute_type_reason" {
+  description = "Why the compute type was recommended"
+  value       = try(local.settings.compute_type_reason.S, "")
+}
+
+output "mode" {
+  description = "recommend or apply - with apply compute_type follows the recommendation"
+  value       = var.mode
+}
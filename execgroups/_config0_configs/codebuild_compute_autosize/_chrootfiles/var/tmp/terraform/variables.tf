@@ -0,0 +1,118 @@
+variable "aws_default_region" {
+  description = "AWS region where resources will be deployed"
+  type        = string
+  default     = "us-east-1"
+}
+
+variable "trigger_id" {
+  description = "Trigger id of the project - the _id of its settings item"
+  type        = string
+}
+
+variable "mode" {
+  description = "recommend only records the recommendation, apply also updates compute_type"
+  type        = string
+  default     = "recommend"
+
+  validation {
+    condition     = contains(["recommend", "apply"], var.mode)
+    error_message = "mode needs to be recommend or apply"
+  }
+}
+
+variable "settings_table" {
+  description = "DynamoDB table with the project settings items"
+  type        = string
+  default     = "ci-shared-settings"
+}
+
+variable "runs_table" {
+  description = "DynamoDB table with the build runs"
+  type        = string
+  default     = "ci-shared-runs"
+}
+
+variable "runs_index" {
+  description = "Index on the runs table keyed by runs_key_attribute - the table is scanned when empty"
+  type        = string
+  default     = ""
+}
+
+variable "runs_key_attribute" {
+  description = "Attribute of a run holding the trigger id"
+  type        = string
+}
+
+variable "duration_attribute" {
+  description = "Attribute of a run holding the build duration in seconds"
+  type        = string
+}
+
+variable "status_attribute" {
+  description = "Attribute of a run holding the build status"
+  type        = string
+}
+
+variable "status_message_attribute" {
+  description = "Attribute of a run holding the failure message used to detect out of memory failures"
+  type        = string
+}
+
+variable "timestamp_attribute" {
+  description = "Attribute of a run used to order the runs"
+  type        = string
+}
+
+variable "version_attribute" {
+  description = "String attribute of the settings item set to a sha256 of its other attributes on every write"
+  type        = string
+  default     = "settings_version"
+}
+
+variable "lookback" {
+  description = "Number of most recent runs evaluated"
+  type        = number
+  default     = 30
+}
+
+variable "min_samples" {
+  description = "Minimum runs with a duration before a change is recommended"
+  type        = number
+  default     = 5
+}
+
+variable "upsize_p90_seconds" {
+  description = "p90 build duration in seconds at or above which the compute type is upsized"
+  type        = number
+  default     = 900
+}
+
+variable "downsize_p90_seconds" {
+  description = "p90 build duration in seconds at or below which the compute type is downsized"
+  type        = number
+  default     = 180
+}
+
+variable "oom_rate" {
+  description = "Share of out of memory failures at or above which the compute type is upsized"
+  type        = number
+  default     = 0.1
+}
+
+variable "min_compute_type" {
+  description = "Smallest compute type that can be recommended"
+  type        = string
+  default     = "BUILD_GENERAL1_SMALL"
+}
+
+variable "max_compute_type" {
+  description = "Largest compute type that can be recommended"
+  type        = string
+  default     = "BUILD_GENERAL1_LARGE"
+}
+
+variable "cloud_tags" {
+  description = "Additional tags as a map to apply to all resources"
+  type        = map(string)
+  default     = {}
+}
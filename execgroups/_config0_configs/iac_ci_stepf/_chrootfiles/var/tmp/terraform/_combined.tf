@@ -1,235 +1,464 @@
 ####FILE####:::step_function.tf
-resource "aws_sfn_state_machine" "sfn_state_machine" {
-  name       = var.step_function_name
-  role_arn   = aws_iam_role.default.arn
-  tags       = var.cloud_tags
-  definition = <<EOF
-{
-  "Comment": "Processes webhook, executes CodeBuild, supports optional parallel folder builds when report && parallel_folder_builds. No parsing of $.body.",
-  "StartAt": "ProcessWebhook",
-  "States": {
-    "ProcessWebhook": {
-      "Type": "Task",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-process-webhook",
-      "Next": "ChkProcessWebhook"
-    },
-    "ChkProcessWebhook": {
-      "Type": "Choice",
-      "Choices": [
+locals {
+  lambda_arn_prefix = "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}"
+
+  # lambdas with an alias (lambda_aliases_hash, function name suffix to
+  # alias) are invoked through it, so their provisioned concurrency and
+  # SnapStart versions serve the invocations
+  lambda_aliases = jsondecode(var.lambda_aliases_hash == "" ? "{}" : base64decode(var.lambda_aliases_hash))
+
+  lambda_function_arns = { for name in [var.process_webhook, var.pkgcode_to_s3, var.trigger_codebuild, var.trigger_lambda, var.update_pr, var.check_codebuild] : name => "${local.lambda_arn_prefix}-${name}" }
+
+  lambda_arns = { for name, arn in local.lambda_function_arns : name => lookup(local.lambda_aliases, name, "") == "" ? arn : "${arn}:${local.lambda_aliases[name]}" }
+
+  # "task_token" parks TriggerCodebuild on a task token that the
+  # CodeBuild state change event resumes instead of polling
+  task_token_enabled = var.codebuild_wait == "task_token"
+
+  # seconds of WaitCodebuildBackoff - the numeric suggestion of
+  # check-codebuild or a doubling backoff, rounded and bounded
+  check_wait_seconds = join(" ", [
+    "{% (",
+    "$suggested := $states.input.next_wait_seconds;",
+    "$wait := $type($suggested) = 'number' ? $suggested : ${var.check_wait_min_seconds} * $power(2, $check_count);",
+    "$round($min([$max([$wait, ${var.check_wait_min_seconds}]), ${var.check_wait_max_seconds}]))",
+    ") %}"
+  ])
+
+  # folder sets of parallel_distributed_threshold or more run in a
+  # distributed map whose results are written to s3
+  distributed_enabled = var.parallel_distributed_threshold > 0 && var.map_results_bucket != ""
+
+  states = {
+    ProcessWebhook = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.process_webhook]
+      Next     = "ChkProcessWebhook"
+    }
+    ChkProcessWebhook = {
+      Type = "Choice"
+      Choices = [
         {
-          "And": [
+          And = [
             {
-              "BooleanEquals": true,
-              "Variable": "$.apply"
+              BooleanEquals = true
+              Variable      = "$.apply"
             },
             {
-              "BooleanEquals": true,
-              "Variable": "$.continue"
+              BooleanEquals = true
+              Variable      = "$.continue"
             }
-          ],
-          "Next": "TriggerCodebuild"
+          ]
+          Next = "TriggerCodebuild"
         },
         {
-          "And": [
+          And = [
             {
-              "BooleanEquals": true,
-              "Variable": "$.destroy"
+              BooleanEquals = true
+              Variable      = "$.destroy"
             },
             {
-              "BooleanEquals": true,
-              "Variable": "$.continue"
+              BooleanEquals = true
+              Variable      = "$.continue"
             }
-          ],
-          "Next": "TriggerCodebuild"
+          ]
+          Next = "TriggerCodebuild"
         },
         {
-          "And": [
+          And = [
             {
-              "BooleanEquals": true,
-              "Variable": "$.continue"
+              BooleanEquals = true
+              Variable      = "$.continue"
             },
             {
-              "BooleanEquals": true,
-              "Variable": "$.report"
+              BooleanEquals = true
+              Variable      = "$.report"
             },
             {
-              "IsPresent": true,
-              "Variable": "$.parallel_folder_builds"
+              IsPresent = true
+              Variable  = "$.parallel_folder_builds"
             }
-          ],
-          "Next": "PrepareParallelBody"
+          ]
+          Next = "ChkParallelConcurrency"
         },
         {
-          "And": [
+          And = [
             {
-              "BooleanEquals": true,
-              "Variable": "$.check"
+              BooleanEquals = true
+              Variable      = "$.check"
             },
             {
-              "BooleanEquals": true,
-              "Variable": "$.continue"
+              BooleanEquals = true
+              Variable      = "$.continue"
             }
-          ],
-          "Next": "PkgCodeToS3"
+          ]
+          Next = "PkgCodeToS3"
         }
-      ],
-      "Default": "Done"
-    },
-    "PrepareParallelBody": {
-      "Type": "Pass",
-      "Parameters": {
-        "parallelArray.$": "$.parallel_folder_builds",
-        "original_body.$": "$.body"
-      },
-      "Next": "ParallelPkgCodeToS3"
-    },
-    "ParallelPkgCodeToS3": {
-      "Type": "Map",
-      "ItemsPath": "$.parallelArray",
-      "ResultPath": "$.parallelResults",
-      "MaxConcurrency": 0,
-      "Parameters": {
-        "iac_ci_folder.$": "$$.Map.Item.Value",
-        "report": true,
-        "body.$": "$.original_body",
-        "_id.$": "$$.Map.Item.Value"
-      },
-      "Iterator": {
-        "StartAt": "ChildPkgCodeToS3",
-        "States": {
-          "ChildPkgCodeToS3": {
-            "Type": "Task",
-            "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-pkgcode-to-s3",
-            "Next": "ChildChkPkgCodeToS3"
-          },
-          "ChildChkPkgCodeToS3": {
-            "Type": "Choice",
-            "Choices": [
-              {
-                "IsPresent": true,
-                "Variable": "$.failure_s3_key",
-                "Next": "Done_Child"
-              },
-              {
-                "BooleanEquals": true,
-                "Variable": "$.continue",
-                "Next": "ChildTriggerLambda"
-              }
-            ],
-            "Default": "Done_Child"
-          },
-          "ChildTriggerLambda": {
-            "Type": "Task",
-            "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-trigger-lambda",
-            "Next": "Done_Child"
-          },
-          "Done_Child": {
-            "Type": "Pass",
-            "End": true
-          }
+      ]
+      Default = "Done"
+    }
+    # the registered repo's settings item can cap the concurrency
+    # with parallel_max_concurrency - otherwise the stack default
+    ChkParallelConcurrency = {
+      Type = "Choice"
+      Choices = [
+        {
+          And = [
+            {
+              IsPresent = true
+              Variable  = "$.parallel_max_concurrency"
+            },
+            {
+              IsNumeric = true
+              Variable  = "$.parallel_max_concurrency"
+            }
+          ]
+          Next = "PrepareParallelBody"
         }
-      },
-      "Next": "EvaluatePrParent"
-    },
-    "EvaluatePrParent": {
-      "Type": "Task",
-      "Comment": "Send final PR update using original string body; set continue=true inside your Lambda if needed.",
-      "InputPath": "$.original_body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-update-pr",
-      "End": true
-    },
-    "PkgCodeToS3": {
-      "Type": "Task",
-      "InputPath": "$.body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-pkgcode-to-s3",
-      "Next": "ChkPkgCodeToS3"
-    },
-    "ChkPkgCodeToS3": {
-      "Type": "Choice",
-      "Choices": [
+      ]
+      Default = "SetParallelConcurrency"
+    }
+    SetParallelConcurrency = {
+      Type       = "Pass"
+      Result     = var.parallel_max_concurrency
+      ResultPath = "$.parallel_max_concurrency"
+      Next       = "PrepareParallelBody"
+    }
+    PrepareParallelBody = {
+      Type = "Pass"
+      Parameters = {
+        "parallelArray.$"            = "$.parallel_folder_builds"
+        "parallel_count.$"           = "States.ArrayLength($.parallel_folder_builds)"
+        "parallel_max_concurrency.$" = "$.parallel_max_concurrency"
+        "original_body.$"            = "$.body"
+      }
+      Next = local.distributed_enabled ? "ChkParallelMapMode" : "ParallelPkgCodeToS3"
+    }
+    ParallelPkgCodeToS3 = {
+      Type               = "Map"
+      ItemsPath          = "$.parallelArray"
+      ResultPath         = "$.parallelResults"
+      MaxConcurrencyPath = "$.parallel_max_concurrency"
+      Parameters         = local.parallel_item
+      Iterator = {
+        StartAt = "ChildPkgCodeToS3"
+        States  = local.parallel_child_states
+      }
+      Next = "EvaluatePrParent"
+    }
+    EvaluatePrParent = {
+      Type      = "Task"
+      Comment   = "Send final PR update using original string body; set continue=true inside your Lambda if needed."
+      InputPath = "$.original_body"
+      Resource  = local.lambda_arns[var.update_pr]
+      End       = true
+    }
+    PkgCodeToS3 = {
+      Type      = "Task"
+      InputPath = "$.body"
+      Resource  = local.lambda_arns[var.pkgcode_to_s3]
+      Next      = "ChkPkgCodeToS3"
+    }
+    ChkPkgCodeToS3 = {
+      Type = "Choice"
+      Choices = [
         {
-          "IsPresent": true,
-          "Variable": "$.failure_s3_key",
-          "Next": "EvaluatePr"
+          IsPresent = true
+          Variable  = "$.failure_s3_key"
+          Next      = "EvaluatePr"
         },
         {
-          "BooleanEquals": true,
-          "Variable": "$.continue",
-          "Next": "TriggerLambda"
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "TriggerLambda"
         }
-      ],
-      "Default": "Done"
-    },
-    "TriggerLambda": {
-      "Type": "Task",
-      "InputPath": "$.body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-trigger-lambda",
-      "Next": "ChkTriggerLambda"
-    },
-    "ChkTriggerLambda": {
-      "Type": "Choice",
-      "Choices": [
+      ]
+      Default = "Done"
+    }
+    TriggerLambda = {
+      Type      = "Task"
+      InputPath = "$.body"
+      Resource  = local.lambda_arns[var.trigger_lambda]
+      Next      = "ChkTriggerLambda"
+    }
+    ChkTriggerLambda = {
+      Type = "Choice"
+      Choices = [
         {
-          "BooleanEquals": true,
-          "Variable": "$.continue",
-          "Next": "EvaluatePr"
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "EvaluatePr"
         }
-      ],
-      "Default": "Done"
-    },
-    "EvaluatePr": {
-      "Type": "Task",
-      "InputPath": "$.body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-update-pr",
-      "End": true
-    },
-    "TriggerCodebuild": {
-      "Type": "Task",
-      "InputPath": "$.body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-trigger-codebuild",
-      "Next": "ChkTriggerCodebuild"
-    },
-    "ChkTriggerCodebuild": {
-      "Type": "Choice",
-      "Choices": [
+      ]
+      Default = "Done"
+    }
+    EvaluatePr = {
+      Type      = "Task"
+      InputPath = "$.body"
+      Resource  = local.lambda_arns[var.update_pr]
+      End       = true
+    }
+    Done = {
+      Type = "Pass"
+      End  = true
+    }
+  }
+
+  # each folder is packaged and its lambda triggered in a map branch
+  parallel_item = {
+    "iac_ci_folder.$" = "$$.Map.Item.Value"
+    report            = true
+    "body.$"          = "$.original_body"
+    "_id.$"           = "$$.Map.Item.Value"
+  }
+
+  parallel_child_states = {
+    ChildPkgCodeToS3 = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.pkgcode_to_s3]
+      Next     = "ChildChkPkgCodeToS3"
+    }
+    ChildChkPkgCodeToS3 = {
+      Type = "Choice"
+      Choices = [
         {
-          "BooleanEquals": true,
-          "Variable": "$.continue",
-          "Next": "WaitCodebuildCheck"
+          IsPresent = true
+          Variable  = "$.failure_s3_key"
+          Next      = "Done_Child"
+        },
+        {
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "ChildTriggerLambda"
         }
-      ],
-      "Default": "Done"
-    },
-    "WaitCodebuildCheck": {
-      "Type": "Wait",
-      "Comment": "Wait to Check CodeBuild completion",
-      "Seconds": 30,
-      "Next": "CheckCodebuild"
-    },
-    "CheckCodebuild": {
-      "Type": "Task",
-      "InputPath": "$.body",
-      "Resource": "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:iac-ci-check-codebuild",
-      "Next": "ChkCheckCodebuild"
-    },
-    "ChkCheckCodebuild": {
-      "Type": "Choice",
-      "Choices": [
+      ]
+      Default = "Done_Child"
+    }
+    ChildTriggerLambda = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.trigger_lambda]
+      Next     = "Done_Child"
+    }
+    Done_Child = {
+      Type = "Pass"
+      End  = true
+    }
+  }
+
+  # child workflow executions per folder, with the results written to
+  # s3 - the state only keeps the ResultWriterDetails so large folder
+  # sets stay below the 256 KB payload limit
+  distributed_states = {
+    ChkParallelMapMode = {
+      Type = "Choice"
+      Choices = [
         {
-          "BooleanEquals": true,
-          "Variable": "$.continue",
-          "Next": "CheckCodebuild"
+          NumericGreaterThanEquals = var.parallel_distributed_threshold
+          Variable                 = "$.parallel_count"
+          Next                     = "DistributedPkgCodeToS3"
         }
-      ],
-      "Default": "Done"
-    },
-    "Done": {
-      "Type": "Pass",
-      "End": true
+      ]
+      Default = "ParallelPkgCodeToS3"
+    }
+    DistributedPkgCodeToS3 = {
+      Type               = "Map"
+      ItemsPath          = "$.parallelArray"
+      ResultPath         = "$.parallelResults"
+      MaxConcurrencyPath = "$.parallel_max_concurrency"
+      ItemSelector       = local.parallel_item
+      ItemProcessor = {
+        ProcessorConfig = {
+          Mode          = "DISTRIBUTED"
+          ExecutionType = "STANDARD"
+        }
+        StartAt = "ChildPkgCodeToS3"
+        States  = local.parallel_child_states
+      }
+      ResultWriter = {
+        Resource = "arn:aws:states:::s3:putObject"
+        Parameters = {
+          Bucket = var.map_results_bucket
+          Prefix = "${var.map_results_prefix}/${var.step_function_name}"
+        }
+      }
+      Next = "EvaluatePrParent"
+    }
+  }
+
+  # polls check-codebuild until the build completes
+  poll_states = {
+    TriggerCodebuild = {
+      Type      = "Task"
+      InputPath = "$.body"
+      Resource  = local.lambda_arns[var.trigger_codebuild]
+      Next      = "ChkTriggerCodebuild"
+    }
+    ChkTriggerCodebuild = {
+      Type = "Choice"
+      Choices = [
+        {
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "WaitCodebuildCheck"
+        }
+      ]
+      Default = "Done"
+    }
+    WaitCodebuildCheck = {
+      Type    = "Wait"
+      Comment = "Wait to Check CodeBuild completion"
+      Seconds = 30
+      Next    = "CheckCodebuild"
+      Assign = {
+        check_count = 0
+      }
+    }
+    CheckCodebuild = {
+      Type      = "Task"
+      InputPath = "$.body"
+      Resource  = local.lambda_arns[var.check_codebuild]
+      Next      = "ChkCheckCodebuild"
+    }
+    ChkCheckCodebuild = {
+      Type = "Choice"
+      Choices = [
+        {
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "WaitCodebuildBackoff"
+        }
+      ]
+      Default = "Done"
+    }
+    # check-codebuild may suggest the next wait (next_wait_seconds) from
+    # the elapsed time and the project's build history.  Without a
+    # numeric suggestion the wait doubles from check_wait_min_seconds on
+    # every check.  Both are rounded and kept within the bounds.
+    WaitCodebuildBackoff = {
+      Type          = "Wait"
+      QueryLanguage = "JSONata"
+      Comment       = "Wait before the next check"
+      Seconds       = local.check_wait_seconds
+      Assign = {
+        check_count = "{% $check_count + 1 %}"
+      }
+      Next = "CheckCodebuild"
+    }
+  }
+
+  # trigger-codebuild receives {"body": ..., "task_token": ...} and stores the
+  # token against the build id; check-codebuild sends the task success with
+  # its check result when the build state change event arrives
+  task_token_states = {
+    TriggerCodebuild = {
+      Type     = "Task"
+      Resource = "arn:aws:states:::lambda:invoke.waitForTaskToken"
+      Parameters = {
+        FunctionName = local.lambda_arns[var.trigger_codebuild]
+        Payload = {
+          "body.$"       = "$.body"
+          "task_token.$" = "$$.Task.Token"
+        }
+      }
+      TimeoutSeconds = var.task_token_timeout_seconds
+      Next           = "Done"
+      Catch = [
+        {
+          ErrorEquals = ["States.Timeout"]
+          ResultPath  = "$.task_token_error"
+          Next        = "Done"
+        }
+      ]
     }
   }
 }
-EOF
+
+locals {
+  # task token states replace the polling states when enabled
+  definition_states = merge(concat(
+    [local.states],
+    [for states in [local.poll_states] : states if !local.task_token_enabled],
+    [for states in [local.task_token_states] : states if local.task_token_enabled],
+    [for states in [local.distributed_states] : states if local.distributed_enabled]
+  )...)
+
+  # EXPRESS only runs ProcessWebhook and hands everything after it to a
+  # STANDARD build tracking child, which can wait on builds for hours
+  express_enabled = var.workflow_type == "EXPRESS"
+
+  build_tracking_states = { for name, state in local.definition_states : name => state if name != "ProcessWebhook" }
+
+  express_states = {
+    ProcessWebhook = {
+      Type     = "Task"
+      Resource = local.lambda_arns[var.process_webhook]
+      Next     = "ChkStartBuildTracking"
+    }
+    ChkStartBuildTracking = {
+      Type = "Choice"
+      Choices = [
+        {
+          BooleanEquals = true
+          Variable      = "$.continue"
+          Next          = "StartBuildTracking"
+        }
+      ]
+      Default = "Done"
+    }
+    # fire and forget - the express execution ends once the child starts
+    StartBuildTracking = {
+      Type     = "Task"
+      Resource = "arn:aws:states:::states:startExecution"
+      Parameters = {
+        StateMachineArn = one(aws_sfn_state_machine.build_tracking[*].arn)
+        "Input.$"       = "$"
+      }
+      End = true
+    }
+    Done = {
+      Type = "Pass"
+      End  = true
+    }
+  }
+}
+
+resource "aws_sfn_state_machine" "sfn_state_machine" {
+  name     = var.step_function_name
+  role_arn = aws_iam_role.default.arn
+  type     = var.workflow_type
+  tags     = var.cloud_tags
+
+  lifecycle {
+    # parked executions are only resumed by lambdas that handle task tokens
+    precondition {
+      condition     = !local.task_token_enabled || var.task_token_lambda_support
+      error_message = "codebuild_wait task_token requires task_token_lambda_support - trigger-codebuild and check-codebuild need to handle task tokens"
+    }
+  }
+
+  definition = jsonencode({
+    Comment = "Processes webhook, executes CodeBuild, supports optional parallel folder builds when report && parallel_folder_builds. No parsing of $.body."
+    StartAt = "ProcessWebhook"
+    States = merge(concat(
+      [for states in [local.definition_states] : states if !local.express_enabled],
+      [for states in [local.express_states] : states if local.express_enabled]
+    )...)
+  })
+}
+
+resource "aws_sfn_state_machine" "build_tracking" {
+  count = local.express_enabled ? 1 : 0
+
+  name     = "${var.step_function_name}-build"
+  role_arn = aws_iam_role.default.arn
+  type     = "STANDARD"
+  tags     = var.cloud_tags
+
+  definition = jsonencode({
+    Comment = "Started by the express webhook state machine - executes CodeBuild and the folder builds"
+    StartAt = "ChkProcessWebhook"
+    States  = local.build_tracking_states
+  })
 }
 
 ####FILE####:::data.tf
@@ -246,6 +475,16 @@ output "arn" {
   value       = aws_sfn_state_machine.sfn_state_machine.arn
 }
 
+output "build_tracking_arn" {
+  description = "ARN of the STANDARD build tracking state machine - empty unless workflow_type is EXPRESS"
+  value       = local.express_enabled ? aws_sfn_state_machine.build_tracking[0].arn : ""
+}
+
+output "codebuild_state_change_dashboard" {
+  description = "Dashboard comparing forwarded and filtered CodeBuild state changes - empty without a project prefix"
+  value       = local.codebuild_project_filtered ? aws_cloudwatch_dashboard.codebuild_state_change[0].dashboard_name : ""
+}
+
 ####FILE####:::variables.tf
 variable "aws_default_region" {
   description = "AWS region where resources will be deployed"
@@ -301,6 +540,88 @@ variable "trigger_codebuild" {
   default     = "trigger-codebuild"
 }
 
+variable "lambda_aliases_hash" {
+  description = "Base64 encoded JSON map of lambda function name suffix to the alias the state machine invokes - unlisted functions are invoked unqualified"
+  type        = string
+  default     = ""
+}
+
+variable "codebuild_wait" {
+  description = "How the state machine waits on the build - poll (check-codebuild loop) or task_token (resumed by the build state change event)"
+  type        = string
+  default     = "poll"
+
+  validation {
+    condition     = contains(["poll", "task_token"], var.codebuild_wait)
+    error_message = "codebuild_wait needs to be poll or task_token"
+  }
+}
+
+variable "check_wait_min_seconds" {
+  description = "First and lowest wait between checks"
+  type        = number
+  default     = 10
+}
+
+variable "check_wait_max_seconds" {
+  description = "Highest wait between checks"
+  type        = number
+  default     = 120
+}
+
+variable "task_token_lambda_support" {
+  description = "Confirms the deployed trigger-codebuild and check-codebuild handle task tokens - required by codebuild_wait task_token"
+  type        = bool
+  default     = false
+}
+
+variable "task_token_timeout_seconds" {
+  description = "Seconds an execution waits on the build's task token before it ends"
+  type        = number
+  default     = 28800
+}
+
+variable "workflow_type" {
+  description = "STANDARD, or EXPRESS to process webhooks in an express workflow that starts a STANDARD build tracking child"
+  type        = string
+  default     = "STANDARD"
+
+  validation {
+    condition     = contains(["STANDARD", "EXPRESS"], var.workflow_type)
+    error_message = "workflow_type needs to be STANDARD or EXPRESS"
+  }
+}
+
+variable "parallel_max_concurrency" {
+  description = "Folder builds run at once when the registered repo's settings item has no parallel_max_concurrency - 0 is unlimited"
+  type        = number
+  default     = 10
+}
+
+variable "parallel_distributed_threshold" {
+  description = "Folder count from which folder builds run in a distributed map - 0 disables the distributed map"
+  type        = number
+  default     = 100
+}
+
+variable "map_results_bucket" {
+  description = "S3 bucket the distributed map writes its results to - empty disables the distributed map"
+  type        = string
+  default     = ""
+}
+
+variable "map_results_prefix" {
+  description = "S3 key prefix of the distributed map results"
+  type        = string
+  default     = "map-results"
+}
+
+variable "codebuild_project_prefix" {
+  description = "Comma separated CodeBuild project name prefixes the state change rule forwards - empty forwards every project"
+  type        = string
+  default     = ""
+}
+
 variable "cloud_tags" {
   description = "Additional tags to apply to all resources"
   type        = map(string)
@@ -383,62 +704,203 @@ resource "aws_iam_role" "default" {
   tags = var.cloud_tags
 }
 
+locals {
+  # a distributed map starts child executions of its own state machine
+  # and writes the results to map_results_bucket
+  distributed_map_statements = [
+    {
+      Action = [
+        "states:StartExecution"
+      ]
+      Effect = "Allow"
+      Resource = [
+        "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:stateMachine:${var.step_function_name}",
+        "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:stateMachine:${var.step_function_name}-build"
+      ]
+    },
+    {
+      Action = [
+        "states:DescribeExecution",
+        "states:StopExecution"
+      ]
+      Effect = "Allow"
+      Resource = [
+        "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:execution:${var.step_function_name}/*",
+        "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:execution:${var.step_function_name}-build/*"
+      ]
+    },
+    {
+      Action = [
+        "s3:PutObject",
+        "s3:GetObject",
+        "s3:ListMultipartUploadParts",
+        "s3:AbortMultipartUpload"
+      ]
+      Effect = "Allow"
+      Resource = [
+        "arn:aws:s3:::${var.map_results_bucket}/${var.map_results_prefix}/*"
+      ]
+    }
+  ]
+}
+
 resource "aws_iam_role_policy" "step_function_policy" {
   name = "${var.step_function_name}-policy"
   role = aws_iam_role.default.id
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Action = [
           "lambda:InvokeFunction"
         ]
         Effect = "Allow"
+        # unqualified and through an alias
+        Resource = concat(
+          values(local.lambda_function_arns),
+          [for arn in values(local.lambda_function_arns) : "${arn}:*"]
+        )
+      },
+      {
+        # EXPRESS webhook processing starts the build tracking child
+        Action = [
+          "states:StartExecution"
+        ]
+        Effect = "Allow"
         Resource = [
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.process_webhook}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.pkgcode_to_s3}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.trigger_codebuild}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.trigger_lambda}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.update_pr}",
-          "arn:aws:lambda:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:function:${var.app_name}-${var.check_codebuild}"
+          "arn:aws:states:${var.aws_default_region}:${data.aws_caller_identity.current.account_id}:stateMachine:${var.step_function_name}-build"
         ]
       }
-    ]
+    ], [for statement in local.distributed_map_statements : statement if local.distributed_enabled])
   })
 }
 
 ####FILE####:::cloudwatch.tf
+locals {
+  # the build state change event carries the project name but not its
+  # tags, so projects are scoped by name prefix
+  codebuild_project_prefixes = compact([for prefix in split(",", var.codebuild_project_prefix) : trimspace(prefix)])
+  codebuild_project_filtered = length(local.codebuild_project_prefixes) > 0
+
+  codebuild_state_change_detail = {
+    build-status = ["SUCCEEDED", "FAILED", "STOPPED", "TIMED_OUT"]
+  }
+}
+
 # EventBridge rule to capture CodeBuild state changes
 resource "aws_cloudwatch_event_rule" "codebuild_state_change" {
   name        = "${var.app_name}-codebuild-state-change"
-  description = "Captures CodeBuild state changes and triggers Step Function"
+  description = local.task_token_enabled ? "Captures CodeBuild state changes and resumes the waiting Step Function execution" : "Captures CodeBuild state changes and triggers Step Function"
 
   event_pattern = jsonencode({
     source      = ["aws.codebuild"]
     detail-type = ["CodeBuild Build State Change"]
-    detail = {
-      build-status = ["SUCCEEDED", "FAILED", "STOPPED", "TIMED_OUT"]
-    }
+    detail = merge(
+      local.codebuild_state_change_detail,
+      { for key, value in { project-name = [for prefix in local.codebuild_project_prefixes : { prefix = prefix }] } : key => value if local.codebuild_project_filtered }
+    )
   })
 }
 
-# EventBridge target to invoke Step Function
-resource "aws_cloudwatch_event_target" "invoke_step_function" {
-  rule     = aws_cloudwatch_event_rule.codebuild_state_change.name
-  arn      = aws_sfn_state_machine.sfn_state_machine.arn
-  role_arn = aws_iam_role.eventbridge_sfn_role.arn
+# Unfiltered rule - only counted so filtered vs forwarded events can be
+# compared on the dashboard below
+resource "aws_cloudwatch_event_rule" "codebuild_state_change_all" {
+  count = local.codebuild_project_filtered ? 1 : 0
 
-  # Format the event data for the Step Function
-  input_transformer {
-    input_paths = {
-      buildStatus = "$.detail.build-status",
-      buildId     = "$.detail.build-id",
-      projectName = "$.detail.project-name",
-      region      = "$.region",
-      account     = "$.account"
-    }
-    input_template = <<EOF
+  name        = "${var.app_name}-codebuild-state-change-all"
+  description = "Counts CodeBuild state changes before the project name filter"
+
+  event_pattern = jsonencode({
+    source      = ["aws.codebuild"]
+    detail-type = ["CodeBuild Build State Change"]
+    detail      = local.codebuild_state_change_detail
+  })
+}
+
+# EventBridge only reports MatchedEvents for rules with a target, so the
+# unfiltered rule logs its events to a log group kept for a day
+resource "aws_cloudwatch_log_group" "codebuild_state_change_all" {
+  count = local.codebuild_project_filtered ? 1 : 0
+
+  name              = "/aws/events/${var.app_name}-codebuild-state-change-all"
+  retention_in_days = 1
+  tags              = var.cloud_tags
+}
+
+resource "aws_cloudwatch_log_resource_policy" "codebuild_state_change_all" {
+  count = local.codebuild_project_filtered ? 1 : 0
+
+  policy_name = "${var.app_name}-codebuild-state-change-all"
+
+  policy_document = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Principal = {
+          Service = ["events.amazonaws.com", "delivery.logs.amazonaws.com"]
+        }
+        Action = [
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "${aws_cloudwatch_log_group.codebuild_state_change_all[0].arn}:*"
+      }
+    ]
+  })
+}
+
+resource "aws_cloudwatch_event_target" "codebuild_state_change_all" {
+  count = local.codebuild_project_filtered ? 1 : 0
+
+  rule = aws_cloudwatch_event_rule.codebuild_state_change_all[0].name
+  arn  = aws_cloudwatch_log_group.codebuild_state_change_all[0].arn
+
+  depends_on = [aws_cloudwatch_log_resource_policy.codebuild_state_change_all]
+}
+
+resource "aws_cloudwatch_dashboard" "codebuild_state_change" {
+  count = local.codebuild_project_filtered ? 1 : 0
+
+  dashboard_name = "${var.app_name}-codebuild-state-change"
+
+  dashboard_body = jsonencode({
+    widgets = [
+      {
+        type   = "metric"
+        x      = 0
+        y      = 0
+        width  = 12
+        height = 6
+        properties = {
+          title  = "CodeBuild state changes - forwarded vs filtered"
+          region = var.aws_default_region
+          stat   = "Sum"
+          period = 3600
+          view   = "timeSeries"
+          metrics = [
+            ["AWS/Events", "MatchedEvents", "RuleName", aws_cloudwatch_event_rule.codebuild_state_change.name, { id = "forwarded", label = "forwarded" }],
+            ["AWS/Events", "MatchedEvents", "RuleName", aws_cloudwatch_event_rule.codebuild_state_change_all[0].name, { id = "all", visible = false }],
+            [{ expression = "all - forwarded", id = "filtered", label = "filtered" }]
+          ]
+        }
+      }
+    ]
+  })
+}
+
+# Format the event data for the Step Function or check-codebuild
+locals {
+  codebuild_state_change_input_paths = {
+    buildStatus = "$.detail.build-status",
+    buildId     = "$.detail.build-id",
+    projectName = "$.detail.project-name",
+    region      = "$.region",
+    account     = "$.account"
+  }
+
+  codebuild_state_change_input_template = <<EOF
 {
   "body": {
     "buildStatus": <buildStatus>,
@@ -451,11 +913,51 @@ resource "aws_cloudwatch_event_target" "invoke_step_function" {
   }
 }
 EOF
+}
+
+# EventBridge target to invoke Step Function
+resource "aws_cloudwatch_event_target" "invoke_step_function" {
+  count = local.task_token_enabled ? 0 : 1
+
+  rule     = aws_cloudwatch_event_rule.codebuild_state_change.name
+  arn      = aws_sfn_state_machine.sfn_state_machine.arn
+  role_arn = aws_iam_role.eventbridge_sfn_role[0].arn
+
+  input_transformer {
+    input_paths    = local.codebuild_state_change_input_paths
+    input_template = local.codebuild_state_change_input_template
   }
 }
 
+# EventBridge target to invoke check-codebuild, which resumes the
+# execution waiting on the build's task token
+resource "aws_cloudwatch_event_target" "resume_step_function" {
+  count = local.task_token_enabled ? 1 : 0
+
+  rule = aws_cloudwatch_event_rule.codebuild_state_change.name
+  arn  = local.lambda_arns[var.check_codebuild]
+
+  input_transformer {
+    input_paths    = local.codebuild_state_change_input_paths
+    input_template = local.codebuild_state_change_input_template
+  }
+}
+
+resource "aws_lambda_permission" "resume_step_function" {
+  count = local.task_token_enabled ? 1 : 0
+
+  statement_id  = "${var.app_name}-codebuild-state-change"
+  action        = "lambda:InvokeFunction"
+  function_name = "${var.app_name}-${var.check_codebuild}"
+  qualifier     = lookup(local.lambda_aliases, var.check_codebuild, null)
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.codebuild_state_change.arn
+}
+
 # IAM role for EventBridge to invoke Step Function
 resource "aws_iam_role" "eventbridge_sfn_role" {
+  count = local.task_token_enabled ? 0 : 1
+
   name = "${var.app_name}-eventbridge-sfn-role"
 
   assume_role_policy = jsonencode({
@@ -476,8 +978,10 @@ resource "aws_iam_role" "eventbridge_sfn_role" {
 
 # IAM policy to allow EventBridge to invoke Step Function
 resource "aws_iam_role_policy" "eventbridge_sfn_policy" {
+  count = local.task_token_enabled ? 0 : 1
+
   name = "${var.app_name}-eventbridge-sfn-policy"
-  role = aws_iam_role.eventbridge_sfn_role.id
+  role = aws_iam_role.eventbridge_sfn_role[0].id
 
   policy = jsonencode({
     Version = "2012-10-17"
@@ -490,3 +994,18 @@ resource "aws_iam_role_policy" "eventbridge_sfn_policy" {
     ]
   })
 }
+
+moved {
+  from = aws_cloudwatch_event_target.invoke_step_function
+  to   = aws_cloudwatch_event_target.invoke_step_function[0]
+}
+
+moved {
+  from = aws_iam_role.eventbridge_sfn_role
+  to   = aws_iam_role.eventbridge_sfn_role[0]
+}
+
+moved {
+  from = aws_iam_role_policy.eventbridge_sfn_policy
+  to   = aws_iam_role_policy.eventbridge_sfn_policy[0]
+}
@@ -15,8 +15,75 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import hashlib
+import json
+
+
+class _DryRunResource(dict):
+    """
+    Stand-in for a resource that does not exist yet during a dry run.
+    Missing keys render as a placeholder instead of raising.
+    """
+
+    def __init__(self, resource_type, name):
+        dict.__init__(self)
+        self.resource_type = resource_type
+        self.name = name
+
+    def __missing__(self, key):
+        return f"<{self.resource_type}:{self.name}:{key}>"
+
+
 class Main(newSchedStack):
 
+    CACHE_TYPES = ["NO_CACHE", "S3", "LOCAL"]
+
+    CACHE_MODES = [
+        "LOCAL_DOCKER_LAYER_CACHE",
+        "LOCAL_SOURCE_CACHE"
+    ]
+
+    # resources created by this stack - an entry of lookup_cache_hash
+    # can be older than them, so they are always looked up
+    LOOKUP_CACHE_EXCLUDED = [
+        "ecr_repo",
+        "ssh_key_pair",
+        "config0_token"
+    ]
+
+    # record of the onboard_id a commit job confirmed (see
+    # add_codebuild_ci_bulk)
+    ONBOARD_RESOURCE_TYPE = "codebuild_ci_onboard"
+
+    # seconds between the retries of a scheduled job
+    DEFAULT_TIMEWAIT = 120
+
+    # fingerprints of inserts that succeeded, and of inserts submitted
+    # by a run that has not been confirmed yet
+    INSERT_RESOURCE_TYPE = "insert_fingerprint"
+
+    PENDING_RESOURCE_TYPE = "insert_fingerprint_pending"
+
+    # timeout of the commit_<job> jobs added by _add_commit_jobs
+    COMMIT_JOB_TIMEOUT = 600
+
+    # content hash on the CI settings items - the same string attribute
+    # is written by aws_dynamodb_upsert and codebuild_compute_autosize,
+    # which use it as their write condition
+    SETTINGS_VERSION_ATTRIBUTE = "settings_version"
+
+    SUBSTACKS = {
+        "aws_ecr_repo": 'config0-hub:::aws_storage::aws_ecr_repo',
+        "aws_s3_buckets": 'config0-hub:::devops-solutions::aws_s3_buckets',
+        "new_github_ssh_key": 'config0-hub:::github::new_github_ssh_key',
+        "dynamodb": 'config0-hub:::aws_storage::aws_dynamodb_item',
+        "aws_dynamodb_upsert": 'config0-hub:::devops-solutions::aws_dynamodb_upsert',
+        "aws_ssm_params": 'config0-hub:::devops-solutions::aws_ssm_params',
+        "aws_codebuild": 'config0-hub:::aws::aws_codebuild',
+        "aws_codebuild_cache": 'config0-hub:::devops-solutions::aws_codebuild_cache',
+        "github_webhook": 'config0-hub:::github::github_webhook'
+    }
+
     def __init__(self, stackargs):
 
         newSchedStack.__init__(self, stackargs)
@@ -80,6 +147,17 @@ class Main(newSchedStack):
                                 types="str",
                                 default="BUILD_GENERAL1_SMALL")
 
+        # NO_CACHE, S3 (uses the cache bucket) or LOCAL - set on the
+        # project by aws_codebuild_cache, otherwise the project keeps
+        # the cache aws_codebuild gives it
+        self.parse.add_optional(key="cache_type",
+                                types="str")
+
+        # comma separated local cache modes when cache_type is LOCAL
+        # e.g. LOCAL_DOCKER_LAYER_CACHE,LOCAL_SOURCE_CACHE
+        self.parse.add_optional(key="cache_modes",
+                                types="str")
+
         self.parse.add_optional(key="secret",
                                 types="str",
                                 default="_random")
@@ -113,6 +191,12 @@ class Main(newSchedStack):
                                 types="int",
                                 default="1")
 
+        # import the buckets created before by the per bucket
+        # aws_s3_bucket substack
+        self.parse.add_optional(key="import_existing_buckets",
+                                types="bool",
+                                default="true")
+
         self.parse.add_optional(key="subnet_ids",
                                 default="null")
 
@@ -128,20 +212,155 @@ class Main(newSchedStack):
                                 types="str",
                                 default="us-east-1")
 
+        # insert substacks even when their arguments are unchanged
+        self.parse.add_optional(key="force",
+                                types="bool",
+                                default="false")
+
+        # put replaces the settings item, upsert only writes changed attributes
+        self.parse.add_optional(key="settings_write_mode",
+                                types="str",
+                                default="put")
+
+        # evaluate the jobs in-process and render the inserts
+        # without executing any substack
+        self.parse.add_optional(key="dry_run",
+                                types="bool",
+                                default="false")
+
+        # id of the arguments the repo is onboarded with - set by
+        # add_codebuild_ci_bulk and recorded by the commit jobs
+        self.parse.add_optional(key="onboard_id",
+                                types="str")
+
+        # base64 encoded list of lookups resolved by the caller (see
+        # add_codebuild_ci_bulk) that every job reuses instead of
+        # going back to the config0 resource db
+        self.parse.add_optional(key="lookup_cache_hash",
+                                types="str")
+
+        # seconds a lookup of lookup_cache_hash is reused after it was resolved
+        self.parse.add_optional(key="lookup_cache_ttl",
+                                types="int",
+                                default="3600")
+
         # Add substack
-        self.stack.add_substack('config0-hub:::aws_storage::aws_ecr_repo')
-        self.stack.add_substack('config0-hub:::aws_storage::aws_s3_bucket')
-        self.stack.add_substack('config0-hub:::github::new_github_ssh_key')
-        self.stack.add_substack('config0-hub:::aws_storage::aws_dynamodb_item', 'dynamodb')
-        self.stack.add_substack('config0-hub:::aws_storage::aws_ssm_param')
-        self.stack.add_substack('config0-hub:::aws::aws_codebuild')
-        self.stack.add_substack('config0-hub:::github::github_webhook')
+        for substack_name, substack in self.SUBSTACKS.items():
+            self.stack.add_substack(substack, substack_name)
 
         self.stack.init_substacks()
 
+        self._dry_run_plan = []
+        self._dry_run_job = None
+
+        self._lookup_cache = None
+        self._lookup_stats = {"hits": 0, "misses": 0}
+
     def _setup_vars(self):
         self.stack.init_variables()
 
+        # a dry run never handles the real webhook secret
+        if self._is_dry_run():
+            self.stack.set_variable("secret",
+                                    self._get_dry_run_placeholder("secret"),
+                                    types="str")
+
+    @staticmethod
+    def _get_dry_run_placeholder(name):
+        return f"<dry_run:{name}>"
+
+    def _is_dry_run(self):
+        return self.stack.get_attr("dry_run") in ["True", True, "true"]
+
+    @staticmethod
+    def _get_lookup_key(resource_type, provider, name):
+        return f"{resource_type}:{provider}:{name}"
+
+    def _get_lookup_cache(self):
+        """
+        Lookups passed in with lookup_cache_hash, keyed by
+        _get_lookup_key.  Entries older than lookup_cache_ttl and
+        entries for LOOKUP_CACHE_EXCLUDED resources are dropped.
+
+        Returns:
+            dict: Lookup key to resource
+        """
+        import time
+
+        if self._lookup_cache is not None:
+            return self._lookup_cache
+
+        self._lookup_cache = {}
+
+        if not self.stack.get_attr("lookup_cache_hash"):
+            return self._lookup_cache
+
+        try:
+            entries = self.stack.b64_decode(self.stack.lookup_cache_hash)
+        except Exception as e:
+            raise Exception(f"lookup_cache_hash is not a base64 encoded list - {e}")
+
+        expire_before = time.time() - int(self.stack.lookup_cache_ttl)
+
+        for entry in entries or []:
+            if entry.get("resource_type") in self.LOOKUP_CACHE_EXCLUDED:
+                continue
+
+            if float(entry.get("fetched_at") or 0) < expire_before:
+                continue
+
+            _key = self._get_lookup_key(entry["resource_type"], entry["provider"], entry["name"])
+            self._lookup_cache[_key] = entry["resource"]
+
+        return self._lookup_cache
+
+    def _get_cached_resource(self, **kwargs):
+        """
+        Resource of the lookup from lookup_cache_hash.  Decrypted
+        lookups are never cached.
+
+        Returns:
+            dict: The cached resource, or None on a miss
+        """
+        if kwargs.get("decrypt"):
+            return
+
+        _key = self._get_lookup_key(kwargs.get("resource_type"),
+                                    kwargs.get("provider"),
+                                    kwargs.get("name"))
+
+        resource = self._get_lookup_cache().get(_key)
+        self._lookup_stats["hits" if resource else "misses"] += 1
+
+        self.stack.logger.debug(f'lookup cache {"hit" if resource else "miss"} for "{_key}" '
+                                f'(hits={self._lookup_stats["hits"]} misses={self._lookup_stats["misses"]})')
+
+        return resource
+
+    def _get_resource(self, **kwargs):
+        """
+        Look up a resource through the lookup cache (see
+        _get_cached_resource) or the config0 resource db.  In a dry
+        run, resources created by earlier jobs do not exist and are
+        replaced with placeholders.
+        """
+        cached = self._get_cached_resource(**kwargs)
+
+        if cached:
+            return [cached]
+
+        try:
+            results = self.stack.get_resource(**kwargs)
+        except Exception:
+            if not self._is_dry_run():
+                raise
+            results = None
+
+        if not results and self._is_dry_run():
+            results = [_DryRunResource(kwargs.get("resource_type"), kwargs.get("name"))]
+
+        return results
+
     def _determine_suffix_id(self):
         """
         Determine the suffix ID for resource naming.
@@ -174,7 +393,7 @@ class Main(newSchedStack):
                   "provider": "aws",
                   "name": apigateway_name}
 
-        results = self.stack.get_resource(**_lookup)[0]
+        results = self._get_resource(**_lookup)[0]
 
         return os.path.join(str(results["base_url"]), str(self.stack.trigger_id))
 
@@ -190,12 +409,16 @@ class Main(newSchedStack):
         """
         key_name = f"{self.stack.codebuild_name}-codebuild-deploy-key"
 
+        # the private key is not looked up and decrypted in a dry run
+        if self._is_dry_run():
+            return self._get_dry_run_placeholder(f"{key_name}:private_key")
+
         _lookup = {"must_be_one": True,
                   "resource_type": "ssh_key_pair",
                   "provider": "config0",
                   "name": key_name}
 
-        results = self.stack.get_resource(decrypt=True, **_lookup)[0]
+        results = self._get_resource(decrypt=True, **_lookup)[0]
 
         return self.stack.b64_encode(results["private_key"])
 
@@ -212,10 +435,10 @@ class Main(newSchedStack):
         if not self.stack.get_attr("ecr_repo_name"):
             return
 
-        return self.stack.get_resource(name=self.stack.ecr_repo_name,
-                                      resource_type="ecr_repo",
-                                      provider="aws",
-                                      must_exists=True)[0]["repository_uri"]
+        return self._get_resource(name=self.stack.ecr_repo_name,
+                                  resource_type="ecr_repo",
+                                  provider="aws",
+                                  must_exists=True)[0]["repository_uri"]
 
     def _set_codebuild_buckets(self):
         """
@@ -261,7 +484,7 @@ class Main(newSchedStack):
                     "automation_phase": "continuous_delivery",
                     "human_description": human_description}
 
-        return self.stack.github_webhook.insert(display=True, **inputargs)
+        return self._insert("github_webhook", **inputargs)
 
     def run_setup(self):
         """
@@ -314,7 +537,11 @@ class Main(newSchedStack):
                     "automation_phase": "continuous_delivery",
                     "human_description": human_description}
 
-        self.stack.aws_ecr_repo.insert(display=True, **inputargs)
+        self._insert("aws_ecr_repo",
+                     state_lookup={"resource_type": "ecr_repo",
+                                   "provider": "aws",
+                                   "name": self.stack.ecr_repo_name},
+                     **inputargs)
 
     def _s3(self):
         if "_" in self.stack.get_attr("codebuild_name"):
@@ -323,43 +550,38 @@ class Main(newSchedStack):
 
         self._set_codebuild_buckets()
 
-        arguments = {
-            "bucket": self.s3_bucket_cache,
-            "acl": self.stack.bucket_acl,
-            "expire_days": self.stack.bucket_expire_days,
-            "force_destroy": "true",
-            "enable_lifecycle": "true",
-            "aws_default_region": self.stack.aws_default_region
-        }
-
-        if self.stack.get_attr("cloud_tags_hash"):
-            arguments["cloud_tags_hash"] = self.stack.cloud_tags_hash
-
-        human_description = f'Create s3 bucket "{self.s3_bucket_cache}" cache'
-        inputargs = {"arguments": arguments,
-                    "automation_phase": "continuous_delivery",
-                    "human_description": human_description}
+        bucket_specs = []
 
-        self.stack.aws_s3_bucket.insert(display=True, **inputargs)
+        for s3_bucket in [self.s3_bucket_cache, self.s3_bucket_output]:
+            bucket_specs.append({
+                "bucket": s3_bucket,
+                "acl": self.stack.bucket_acl,
+                "expire_days": self.stack.bucket_expire_days,
+                "force_destroy": "true",
+                "enable_lifecycle": "true"
+            })
 
+        # cache and output buckets are provisioned in one execution
         arguments = {
-            "bucket": self.s3_bucket_output,
-            "acl": self.stack.bucket_acl,
-            "expire_days": self.stack.bucket_expire_days,
-            "force_destroy": "true",
-            "enable_lifecycle": "true",
+            "buckets_name": f"{self.stack.codebuild_name}-codebuild-{self._determine_suffix_id()}",
+            "buckets_hash": self.stack.b64_encode(bucket_specs),
+            "import_existing": self.stack.import_existing_buckets,
             "aws_default_region": self.stack.aws_default_region
         }
 
         if self.stack.get_attr("cloud_tags_hash"):
             arguments["cloud_tags_hash"] = self.stack.cloud_tags_hash
 
-        human_description = f'Create s3 bucket "{self.s3_bucket_output}" output'
+        human_description = f'Create s3 buckets "{self.s3_bucket_cache}" cache and "{self.s3_bucket_output}" output'
         inputargs = {"arguments": arguments,
                     "automation_phase": "continuous_delivery",
                     "human_description": human_description}
 
-        return self.stack.aws_s3_bucket.insert(display=True, **inputargs)
+        return self._insert("aws_s3_buckets",
+                            state_lookup={"resource_type": "s3_buckets",
+                                          "provider": "aws",
+                                          "name": arguments["buckets_name"]},
+                            **inputargs)
 
     def _sshdeploy(self):
         key_name = f"{self.stack.codebuild_name}-codebuild-deploy-key"
@@ -375,8 +597,11 @@ class Main(newSchedStack):
                     "automation_phase": "continuous_delivery",
                     "human_description": human_description}
 
-        return self.stack.new_github_ssh_key.insert(display=True,
-                                                   **inputargs)
+        return self._insert("new_github_ssh_key",
+                            state_lookup={"resource_type": "ssh_key_pair",
+                                          "provider": "config0",
+                                          "name": key_name},
+                            **inputargs)
 
     def _set_github_token(self):
         if self.stack.inputvars.get("github_token"):
@@ -428,6 +653,17 @@ class Main(newSchedStack):
                                 tags="tf_sensitive",
                                 types="str")
 
+        if not self._is_dry_run():
+            return
+
+        # tokens passed in are replaced before anything renders them
+        for _key in ["github_token", "docker_token", "slack_webhook_hash"]:
+            if self.stack.get_attr(_key):
+                self.stack.set_variable(_key,
+                                        self._get_dry_run_placeholder(_key),
+                                        tags="tf_sensitive",
+                                        types="str")
+
     def run_ssm(self):
         """
         Configure AWS Systems Manager (SSM) parameters.
@@ -445,73 +681,90 @@ class Main(newSchedStack):
         self.stack.verify_variables()
         self._eval_inputvars()
         self._set_ssm_keys()
-        self.stack.set_parallel()
 
-        # add config0 token
-        arguments = {
-            "ssm_key": self.stack.ssm_callback_token,
-            "ssm_value": self._get_token(),
-            "aws_default_region": self.stack.aws_default_region
+        ssm_params = {
+            self.stack.ssm_callback_token: self._get_token(),
+            self.stack.ssm_ssh_key: self._get_ssh_private_key()
         }
 
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Config0 callback token to ssm"
-        }
+        if self.stack.get_attr("docker_token"):
+            ssm_params[self.stack.ssm_docker_token] = self.stack.docker_token
 
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
-  
-        # add ssh key
+        if self.stack.get_attr("slack_webhook_hash"):
+            ssm_params[self.stack.ssm_slack_webhook_hash] = self.stack.slack_webhook_hash
+
+        # all parameters are written in one execution
         arguments = {
-            "ssm_key": self.stack.ssm_ssh_key,
-            "ssm_value": self._get_ssh_private_key(),
+            "ssm_name": f"{self.stack.codebuild_name}-codebuild-ssm",
+            "ssm_params_hash": self.stack.b64_encode(ssm_params),
             "aws_default_region": self.stack.aws_default_region
         }
 
         inputargs = {
             "arguments": arguments,
             "automation_phase": "continuous_delivery",
-            "human_description": "Upload private ssh key to ssm"
+            "human_description": "Upload callback token, ssh key and credentials to ssm"
         }
 
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
+        self._insert("aws_ssm_params",
+                     state_lookup={"resource_type": "ssm_parameters",
+                                   "provider": "aws",
+                                   "name": arguments["ssm_name"]},
+                     **inputargs)
 
-        if self.stack.get_attr("docker_token"):
-            arguments = {
-                "ssm_key": self.stack.ssm_docker_token,
-                "ssm_value": self.stack.docker_token,
-                "aws_default_region": self.stack.aws_default_region
-            }
+        return True
 
-            inputargs = {
-                "arguments": arguments,
-                "automation_phase": "continuous_delivery",
-                "human_description": "Upload docker token to ssm"
-            }
+    def _get_s3_bucket(self):
+        suffix_id = self._determine_suffix_id()
+        return f"ci-shared-{self.stack.ci_environment}-{suffix_id}"
 
-            self.stack.aws_ssm_param.insert(display=True, **inputargs)
+    def _get_compute_autosize(self):
+        """
+        Outputs of codebuild_compute_autosize for this project, so a re-run
+        does not overwrite what the autosizing wrote to the settings item.
 
-        if self.stack.get_attr("slack_webhook_hash"):
-            arguments = {
-                "ssm_key": self.stack.ssm_slack_webhook_hash,
-                "ssm_value": self.stack.slack_webhook_hash,
-                "aws_default_region": self.stack.aws_default_region
-            }
+        Returns:
+            dict: The autosize resource, or None without one
+        """
+        for name in [self.stack.codebuild_name, self.stack.trigger_id]:
+            try:
+                resources = self.stack.get_resource(resource_type="codebuild_compute_autosize",
+                                                    provider="aws",
+                                                    name=f"{name}-compute-autosize")
+            except Exception:
+                resources = None
+
+            if resources:
+                return resources[0]
+
+    def _set_compute_items(self, item):
+        """
+        Set compute_type on the settings item, keeping the recommendation
+        of codebuild_compute_autosize and the compute type it applied.
 
-            inputargs = {
-                "arguments": arguments,
-                "automation_phase": "continuous_delivery",
-                "human_description": "Upload slack webhook url to ssm"
-            }
+        Args:
+            item (dict): DynamoDB item to update
+        """
+        item["compute_type"] = {"S": str(self.stack.compute_type)}
 
-            self.stack.aws_ssm_param.insert(display=True, **inputargs)
+        autosize = self._get_compute_autosize()
 
-        return True
+        if not autosize or not autosize.get("compute_type_recommended"):
+            return
 
-    def _get_s3_bucket(self):
-        suffix_id = self._determine_suffix_id()
-        return f"ci-shared-{self.stack.ci_environment}-{suffix_id}"
+        item["compute_type_recommended"] = {"S": str(autosize["compute_type_recommended"])}
+
+        if autosize.get("compute_type_reason"):
+            item["compute_type_reason"] = {"S": str(autosize["compute_type_reason"])}
+
+        if autosize.get("mode") != "apply":
+            return
+
+        if str(self.stack.compute_type) != autosize["compute_type_recommended"]:
+            self.stack.logger.debug(f'compute_type {autosize["compute_type_recommended"]} applied by autosizing '
+                                    f'replaces {self.stack.compute_type}')
+
+        item["compute_type"] = {"S": str(autosize["compute_type_recommended"])}
 
     def _set_docker_items(self, item):
 
@@ -558,6 +811,51 @@ class Main(newSchedStack):
             repo_name = str(item["docker_repository_uri"]["S"].split("/")[-1])
             item["docker_repo_name"] = {"S": str(repo_name)}
 
+    def _get_cache_settings(self):
+        """
+        Validate the CodeBuild cache settings.
+
+        Returns:
+            dict: cache_type and cache_modes (list), or None when
+                cache_type is not set
+
+        Raises:
+            Exception: If the cache type or a cache mode is not supported
+        """
+        if not self.stack.get_attr("cache_type"):
+            if self.stack.get_attr("cache_modes"):
+                raise Exception("cache_modes requires cache_type LOCAL")
+            return
+
+        cache_type = str(self.stack.cache_type).upper()
+
+        if cache_type not in self.CACHE_TYPES:
+            raise Exception(f'cache_type "{self.stack.cache_type}" needs to be one of {self.CACHE_TYPES}')
+
+        cache_modes = []
+
+        if self.stack.get_attr("cache_modes"):
+            cache_modes = [_mode.strip().upper() for _mode in self.stack.cache_modes.split(",") if _mode.strip()]
+
+        unknown_modes = set(cache_modes) - set(self.CACHE_MODES)
+
+        if unknown_modes:
+            raise Exception(f'cache_modes {sorted(unknown_modes)} need to be in {self.CACHE_MODES}')
+
+        if cache_modes and cache_type != "LOCAL":
+            raise Exception("cache_modes requires cache_type LOCAL")
+
+        if cache_type == "LOCAL" and not cache_modes:
+            raise Exception("cache_type LOCAL requires at least one cache_modes")
+
+        if "LOCAL_DOCKER_LAYER_CACHE" in cache_modes and self.stack.privileged_mode not in ["True", True, "true"]:
+            raise Exception("LOCAL_DOCKER_LAYER_CACHE requires privileged_mode")
+
+        return {
+            "cache_type": cache_type,
+            "cache_modes": cache_modes
+        }
+
     def _get_dynamodb_item(self):
         """
         Generate the DynamoDB item for storing CodeBuild configuration.
@@ -590,7 +888,6 @@ class Main(newSchedStack):
             "image_type": {"S": str(self.stack.image_type)},
             "build_image": {"S": str(self.stack.build_image)},
             "build_timeout": {"S": str(self.stack.build_timeout)},
-            "compute_type": {"S": str(self.stack.compute_type)},
             "docker_registry": {"S": str(self.stack.docker_registry)},
             "aws_default_region": {"S": str(self.stack.aws_default_region)},
             "trigger_id": {"S": str(self.stack.trigger_id)},
@@ -615,7 +912,16 @@ class Main(newSchedStack):
         if self.stack.get_attr("slack_channel"):
             item["slack_channel"] = {"S": str(self.stack.slack_channel)}
 
+        cache_settings = self._get_cache_settings()
+
+        if cache_settings:
+            item["cache_type"] = {"S": cache_settings["cache_type"]}
+
+        if cache_settings and cache_settings["cache_modes"]:
+            item["cache_modes"] = {"S": ",".join(cache_settings["cache_modes"])}
+
         self._set_docker_items(item)
+        self._set_compute_items(item)
 
         # config0 settings
         item["user_endpoint"] = {"S": str(self.stack.get_user_endpt())}
@@ -643,7 +949,26 @@ class Main(newSchedStack):
         if self.stack.get_attr("sched_type") != "build":
             self.stack.logger.warn('sched_type should be build - overide ci/commit UI display')
 
-        return self.stack.b64_encode(item)
+        return self.stack.b64_encode(self._set_settings_version(item))
+
+    # dup 5817211
+    def _set_settings_version(self, item):
+        """
+        Set settings_version of a settings item to the sha256 of its
+        other attributes, so it changes whenever the item does.
+
+        Args:
+            item (dict): DynamoDB item
+
+        Returns:
+            dict: The item with settings_version set
+        """
+        item.pop(self.SETTINGS_VERSION_ATTRIBUTE, None)
+
+        content = json.dumps(item, sort_keys=True).encode()
+        item[self.SETTINGS_VERSION_ATTRIBUTE] = {"S": hashlib.sha256(content).hexdigest()}
+
+        return item
 
     def _set_ssm_keys(self):
         self.stack.set_variable("ssm_docker_token", None)
@@ -664,6 +989,9 @@ class Main(newSchedStack):
                                     f"/codebuild/{self.stack.codebuild_name}/config0/slack_webhook_hash")
 
     def _get_token(self):
+        if self._is_dry_run():
+            return self._get_dry_run_placeholder(f"{self.stack.codebuild_name}:token")
+
         _lookup = {
             "must_be_one": True,
             "resource_type": "config0_token",
@@ -671,9 +999,12 @@ class Main(newSchedStack):
             "name": self.stack.codebuild_name
         }
 
-        return str(self.stack.get_resource(**_lookup)[0]["token"])
+        return str(self._get_resource(**_lookup)[0]["token"])
 
     def _token(self):
+        if self._is_dry_run():
+            return True
+
         self.stack.create_token(name=self.stack.codebuild_name)
 
         return True
@@ -696,7 +1027,17 @@ class Main(newSchedStack):
             "human_description": human_description
         }
 
-        return self.stack.dynamodb.insert(display=True, **inputargs)
+        if self.stack.settings_write_mode not in ["put", "upsert"]:
+            raise Exception(f'settings_write_mode "{self.stack.settings_write_mode}" needs to be put or upsert')
+
+        if self.stack.settings_write_mode == "upsert":
+            return self._insert("aws_dynamodb_upsert",
+                                state_lookup={"resource_type": "dynamodb_item",
+                                              "provider": "aws",
+                                              "name": f"{table_name}-{self.stack.trigger_id}"},
+                                **inputargs)
+
+        return self._insert("dynamodb", **inputargs)
 
     def run_codebuild(self):
         """
@@ -763,7 +1104,242 @@ class Main(newSchedStack):
             "human_description": human_description
         }
 
-        return self.stack.aws_codebuild.insert(display=True, **inputargs)
+        results = self._insert("aws_codebuild", **inputargs)
+
+        cache_settings = self._get_cache_settings()
+
+        if cache_settings:
+            self._codebuild_cache(cache_settings)
+
+        return results
+
+    def _codebuild_cache(self, cache_settings):
+        """
+        Set the project cache after aws_codebuild.  Not skipped when
+        unchanged, since applying aws_codebuild again resets the cache;
+        aws_codebuild_cache only updates a project that drifted.
+
+        Args:
+            cache_settings (dict): Settings from _get_cache_settings
+        """
+        arguments = {
+            "project_name": self.stack.codebuild_name,
+            "cache_type": cache_settings["cache_type"],
+            "cache_modes": ",".join(cache_settings["cache_modes"]),
+            "aws_default_region": self.stack.aws_default_region
+        }
+
+        if cache_settings["cache_type"] == "S3":
+            arguments["cache_location"] = self.s3_bucket_cache
+
+        inputargs = {
+            "arguments": arguments,
+            "automation_phase": "continuous_delivery",
+            "human_description": f'Set cache of Codebuild project "{self.stack.codebuild_name}"'
+        }
+
+        if self._is_dry_run():
+            return self._add_dry_run_insert("aws_codebuild_cache", **inputargs)
+
+        return self.stack.aws_codebuild_cache.insert(display=True, **inputargs)
+
+    def _get_fingerprint_scope(self):
+        return f"add_codebuild_ci.{self.stack.ci_environment}.{self.stack.codebuild_name}"
+
+    def _insert(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack unless it is unchanged since its last
+        successful insert (see _insert_if_changed).
+        Returns None when the insert is skipped.
+        """
+        if self._is_dry_run():
+            return self._add_dry_run_insert(substack_name, **inputargs)
+
+        return self._insert_if_changed(substack_name,
+                                       state_lookup=state_lookup,
+                                       **inputargs)
+
+    # dup 5817205
+    def _get_insert_record(self, resource_type, name):
+
+        try:
+            records = self.stack.get_resource(resource_type=resource_type,
+                                              provider="config0",
+                                              name=name)
+        except Exception:
+            records = None
+
+        if not records:
+            return
+
+        return records[0]
+
+    # dup 5817206
+    def _add_insert_record(self, resource_type, name, values):
+
+        values = dict(values,
+                      _id=self.stack.get_hash(f"{resource_type}.{name}"),
+                      resource_type=resource_type,
+                      provider="config0",
+                      name=name)
+
+        self.stack.add_resource(values=values,
+                                name=name)
+
+    # dup 5817207
+    def _get_state_hash(self, state_lookup):
+        """
+        Hash of the resource an insert produced, so a resource that was
+        changed, replaced or removed since the insert is inserted again.
+        """
+        if not state_lookup:
+            return
+
+        try:
+            resources = self.stack.get_resource(**state_lookup)
+        except Exception:
+            resources = None
+
+        if not resources:
+            return "absent"
+
+        return self.stack.get_hash(json.dumps(resources[0],
+                                              sort_keys=True,
+                                              default=str))
+
+    # dup 5817208
+    def _insert_if_changed(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack, skipping it when the same arguments were
+        already inserted successfully and the resource it produced is
+        unchanged.
+
+        The fingerprint is a canonical hash of the substack reference
+        and the arguments.  It is first recorded as pending with the
+        run_id and job of the insert; the commit_<job> jobs (see
+        _add_commit_jobs) only run after the jobs before them succeeded
+        and promote the pending fingerprints of the current run.  A
+        failed insert is therefore never skipped on the next run.
+
+        With state_lookup, the resource produced by the substack is
+        hashed when the fingerprint is committed, and the insert is
+        only skipped while that resource is unchanged.
+
+        The substack references are not versioned, so the fingerprint
+        does not change with a new substack release.  Substacks
+        deploying code (lambda functions, state machines) are inserted
+        directly instead; for the others a new release is picked up
+        with "force".
+
+        Args:
+            substack_name (str): Key of the substack in SUBSTACKS
+            state_lookup (dict): get_resource arguments of the resource
+                the substack produces
+            **inputargs: Arguments for the substack insert
+
+        Returns:
+            dict: Result of the insert, or None when it was skipped
+        """
+        scope = self._get_fingerprint_scope()
+        substack_ref = self.SUBSTACKS[substack_name]
+
+        fingerprint = self.stack.get_hash(json.dumps({"substack": substack_ref,
+                                                      "arguments": inputargs["arguments"]},
+                                                     sort_keys=True,
+                                                     default=str))
+
+        name = self.stack.get_hash(f'{scope}.{substack_name}.{inputargs["human_description"]}')
+        committed = self._get_insert_record(self.INSERT_RESOURCE_TYPE, name)
+
+        if (committed and
+                committed.get("fingerprint") == fingerprint and
+                committed.get("state_hash") == self._get_state_hash(state_lookup) and
+                self.stack.get_attr("force") not in ["True", True, "true"]):
+            self.stack.logger.debug(f'skipping unchanged insert "{inputargs["human_description"]}"')
+            return
+
+        results = getattr(self.stack, substack_name).insert(display=True, **inputargs)
+
+        # without a run_id the insert cannot be confirmed and is
+        # never skipped
+        if not self.stack.get_attr("run_id"):
+            return results
+
+        self._add_insert_record(self.PENDING_RESOURCE_TYPE, name, {
+            "scope": scope,
+            "run_id": str(self.stack.run_id),
+            "job": str(self.stack.get_attr("sched_name")),
+            "substack": substack_ref,
+            "fingerprint": fingerprint,
+            "state_lookup": json.dumps(state_lookup or {}, sort_keys=True)
+        })
+
+        return results
+
+    def _render_dry_run_arguments(self, arguments):
+        """
+        Decode the *_hash arguments of an insert so they can be read.
+        Secrets are placeholders in a dry run (see _get_dry_run_placeholder).
+        """
+        rendered = {}
+
+        for _key, _value in arguments.items():
+            if not _key.endswith("_hash") or not _value:
+                rendered[_key] = _value
+                continue
+
+            try:
+                rendered[_key] = self.stack.b64_decode(_value)
+            except Exception:
+                rendered[_key] = _value
+
+        return rendered
+
+    def _add_dry_run_insert(self, substack_name, **inputargs):
+
+        planned = {
+            "job": self._dry_run_job,
+            "substack": self.SUBSTACKS[substack_name],
+            "human_description": inputargs["human_description"],
+            "arguments": self._render_dry_run_arguments(inputargs["arguments"])
+        }
+
+        self._dry_run_plan.append(planned)
+
+        return planned
+
+    def _run_dry(self):
+        """
+        Evaluate run_setup, run_connect_repo, run_ssm and run_codebuild
+        in-process without inserting any substack or creating tokens.
+        Lookups of resources that would be created by an earlier job
+        resolve to placeholders, and the ssh key, tokens and webhook
+        secret are placeholders rather than decrypted values.
+
+        Returns:
+            dict: The rendered inserts and the settings DynamoDB item
+        """
+        import json
+
+        self._dry_run_plan = []
+
+        for job in ["setup", "connect_repo", "ssm", "codebuild"]:
+            self._dry_run_job = job
+            getattr(self, f"run_{job}")()
+
+        dynamodb_items = [planned["arguments"]["item_hash"] for planned in self._dry_run_plan
+                          if "item_hash" in planned["arguments"]]
+
+        plan = {
+            "codebuild_name": self.stack.codebuild_name,
+            "inserts": self._dry_run_plan,
+            "dynamodb_item": dynamodb_items[0] if dynamodb_items else None
+        }
+
+        self.stack.logger.debug(f'dry run for codebuild "{self.stack.codebuild_name}":\n'
+                                f'{json.dumps(plan, indent=2, sort_keys=True, default=str)}')
+
+        return plan
 
     def run(self):
         """
@@ -775,54 +1351,289 @@ class Main(newSchedStack):
         3. Adding repository connection jobs
         4. Adding SSM parameter configuration jobs
         5. Adding CodeBuild project creation jobs
+        6. Adding the jobs recording the inserts that succeeded
         
+        With dry_run set, the jobs are evaluated in-process instead
+        and the rendered plan is returned.
+
         Returns:
             dict: Results of all job executions
         """
+        self._setup_vars()
+
+        if self._is_dry_run():
+            return self._run_dry()
+
         self.stack.unset_parallel(sched_init=True)
         self.add_job("setup")
         self.add_job("connect_repo")
         self.add_job("ssm")
         self.add_job("codebuild")
         # self.add_job("webhook")
+        self.add_job("commit_connect_repo")
+        self.add_job("commit_codebuild")
 
         return self.finalize_jobs()
 
+    # dup 5817209
+    def _add_commit_jobs(self, jobs):
+        """
+        Job specs with a commit_<job> job after every job nothing
+        depends on.  A commit job starts only when the jobs before it
+        succeeded, so it can confirm their inserts (see
+        _commit_confirmed_inserts).
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: jobs followed by the commit jobs
+        """
+        parents = {parent for job in jobs for parent in job.get("depends_on") or []}
+
+        commit_jobs = [{"job": f'commit_{job["job"]}',
+                        "timeout": self.COMMIT_JOB_TIMEOUT,
+                        "automation_phase": job["automation_phase"],
+                        "human_description": f'Record the inserts up to "{job["job"]}"',
+                        "depends_on": [job["job"]]}
+                       for job in jobs if job["job"] not in parents]
+
+        return jobs + commit_jobs
+
+    # dup 5817210
+    def _commit_confirmed_inserts(self, commit_job):
+        """
+        Commit the pending fingerprints that commit_job confirms - those
+        inserted by the current run in every job it depends on, directly
+        or through other jobs.
+
+        Args:
+            commit_job (str): Name of the running commit job
+
+        Returns:
+            list: Names of the committed fingerprints
+        """
+        scope = self._get_fingerprint_scope()
+        parents = {job["job"]: job.get("depends_on") or [] for job in self._get_jobs()}
+        confirmed = []
+        pending = list(parents.get(commit_job, []))
+
+        while pending:
+            job_name = pending.pop(0)
+
+            if job_name in confirmed:
+                continue
+
+            confirmed.append(job_name)
+            pending.extend(parents.get(job_name, []))
+
+        run_id = str(self.stack.get_attr("run_id"))
+
+        try:
+            records = self.stack.get_resource(resource_type=self.PENDING_RESOURCE_TYPE,
+                                              provider="config0") or []
+        except Exception:
+            records = []
+
+        committed = []
+
+        for record in records:
+            if record.get("scope") != scope or record.get("run_id") != run_id:
+                continue
+
+            if record.get("job") not in confirmed:
+                continue
+
+            self._add_insert_record(self.INSERT_RESOURCE_TYPE, record["name"], {
+                "scope": scope,
+                "substack": record["substack"],
+                "fingerprint": record["fingerprint"],
+                "state_hash": self._get_state_hash(json.loads(record.get("state_lookup") or "{}"))
+            })
+
+            committed.append(record["name"])
+
+        self.stack.logger.debug(f'committed {len(committed)} inserts of jobs {confirmed}')
+
+        return committed
+
+    def _record_onboard(self, commit_job):
+        """
+        Record onboard_id for commit_job, which only runs once the jobs
+        before it succeeded.  add_codebuild_ci_bulk skips a repo with a
+        record matching its arguments for every commit job.
+        """
+        if not self.stack.get_attr("onboard_id"):
+            return
+
+        name = f"{self.stack.ci_environment}.{self.stack.codebuild_name}.{commit_job}"
+
+        values = {
+            "_id": self.stack.get_hash(f"{self.ONBOARD_RESOURCE_TYPE}.{name}"),
+            "resource_type": self.ONBOARD_RESOURCE_TYPE,
+            "provider": "config0",
+            "name": name,
+            "onboard_id": str(self.stack.onboard_id),
+            "run_id": str(self.stack.get_attr("run_id"))
+        }
+
+        self.stack.add_resource(values=values,
+                                name=name)
+
+    def _commit_inserts(self, commit_job):
+        self._setup_vars()
+
+        committed = self._commit_confirmed_inserts(commit_job)
+
+        self._record_onboard(commit_job)
+
+        return committed
+
+    def run_commit_connect_repo(self):
+        return self._commit_inserts("commit_connect_repo")
+
+    def run_commit_codebuild(self):
+        return self._commit_inserts("commit_codebuild")
+
+    def _get_jobs(self):
+        jobs = [
+            {"job": "setup",
+             "timeout": 1800,
+             "automation_phase": "continuous_delivery",
+             "human_description": "Setup Basic for Codebuild",
+             "retries": 1},
+            {"job": "connect_repo",
+             "timeout": 1800,
+             "automation_phase": "continuous_delivery",
+             "human_description": "Add configurations to DynamoDb",
+             "depends_on": ["setup"]},
+            {"job": "ssm",
+             "timeout": 1800,
+             "automation_phase": "continuous_delivery",
+             "human_description": "Upload deploy key to ssm",
+             "depends_on": ["setup"]},
+            {"job": "codebuild",
+             "timeout": 1800,
+             "automation_phase": "continuous_delivery",
+             "human_description": "Create Codebuild Project",
+             "depends_on": ["ssm"]}
+        ]
+
+        return self._add_commit_jobs(jobs)
+
+    # dup 5817203
+    def _add_dag_schedules(self, jobs):
+        """
+        Add schedules for jobs that declare their dependencies with
+        "depends_on" instead of a hand wired on_success chain.
+
+        Jobs without a dependency between them are started together
+        through on_success fan out.  on_success can fan out but not
+        join, so a job listing more than one job in depends_on is
+        refused rather than started after only one of them.
+
+        Args:
+            jobs (list): Job specs with keys "job", "timeout",
+                "automation_phase", "human_description" and optionally
+                "depends_on" (list), "retries" (int) and "timewait"
+                (int, defaults to DEFAULT_TIMEWAIT)
+
+        Returns:
+            list: Jobs of the critical path, see _get_critical_path
+
+        Raises:
+            Exception: If a dependency is unknown or cyclic, or a job
+                depends on more than one job
+        """
+        children = {job["job"]: [] for job in jobs}
+
+        for job in jobs:
+            depends_on = job.get("depends_on") or []
+
+            if len(depends_on) > 1:
+                raise Exception(f'job "{job["job"]}" depends on {depends_on} - on_success can not join jobs, '
+                                f'so a job can only depend on one job; chain {depends_on} instead')
+
+            for parent in depends_on:
+                if parent not in children:
+                    raise Exception(f'job "{job["job"]}" depends on unknown job "{parent}"')
+                children[parent].append(job["job"])
+
+        critical_path = self._get_critical_path(jobs)
+
+        for job in jobs:
+            sched = self.new_schedule()
+            sched.job = job["job"]
+            sched.archive.timeout = job["timeout"]
+            sched.archive.timewait = job.get("timewait", self.DEFAULT_TIMEWAIT)
+            sched.automation_phase = job["automation_phase"]
+            sched.human_description = job["human_description"]
+
+            if job.get("retries"):
+                sched.conditions.retries = job["retries"]
+
+            if children[job["job"]]:
+                sched.on_success = children[job["job"]]
+
+            self.add_schedule()
+
+        return critical_path
+
+    # dup 5817204
+    def _get_critical_path(self, jobs):
+        """
+        Get the longest chain of depends_on, weighted by the timeout of
+        each job - the worst case time of the schedule.  The path and
+        its seconds are logged so the job to split or speed up is known.
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: Job names of the critical path, first job first
+
+        Raises:
+            Exception: If the depends_on of the jobs are cyclic
+        """
+        specs = {job["job"]: job for job in jobs}
+        finish = {}
+        via = {}
+
+        def _finish(job_name, seen):
+
+            if job_name in seen:
+                raise Exception(f'job "{job_name}" has a cyclic depends_on')
+
+            if job_name not in finish:
+                parents = specs[job_name].get("depends_on") or []
+                start = 0
+
+                for parent in parents:
+                    if _finish(parent, seen + [job_name]) > start:
+                        start = finish[parent]
+                        via[job_name] = parent
+
+                finish[job_name] = start + int(specs[job_name]["timeout"])
+
+            return finish[job_name]
+
+        for job_name in specs:
+            _finish(job_name, [])
+
+        if not finish:
+            return []
+
+        critical_path = [max(finish, key=finish.get)]
+        seconds = finish[critical_path[0]]
+
+        while critical_path[0] in via:
+            critical_path.insert(0, via[critical_path[0]])
+
+        self.stack.logger.debug(f'critical path {" -> ".join(critical_path)} - {seconds} seconds of timeouts')
+
+        return critical_path
+
     def schedule(self):
-        sched = self.new_schedule()
-        sched.job = "setup"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "continuous_delivery"
-        sched.human_description = "Setup Basic for Codebuild"
-        sched.conditions.retries = 1
-        sched.on_success = ["connect_repo"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "connect_repo"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "continuous_delivery"
-        sched.human_description = "Add configurations to DynamoDb"
-        sched.on_success = ["ssm"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "ssm"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "continuous_delivery"
-        sched.human_description = "Upload deploy key to ssm"
-        sched.on_success = ["codebuild"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "codebuild"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "continuous_delivery"
-        sched.human_description = "Create Codebuild Project"
-        self.add_schedule()
+        self._add_dag_schedules(self._get_jobs())
 
         return self.get_schedules()
@@ -0,0 +1,379 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+class Main(newSchedStack):
+
+    # automatic retries of the onboard job for failed repos
+    ONBOARD_RETRIES = 2
+
+    # records add_codebuild_ci writes with the onboard_id of a repo
+    # from its commit jobs, once the jobs before them succeeded
+    ONBOARD_RESOURCE_TYPE = "codebuild_ci_onboard"
+
+    ONBOARD_COMMIT_JOBS = [
+        "commit_connect_repo",
+        "commit_codebuild"
+    ]
+
+    # keys a repo spec may set or override for add_codebuild_ci
+    REPO_SPEC_KEYS = [
+        "codebuild_name",
+        "git_repo",
+        "git_url",
+        "branch",
+        "slack_channel",
+        "ecr_repository_uri",
+        "ecr_repo_name",
+        "docker_repository_uri",
+        "docker_repo_name",
+        "docker_username",
+        "run_title",
+        "trigger_id",
+        "privileged_mode",
+        "image_type",
+        "build_image",
+        "build_timeout",
+        "compute_type",
+        "cache_type",
+        "cache_modes",
+        "docker_registry",
+        "bucket_acl",
+        "bucket_expire_days",
+        "cloud_tags_hash"
+    ]
+
+    REPO_SPEC_REQUIRED = [
+        "codebuild_name",
+        "git_repo",
+        "git_url"
+    ]
+
+    def __init__(self, stackargs):
+
+        newSchedStack.__init__(self, stackargs)
+
+        # base64 encoded list of repo specs e.g.
+        # [{"codebuild_name": "app-a", "git_repo": "org/app-a", "git_url": "git@github.com:org/app-a.git"}]
+        self.parse.add_required(key="repos_hash",
+                                types="str")
+
+        self.parse.add_required(key="project_id",
+                                types="str")
+
+        self.parse.add_required(key="ci_environment")
+
+        self.parse.add_required(key="security_group_id",
+                                default="null",
+                                types="str")
+
+        # max number of repos onboarded at the same time
+        self.parse.add_optional(key="concurrency",
+                                types="int",
+                                default="10")
+
+        # comma separated codebuild_names to (re)run - used to retry
+        # failed repos without onboarding the whole batch again
+        self.parse.add_optional(key="codebuild_names",
+                                types="str")
+
+        self.parse.add_optional(key="suffix_id",
+                                types="str")
+
+        self.parse.add_optional(key="cloud_tags_hash",
+                                types="str")
+
+        self.parse.add_optional(key="subnet_ids",
+                                default="null")
+
+        self.parse.add_optional(key="vpc_id",
+                                default="null",
+                                types="str")
+
+        self.parse.add_optional(key="aws_default_region",
+                                types="str",
+                                default="us-east-1")
+
+        # onboard the selected repos even when they were onboarded
+        # before with the same arguments
+        self.parse.add_optional(key="force",
+                                types="bool",
+                                default="false")
+
+        # validate the repo specs and render the add_codebuild_ci
+        # arguments of every repo in-process instead of onboarding
+        self.parse.add_optional(key="dry_run",
+                                types="bool",
+                                default="false")
+
+        # Add substack
+        self.stack.add_substack('config0-hub:::devops-solutions::add_codebuild_ci')
+
+        self.stack.init_substacks()
+
+    def _get_repo_specs(self):
+        """
+        Decode and validate the repo specs.
+
+        Returns:
+            list: Repo specs to onboard, filtered by codebuild_names if set
+
+        Raises:
+            Exception: If a spec is missing required keys, uses unknown keys
+                or duplicates a codebuild_name
+        """
+        repo_specs = self.stack.b64_decode(self.stack.repos_hash)
+
+        if not isinstance(repo_specs, list) or not repo_specs:
+            raise Exception("repos_hash needs to be a non-empty list of repo specs")
+
+        codebuild_names = []
+
+        for repo_spec in repo_specs:
+            for req_key in self.REPO_SPEC_REQUIRED:
+                if repo_spec.get(req_key):
+                    continue
+                raise Exception(f'repo spec {repo_spec} requires "{req_key}"')
+
+            unknown_keys = set(repo_spec.keys()) - set(self.REPO_SPEC_KEYS)
+
+            if unknown_keys:
+                raise Exception(f'repo spec "{repo_spec["codebuild_name"]}" has unsupported keys {sorted(unknown_keys)}')
+
+            if "_" in repo_spec["codebuild_name"]:
+                raise Exception(f'Cannot use underscores (Only hyphens) in the codebuild_name "{repo_spec["codebuild_name"]}"')
+
+            if repo_spec["codebuild_name"] in codebuild_names:
+                raise Exception(f'codebuild_name "{repo_spec["codebuild_name"]}" is duplicated')
+
+            codebuild_names.append(repo_spec["codebuild_name"])
+
+        if not self.stack.get_attr("codebuild_names"):
+            return repo_specs
+
+        selected = [_name.strip() for _name in self.stack.codebuild_names.split(",") if _name.strip()]
+        missing = set(selected) - set(codebuild_names)
+
+        if missing:
+            raise Exception(f'codebuild_names {sorted(missing)} not found in repos_hash')
+
+        return [repo_spec for repo_spec in repo_specs if repo_spec["codebuild_name"] in selected]
+
+    def _get_lookup_cache_hash(self):
+        """
+        Resolve the lookups every repo makes once for the whole batch,
+        passed to add_codebuild_ci as lookup_cache_hash.  The API gateway
+        of the CI environment is shared by all repos.
+
+        Returns:
+            str: Base64 encoded list of lookups
+        """
+        import time
+
+        lookup = {
+            "resource_type": "apigateway_restapi_lambda",
+            "provider": "aws",
+            "name": f"ci-shared-{self.stack.ci_environment}"
+        }
+
+        resource = self.stack.get_resource(must_be_one=True, **lookup)[0]
+
+        entry = dict(lookup,
+                     fetched_at=int(time.time()),
+                     resource={"base_url": resource["base_url"]})
+
+        return self.stack.b64_encode([entry])
+
+    def _get_arguments(self, repo_spec, lookup_cache_hash=None):
+
+        arguments = {
+            "project_id": self.stack.project_id,
+            "ci_environment": self.stack.ci_environment,
+            "security_group_id": self.stack.security_group_id,
+            "aws_default_region": self.stack.aws_default_region
+        }
+
+        for _key in ["suffix_id", "cloud_tags_hash", "subnet_ids", "vpc_id"]:
+            if self.stack.get_attr(_key):
+                arguments[_key] = self.stack.get_attr(_key)
+
+        # repo spec overrides the shared settings
+        arguments.update(repo_spec)
+
+        if lookup_cache_hash:
+            arguments["lookup_cache_hash"] = lookup_cache_hash
+
+        return arguments
+
+    def _get_onboard_id(self, repo_spec):
+        """
+        Hash of the add_codebuild_ci arguments of a repo.  The shared
+        lookups are left out since they are resolved again every run.
+        """
+        import json
+
+        return self.stack.get_hash(json.dumps(self._get_arguments(repo_spec),
+                                              sort_keys=True,
+                                              default=str))
+
+    def _is_onboarded(self, repo_spec, onboard_id):
+        """
+        Whether every commit job of the repo's add_codebuild_ci recorded
+        onboard_id, i.e. the repo was onboarded with the same arguments.
+        """
+        for commit_job in self.ONBOARD_COMMIT_JOBS:
+            name = f'{self.stack.ci_environment}.{repo_spec["codebuild_name"]}.{commit_job}'
+
+            try:
+                records = self.stack.get_resource(resource_type=self.ONBOARD_RESOURCE_TYPE,
+                                                  provider="config0",
+                                                  name=name)
+            except Exception:
+                records = None
+
+            if not records or records[0].get("onboard_id") != onboard_id:
+                return False
+
+        return True
+
+    def _get_pending_repo_specs(self, repo_specs):
+        """
+        Repo specs not onboarded yet with their current arguments.
+        All of them with force.
+        """
+        if self.stack.force in ["True", True, "true"]:
+            return repo_specs
+
+        pending = []
+
+        for repo_spec in repo_specs:
+            if self._is_onboarded(repo_spec, self._get_onboard_id(repo_spec)):
+                self.stack.logger.debug(f'codebuild ci "{repo_spec["codebuild_name"]}" is already onboarded - skipping')
+                continue
+
+            pending.append(repo_spec)
+
+        return pending
+
+    def _onboard(self, repo_spec, lookup_cache_hash):
+
+        arguments = self._get_arguments(repo_spec, lookup_cache_hash)
+        arguments["onboard_id"] = self._get_onboard_id(repo_spec)
+
+        inputargs = {
+            "arguments": arguments,
+            "automation_phase": "continuous_delivery",
+            "human_description": f'Onboard codebuild ci "{repo_spec["codebuild_name"]}"'
+        }
+
+        return self.stack.add_codebuild_ci.insert(display=True, **inputargs)
+
+    def run_onboard(self):
+        """
+        Onboard the repos in waves of at most "concurrency" repos.
+
+        Each repo is its own add_codebuild_ci substack so a failed repo
+        does not stop the rest of its wave.  A failed repo fails the job,
+        which is retried up to ONBOARD_RETRIES times.  The commit jobs of
+        add_codebuild_ci record the repo's onboard_id once the jobs before
+        them succeeded, so a retry (or a later run) only submits the repos
+        without both records for their current arguments.  Repos still
+        failing after the retries can be re-run with codebuild_names.
+
+        Returns:
+            bool: True if all waves were submitted
+        """
+        self.stack.init_variables()
+        self.stack.verify_variables()
+
+        repo_specs = self._get_pending_repo_specs(self._get_repo_specs())
+        concurrency = max(int(self.stack.concurrency), 1)
+
+        if not repo_specs:
+            self.stack.logger.debug("all repos are onboarded with their current arguments")
+            return True
+
+        lookup_cache_hash = self._get_lookup_cache_hash()
+
+        for idx in range(0, len(repo_specs), concurrency):
+            wave = repo_specs[idx:idx + concurrency]
+
+            self.stack.logger.debug(f'onboarding wave {int(idx / concurrency) + 1} '
+                                    f'with {len(wave)} repos: {[repo_spec["codebuild_name"] for repo_spec in wave]}')
+
+            self.stack.set_parallel()
+
+            for repo_spec in wave:
+                self._onboard(repo_spec, lookup_cache_hash)
+
+            self.stack.unset_parallel()
+
+        return True
+
+    def _run_dry(self):
+        """
+        Validate the repo specs and render the add_codebuild_ci arguments
+        of every repo in-process, without launching any substack.  A
+        single repo's inserts can be rendered with add_codebuild_ci
+        dry_run.
+
+        Returns:
+            dict: The add_codebuild_ci arguments per codebuild_name, the
+                repos already onboarded and the waves the rest would be
+                onboarded in
+        """
+        import json
+
+        selected = self._get_repo_specs()
+        repo_specs = self._get_pending_repo_specs(selected)
+        concurrency = max(int(self.stack.concurrency), 1)
+
+        plan = {
+            "onboarded": [repo_spec["codebuild_name"] for repo_spec in selected
+                          if repo_spec not in repo_specs],
+            "repos": {repo_spec["codebuild_name"]: self._get_arguments(repo_spec)
+                      for repo_spec in repo_specs},
+            "waves": [[repo_spec["codebuild_name"] for repo_spec in repo_specs[idx:idx + concurrency]]
+                      for idx in range(0, len(repo_specs), concurrency)]
+        }
+
+        self.stack.logger.debug(f'dry run for {len(repo_specs)} repos:\n'
+                                f'{json.dumps(plan, indent=2, sort_keys=True, default=str)}')
+
+        return plan
+
+    def run(self):
+        self.stack.init_variables()
+
+        if self.stack.get_attr("dry_run") in ["True", True, "true"]:
+            return self._run_dry()
+
+        self.stack.unset_parallel(sched_init=True)
+        self.add_job("onboard")
+
+        return self.finalize_jobs()
+
+    def schedule(self):
+        sched = self.new_schedule()
+        sched.job = "onboard"
+        sched.archive.timeout = 21600
+        sched.archive.timewait = 120
+        sched.automation_phase = "continuous_delivery"
+        sched.human_description = "Onboard codebuild ci repos in bulk"
+        sched.conditions.retries = self.ONBOARD_RETRIES
+        self.add_schedule()
+
+        return self.get_schedules()
@@ -15,8 +15,16 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import hashlib
+import json
+
 class Main(newSchedStack):
 
+    # content hash on the CI settings items - the same string attribute
+    # is written by aws_dynamodb_upsert and codebuild_compute_autosize,
+    # which use it as their write condition
+    SETTINGS_VERSION_ATTRIBUTE = "settings_version"
+
     def __init__(self, stackargs):
         """
         Initialize the IaC CI/CD stack.
@@ -170,7 +178,26 @@ class Main(newSchedStack):
         if self.stack.ssm_name:
             item["ssm_name"] = {"S": str(self.stack.ssm_name)}
 
-        return self.stack.b64_encode(item)
+        return self.stack.b64_encode(self._set_settings_version(item))
+
+    # dup 5817211
+    def _set_settings_version(self, item):
+        """
+        Set settings_version of a settings item to the sha256 of its
+        other attributes, so it changes whenever the item does.
+
+        Args:
+            item (dict): DynamoDB item
+
+        Returns:
+            dict: The item with settings_version set
+        """
+        item.pop(self.SETTINGS_VERSION_ATTRIBUTE, None)
+
+        content = json.dumps(item, sort_keys=True).encode()
+        item[self.SETTINGS_VERSION_ATTRIBUTE] = {"S": hashlib.sha256(content).hexdigest()}
+
+        return item
 
     def _dynamodb_item(self):
         """
@@ -0,0 +1,92 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="project_name",
+                             tags="tfvar",
+                             types="str")
+
+    # NO_CACHE, S3 or LOCAL
+    stack.parse.add_required(key="cache_type",
+                             tags="tfvar",
+                             types="str")
+
+    # comma separated local cache modes for cache_type LOCAL
+    stack.parse.add_optional(key="cache_modes",
+                             default="",
+                             tags="tfvar",
+                             types="str")
+
+    # bucket (and optional prefix) for cache_type S3
+    stack.parse.add_optional(key="cache_location",
+                             default="",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_codebuild_cache",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    if stack.cache_type == "S3" and not stack.cache_location:
+        raise Exception("cache_type S3 requires cache_location")
+
+    if stack.cache_type == "LOCAL" and not stack.cache_modes:
+        raise Exception("cache_type LOCAL requires cache_modes")
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=f"{stack.project_name}-cache",
+                       resource_type="codebuild_cache")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "project_name": stack.project_name
+    })
+
+    tf.output(keys=["project_name",
+                    "cache_type",
+                    "cache_modes",
+                    "cache_location"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
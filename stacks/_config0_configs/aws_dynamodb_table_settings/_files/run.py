@@ -0,0 +1,112 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="table_name",
+                             tags="tfvar",
+                             types="str")
+
+    # PAY_PER_REQUEST or PROVISIONED
+    stack.parse.add_optional(key="billing_mode",
+                             default="PAY_PER_REQUEST",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="read_capacity",
+                             default="5",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="write_capacity",
+                             default="5",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="ttl_attribute",
+                             default="null",
+                             types="str")
+
+    # base64 encoded list of global secondary indexes
+    # (name, hash_key, range_key, projection)
+    stack.parse.add_optional(key="indexes_hash",
+                             default="null",
+                             types="str")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_dynamodb_table_settings",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    if stack.billing_mode not in ["PAY_PER_REQUEST", "PROVISIONED"]:
+        raise Exception(f"billing_mode {stack.billing_mode} needs to be PAY_PER_REQUEST or PROVISIONED")
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=f"{stack.table_name}-settings",
+                       resource_type="dynamodb_table_settings")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "table_name": stack.table_name,
+        "billing_mode": stack.billing_mode
+    })
+
+    if stack.get_attr("ttl_attribute"):
+        tf.include(values={
+            "ttl_attribute": stack.ttl_attribute
+        })
+
+    if stack.get_attr("indexes_hash"):
+        for index in stack.b64_decode(stack.indexes_hash):
+            if not index.get("name") or not index.get("hash_key"):
+                raise Exception(f"index {index} needs a name and a hash_key")
+
+        tf.include(values={
+            "indexes_hash": stack.indexes_hash
+        })
+
+    tf.output(keys=["table_name",
+                    "billing_mode",
+                    "ttl_attribute",
+                    "index_names",
+                    "settings_sha"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
@@ -0,0 +1,97 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="table_name",
+                             tags="tfvar",
+                             types="str")
+
+    # base64 encoded dynamodb item in attribute value format
+    stack.parse.add_required(key="item_hash",
+                             tags="tfvar,tf_sensitive",
+                             types="str")
+
+    stack.parse.add_optional(key="hash_key",
+                             default="_id",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="version_attribute",
+                             default="settings_version",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="max_retries",
+                             default="5",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_dynamodb_upsert",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    item = stack.b64_decode(stack.item_hash)
+
+    if stack.hash_key not in item:
+        raise Exception(f"item_hash is missing the hash_key {stack.hash_key}")
+
+    _key_value = list(item[stack.hash_key].values())[0]
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=f"{stack.table_name}-{_key_value}",
+                       resource_type="dynamodb_item")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "table_name": stack.table_name,
+        "hash_key": stack.hash_key,
+        "version_attribute": stack.version_attribute
+    })
+
+    tf.output(keys=["table_name",
+                    "item_key",
+                    "item_sha"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
@@ -0,0 +1,102 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="function_name",
+                             tags="tfvar",
+                             types="str")
+
+    # alias of the published version - required by
+    # provisioned_concurrency and snap_start
+    stack.parse.add_optional(key="alias_name",
+                             default="",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="provisioned_concurrency",
+                             default="0",
+                             tags="tfvar",
+                             types="int")
+
+    # null leaves the reserved concurrency of the function as it is
+    stack.parse.add_optional(key="reserved_concurrency",
+                             default="null",
+                             tags="tfvar",
+                             types="int")
+
+    # not supported for container image functions
+    stack.parse.add_optional(key="snap_start",
+                             default="false",
+                             tags="tfvar",
+                             types="bool")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_lambda_concurrency",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    snap_start = stack.snap_start in ["True", True, "true"]
+
+    if (int(stack.provisioned_concurrency) or snap_start) and not stack.alias_name:
+        raise Exception("provisioned_concurrency and snap_start require alias_name")
+
+    if int(stack.provisioned_concurrency) and snap_start:
+        raise Exception("snap_start and provisioned_concurrency can not be used together")
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=f"{stack.function_name}-concurrency",
+                       resource_type="lambda_concurrency")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "function_name": stack.function_name
+    })
+
+    tf.output(keys=["function_name",
+                    "alias_name",
+                    "invoke_name",
+                    "provisioned_concurrency",
+                    "snap_start"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
@@ -0,0 +1,140 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import base64
+import json
+
+from config0_publisher.terraform import TFConstructor
+
+
+def _get_bucket_spec(bucket_spec, cloud_tags):
+
+    if not bucket_spec.get("bucket"):
+        raise Exception(f"bucket spec {bucket_spec} requires a bucket name")
+
+    tags = dict(cloud_tags)
+    tags.update(bucket_spec.get("tags") or {})
+
+    # every spec has the same keys/types for terraform
+    return {
+        "bucket": str(bucket_spec["bucket"]),
+        "acl": str(bucket_spec.get("acl") or "private"),
+        "enable_lifecycle": str(bucket_spec.get("enable_lifecycle", "false")).lower(),
+        "expire_days": int(bucket_spec.get("expire_days") or 1),
+        "force_destroy": str(bucket_spec.get("force_destroy", "true")).lower(),
+        "versioning": str(bucket_spec.get("versioning", "false")).lower(),
+        "sse_algorithm": str(bucket_spec.get("sse_algorithm") or "AES256"),
+        "kms_key_id": str(bucket_spec.get("kms_key_id") or ""),
+        "tags": {str(_key): str(_value) for _key, _value in tags.items()}
+    }
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="buckets_name",
+                             types="str")
+
+    # base64 encoded list of bucket specs
+    stack.parse.add_required(key="buckets_hash",
+                             types="str")
+
+    # import the buckets created before by the per bucket
+    # aws_s3_bucket substack
+    stack.parse.add_optional(key="import_existing",
+                             default="true",
+                             types="bool")
+
+    stack.parse.add_optional(key="cloud_tags_hash",
+                             types="str")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_s3_buckets",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    try:
+        cloud_tags = stack.b64_decode(stack.cloud_tags_hash)
+    except:
+        cloud_tags = {}
+
+    bucket_specs = [_get_bucket_spec(bucket_spec, cloud_tags)
+                    for bucket_spec in stack.b64_decode(stack.buckets_hash)]
+
+    if not bucket_specs:
+        raise Exception("buckets_hash needs at least one bucket spec")
+
+    for bucket_spec in bucket_specs:
+        if "_" in bucket_spec["bucket"]:
+            raise Exception(f'Cannot use underscores (Only hyphens) in the bucket "{bucket_spec["bucket"]}"')
+
+    # buckets the per bucket substack registered - new buckets are
+    # created, buckets already in the state are left alone by the import
+    import_buckets = []
+
+    if stack.import_existing in ["True", True, "true"]:
+        for bucket_spec in bucket_specs:
+            if stack.get_resource(resource_type="s3_bucket",
+                                  provider="aws",
+                                  name=bucket_spec["bucket"]):
+                import_buckets.append(bucket_spec["bucket"])
+
+    stack.set_variable("import_buckets",
+                       ",".join(import_buckets),
+                       tags="tfvar",
+                       types="str")
+
+    # re-encoded as plain json for jsondecode in terraform
+    stack.set_variable("buckets_hash",
+                       base64.b64encode(json.dumps(bucket_specs, sort_keys=True).encode()).decode(),
+                       tags="tfvar",
+                       types="str")
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=stack.buckets_name,
+                       resource_type="s3_buckets")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "buckets_name": stack.buckets_name
+    })
+
+    tf.output(keys=["buckets",
+                    "arns_hash"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
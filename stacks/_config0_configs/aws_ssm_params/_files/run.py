@@ -0,0 +1,92 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import base64
+import json
+
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    stack.parse.add_required(key="ssm_name",
+                             types="str")
+
+    # base64 encoded map of ssm key -> ssm value
+    stack.parse.add_required(key="ssm_params_hash",
+                             tags="tf_sensitive",
+                             types="str")
+
+    stack.parse.add_optional(key="ssm_type",
+                             default="SecureString",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::aws_ssm_params",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    # parameters without a value are not written
+    ssm_params = {str(_key): str(_value)
+                  for _key, _value in stack.b64_decode(stack.ssm_params_hash).items()
+                  if _value}
+
+    if not ssm_params:
+        raise Exception("ssm_params_hash needs at least one ssm key with a value")
+
+    # re-encoded as plain json for jsondecode in terraform
+    stack.set_variable("ssm_params_hash",
+                       base64.b64encode(json.dumps(ssm_params, sort_keys=True).encode()).decode(),
+                       tags="tfvar,tf_sensitive",
+                       types="str")
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=stack.ssm_name,
+                       resource_type="ssm_parameters")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "ssm_name": stack.ssm_name
+    })
+
+    tf.output(keys=["ssm_keys",
+                    "ssm_versions_hash"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
@@ -0,0 +1,156 @@
+"""
+# Copyright (C) 2025 Gary Leong <gary@config0.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from config0_publisher.terraform import TFConstructor
+
+
+def run(stackargs):
+
+    # instantiate authoring stack
+    stack = newStack(stackargs)
+
+    # Add default variables
+    # _id of the project's settings item
+    stack.parse.add_required(key="trigger_id",
+                             tags="tfvar",
+                             types="str")
+
+    # attributes of the run items in runs_table - there is no default
+    # since the runs table is written outside these stacks
+    stack.parse.add_required(key="runs_key_attribute",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_required(key="duration_attribute",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_required(key="status_attribute",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_required(key="status_message_attribute",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_required(key="timestamp_attribute",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="codebuild_name",
+                             types="str")
+
+    # recommend or apply
+    stack.parse.add_optional(key="mode",
+                             default="recommend",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="settings_table",
+                             default="ci-shared-settings",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="runs_table",
+                             default="ci-shared-runs",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="runs_index",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="lookback",
+                             default="30",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="min_samples",
+                             default="5",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="upsize_p90_seconds",
+                             default="900",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="downsize_p90_seconds",
+                             default="180",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="oom_rate",
+                             default="0.1",
+                             tags="tfvar",
+                             types="float")
+
+    stack.parse.add_optional(key="min_compute_type",
+                             default="BUILD_GENERAL1_SMALL",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="max_compute_type",
+                             default="BUILD_GENERAL1_LARGE",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="aws_default_region",
+                             default="us-east-1",
+                             tags="tfvar,resource,db,tf_exec_env",
+                             types="str")
+
+    # Add execgroup
+    stack.add_execgroup("config0-hub:::devops-solutions::codebuild_compute_autosize",
+                        "tf_execgroup")
+
+    # Add substack
+    stack.add_substack('config0-hub:::config0_core::tf_executor')
+
+    # Initialize Variables in stack
+    stack.init_variables()
+    stack.init_execgroups()
+    stack.init_substacks()
+
+    if stack.mode not in ["recommend", "apply"]:
+        raise Exception(f'mode "{stack.mode}" needs to be recommend or apply')
+
+    resource_name = f"{stack.get_attr('codebuild_name') or stack.trigger_id}-compute-autosize"
+
+    tf = TFConstructor(stack=stack,
+                       provider="aws",
+                       execgroup_name=stack.tf_execgroup.name,
+                       resource_name=resource_name,
+                       resource_type="codebuild_compute_autosize")
+
+    tf.include(values={
+        "aws_default_region": stack.aws_default_region,
+        "trigger_id": stack.trigger_id,
+        "mode": stack.mode
+    })
+
+    tf.output(keys=["compute_type",
+                    "compute_type_recommended",
+                    "compute_type_reason",
+                    "mode"])
+
+    # finalize the tf_executor
+    stack.tf_executor.insert(display=True,
+                             **tf.get())
+
+    return stack.get_results()
@@ -32,6 +32,49 @@ def run(stackargs):
                              tags="tfvar,db",
                              types="str")
 
+    # bounds of the wait between checks, doubling from the minimum
+    stack.parse.add_optional(key="check_wait_min_seconds",
+                             default="10",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="check_wait_max_seconds",
+                             default="120",
+                             tags="tfvar",
+                             types="int")
+
+    # pushes to the same trigger_id and branch inside the
+    # window build once - 0 disables coalescing
+    stack.parse.add_optional(key="coalesce_window_seconds",
+                             default="0",
+                             tags="tfvar",
+                             types="int")
+
+    # coalescing keys expire on runs_ttl_attribute
+    # coalesce_ttl_seconds after their window
+    stack.parse.add_optional(key="runs_ttl_attribute",
+                             default="expire_at",
+                             tags="tfvar",
+                             types="str")
+
+    stack.parse.add_optional(key="coalesce_ttl_seconds",
+                             default="86400",
+                             tags="tfvar",
+                             types="int")
+
+    # STANDARD or EXPRESS (webhook processing only,
+    # builds are tracked by a STANDARD child)
+    stack.parse.add_optional(key="workflow_type",
+                             default="STANDARD",
+                             tags="tfvar",
+                             types="str")
+
+    # b64 map of lambda (e.g. check-codebuild) to the alias
+    # the state machine invokes - others are invoked unqualified
+    stack.parse.add_optional(key="lambda_aliases_hash",
+                             default="null",
+                             types="str")
+
     stack.parse.add_optional(key="aws_default_region",
                              default="us-east-1",
                              tags="tfvar,resource,db,tf_exec_env",
@@ -60,8 +103,14 @@ def run(stackargs):
         "step_func": stack.step_function_name
     })
 
+    if stack.get_attr("lambda_aliases_hash"):
+        tf.include(values={
+            "lambda_aliases_hash": stack.lambda_aliases_hash
+        })
+
     tf.output(keys=["role_arn",
-                    "arn"])
+                    "arn",
+                    "build_tracking_arn"])
 
     # finalize the tf_executor
     stack.tf_executor.insert(display=True,
@@ -32,6 +32,68 @@ def run(stackargs):
                              tags="tfvar,resource,db,tf_exec_env",
                              types="str")
 
+    # poll or task_token
+    stack.parse.add_optional(key="codebuild_wait",
+                             default="poll",
+                             tags="tfvar",
+                             types="str")
+
+    # task_token needs trigger-codebuild and check-codebuild
+    # releases that handle task tokens
+    stack.parse.add_optional(key="task_token_lambda_support",
+                             default="false",
+                             tags="tfvar",
+                             types="bool")
+
+    # bounds of the wait between checks, doubling from the minimum
+    stack.parse.add_optional(key="check_wait_min_seconds",
+                             default="10",
+                             tags="tfvar",
+                             types="int")
+
+    stack.parse.add_optional(key="check_wait_max_seconds",
+                             default="120",
+                             tags="tfvar",
+                             types="int")
+
+    # STANDARD or EXPRESS (webhook processing only,
+    # builds are tracked by a STANDARD child)
+    stack.parse.add_optional(key="workflow_type",
+                             default="STANDARD",
+                             tags="tfvar",
+                             types="str")
+
+    # b64 map of lambda (e.g. check-codebuild) to the alias
+    # the state machine invokes - others are invoked unqualified
+    stack.parse.add_optional(key="lambda_aliases_hash",
+                             default="null",
+                             types="str")
+
+    # folder builds at once unless the registered
+    # repo's settings item sets its own
+    stack.parse.add_optional(key="parallel_max_concurrency",
+                             default="10",
+                             tags="tfvar",
+                             types="int")
+
+    # folder count from which the distributed map is used
+    stack.parse.add_optional(key="parallel_distributed_threshold",
+                             default="100",
+                             tags="tfvar",
+                             types="int")
+
+    # s3 bucket for distributed map results - without
+    # it the distributed map is disabled
+    stack.parse.add_optional(key="map_results_bucket",
+                             default="null",
+                             types="str")
+
+    # comma separated project name prefixes - empty
+    # forwards the state change of every project
+    stack.parse.add_optional(key="codebuild_project_prefix",
+                             default="null",
+                             types="str")
+
     # Add execgroup
     stack.add_execgroup("config0-hub:::devops-solutions::iac_ci_stepf",
                         "tf_execgroup")
@@ -55,7 +117,22 @@ def run(stackargs):
         "step_func": stack.step_function_name
     })
 
-    tf.output(keys=["role_arn", "arn"])
+    if stack.get_attr("lambda_aliases_hash"):
+        tf.include(values={
+            "lambda_aliases_hash": stack.lambda_aliases_hash
+        })
+
+    if stack.get_attr("codebuild_project_prefix"):
+        tf.include(values={
+            "codebuild_project_prefix": stack.codebuild_project_prefix
+        })
+
+    if stack.get_attr("map_results_bucket"):
+        tf.include(values={
+            "map_results_bucket": stack.map_results_bucket
+        })
+
+    tf.output(keys=["role_arn", "arn", "build_tracking_arn", "codebuild_state_change_dashboard"])
 
     # finalize the tf_executor
     stack.tf_executor.insert(display=True, **tf.get())
@@ -17,6 +17,9 @@
 
 class Main(newSchedStack):
 
+    # seconds between the retries of a scheduled job
+    DEFAULT_TIMEWAIT = 120
+
     def __init__(self, stackargs):
         newSchedStack.__init__(self, stackargs)
 
@@ -175,32 +178,137 @@ class Main(newSchedStack):
 
         return self.finalize_jobs()
 
+    # dup 5817203
+    def _add_dag_schedules(self, jobs):
+        """
+        Add schedules for jobs that declare their dependencies with
+        "depends_on" instead of a hand wired on_success chain.
+
+        Jobs without a dependency between them are started together
+        through on_success fan out.  on_success can fan out but not
+        join, so a job listing more than one job in depends_on is
+        refused rather than started after only one of them.
+
+        Args:
+            jobs (list): Job specs with keys "job", "timeout",
+                "automation_phase", "human_description" and optionally
+                "depends_on" (list), "retries" (int) and "timewait"
+                (int, defaults to DEFAULT_TIMEWAIT)
+
+        Returns:
+            list: Jobs of the critical path, see _get_critical_path
+
+        Raises:
+            Exception: If a dependency is unknown or cyclic, or a job
+                depends on more than one job
+        """
+        children = {job["job"]: [] for job in jobs}
+
+        for job in jobs:
+            depends_on = job.get("depends_on") or []
+
+            if len(depends_on) > 1:
+                raise Exception(f'job "{job["job"]}" depends on {depends_on} - on_success can not join jobs, '
+                                f'so a job can only depend on one job; chain {depends_on} instead')
+
+            for parent in depends_on:
+                if parent not in children:
+                    raise Exception(f'job "{job["job"]}" depends on unknown job "{parent}"')
+                children[parent].append(job["job"])
+
+        critical_path = self._get_critical_path(jobs)
+
+        for job in jobs:
+            sched = self.new_schedule()
+            sched.job = job["job"]
+            sched.archive.timeout = job["timeout"]
+            sched.archive.timewait = job.get("timewait", self.DEFAULT_TIMEWAIT)
+            sched.automation_phase = job["automation_phase"]
+            sched.human_description = job["human_description"]
+
+            if job.get("retries"):
+                sched.conditions.retries = job["retries"]
+
+            if children[job["job"]]:
+                sched.on_success = children[job["job"]]
+
+            self.add_schedule()
+
+        return critical_path
+
+    # dup 5817204
+    def _get_critical_path(self, jobs):
+        """
+        Get the longest chain of depends_on, weighted by the timeout of
+        each job - the worst case time of the schedule.  The path and
+        its seconds are logged so the job to split or speed up is known.
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: Job names of the critical path, first job first
+
+        Raises:
+            Exception: If the depends_on of the jobs are cyclic
+        """
+        specs = {job["job"]: job for job in jobs}
+        finish = {}
+        via = {}
+
+        def _finish(job_name, seen):
+
+            if job_name in seen:
+                raise Exception(f'job "{job_name}" has a cyclic depends_on')
+
+            if job_name not in finish:
+                parents = specs[job_name].get("depends_on") or []
+                start = 0
+
+                for parent in parents:
+                    if _finish(parent, seen + [job_name]) > start:
+                        start = finish[parent]
+                        via[job_name] = parent
+
+                finish[job_name] = start + int(specs[job_name]["timeout"])
+
+            return finish[job_name]
+
+        for job_name in specs:
+            _finish(job_name, [])
+
+        if not finish:
+            return []
+
+        critical_path = [max(finish, key=finish.get)]
+        seconds = finish[critical_path[0]]
+
+        while critical_path[0] in via:
+            critical_path.insert(0, via[critical_path[0]])
+
+        self.stack.logger.debug(f'critical path {" -> ".join(critical_path)} - {seconds} seconds of timeouts')
+
+        return critical_path
+
     def schedule(self):
-        sched = self.new_schedule()
-        sched.job = "vpc"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Creates vpc"
-        sched.conditions.retries = 1
-        sched.on_success = ["network_vars_set"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "network_vars_set"
-        sched.archive.timeout = 900
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Creates variable set"
-        sched.on_success = ["nat_instance"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "nat_instance"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = 'Create nat instance'
-        self.add_schedule()
-
-        return self.get_schedules()
\ No newline at end of file
+        jobs = [
+            {"job": "vpc",
+             "timeout": 1800,
+             "automation_phase": "infrastructure",
+             "human_description": "Creates vpc",
+             "retries": 1},
+            {"job": "network_vars_set",
+             "timeout": 900,
+             "automation_phase": "infrastructure",
+             "human_description": "Creates variable set",
+             "depends_on": ["vpc"]},
+            {"job": "nat_instance",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create nat instance",
+             "depends_on": ["network_vars_set"]}
+        ]
+
+        self._add_dag_schedules(jobs)
+
+        return self.get_schedules()
@@ -15,6 +15,9 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import hashlib
+import json
+
 class Main(newSchedStack):
     """
     The Main class extends newSchedStack to manage the configuration and deployment
@@ -25,6 +28,31 @@ class Main(newSchedStack):
         stackargs: Arguments for initializing the stack.
     """
 
+    # seconds between the retries of a scheduled job
+    DEFAULT_TIMEWAIT = 120
+
+    # fingerprints of inserts that succeeded, and of inserts submitted
+    # by a run that has not been confirmed yet
+    INSERT_RESOURCE_TYPE = "insert_fingerprint"
+
+    PENDING_RESOURCE_TYPE = "insert_fingerprint_pending"
+
+    # timeout of the commit_<job> jobs added by _add_commit_jobs
+    COMMIT_JOB_TIMEOUT = 600
+
+    # content hash on the CI settings items - the same string attribute
+    # is written by aws_dynamodb_upsert and codebuild_compute_autosize,
+    # which use it as their write condition
+    SETTINGS_VERSION_ATTRIBUTE = "settings_version"
+
+    SUBSTACKS = {
+        "github_webhook": 'config0-hub:::github::github_webhook',
+        "dynamodb_item": 'config0-hub:::aws_storage::aws_dynamodb_item',
+        "aws_dynamodb_upsert": 'config0-hub:::devops-solutions::aws_dynamodb_upsert',
+        "aws_ssm_params": 'config0-hub:::devops-solutions::aws_ssm_params',
+        "new_github_ssh_key": 'config0-hub:::github::new_github_ssh_key'
+    }
+
     def __init__(self, stackargs):
         """
         Initializes the Main class and sets up required parameters and substacks.
@@ -36,10 +64,18 @@ class Main(newSchedStack):
 
         self.parse.add_required(key="app_name_iac", types="str", default="iac-ci")
 
-        self.stack.add_substack('config0-hub:::github::github_webhook')
-        self.stack.add_substack('config0-hub:::aws_storage::aws_dynamodb_item', 'dynamodb_item')
-        self.stack.add_substack('config0-hub:::aws_storage::aws_ssm_param')
-        self.stack.add_substack('config0-hub:::github::new_github_ssh_key')
+        # insert substacks even when their arguments are unchanged
+        self.parse.add_optional(key="force", types="bool", default="false")
+
+        # put replaces the settings item, upsert only writes changed attributes
+        self.parse.add_optional(key="settings_write_mode", types="str", default="put")
+
+        # folder builds of this repo run at once - unset uses the
+        # step function's parallel_max_concurrency
+        self.parse.add_optional(key="parallel_max_concurrency", types="int", default="null")
+
+        for substack_name, substack in self.SUBSTACKS.items():
+            self.stack.add_substack(substack, substack_name)
 
         self.stack.init_substacks()
 
@@ -232,7 +268,7 @@ class Main(newSchedStack):
             "human_description": f'Create webhook {arguments["name"]}'
         }
 
-        return self.stack.github_webhook.insert(display=True, **inputargs)
+        return self._insert("github_webhook", **inputargs)
 
     def _get_ssh_private_key(self):
         """
@@ -269,18 +305,42 @@ class Main(newSchedStack):
             "human_description": f'Create deploy key "{self.stack.app_name_iac}"'
         }
 
-        return self.stack.new_github_ssh_key.insert(display=True,
-                                                    **inputargs)
+        return self._insert("new_github_ssh_key",
+                            state_lookup={"resource_type": "ssh_key_pair",
+                                          "provider": "config0",
+                                          "name": self.stack.app_name_iac},
+                            **inputargs)
 
     def _ssm(self):
         """
-        Adds various secrets to AWS SSM, including tokens and keys.
+        Adds various secrets to AWS SSM, including tokens and keys,
+        in a single execution.
         """
-        self._add_ssm_callback_token()
-        self._add_ssm_ssh_key()
-        self._add_ssm_iac_ci_github_token()
-        self._add_ssm_slack()
-        self._add_ssm_infracost()
+        ssm_params = {}
+
+        ssm_params.update(self._get_ssm_callback_token())
+        ssm_params.update(self._get_ssm_ssh_key())
+        ssm_params.update(self._get_ssm_iac_ci_github_token())
+        ssm_params.update(self._get_ssm_slack())
+        ssm_params.update(self._get_ssm_infracost())
+
+        arguments = {
+            "ssm_name": f"{self.stack.app_name_iac}-{self.stack.iac_ci_repo}-ssm",
+            "ssm_params_hash": self.stack.b64_encode(ssm_params),
+            "aws_default_region": self.stack.aws_default_region
+        }
+
+        inputargs = {
+            "arguments": arguments,
+            "automation_phase": "continuous_delivery",
+            "human_description": "Upload tokens and keys for repo IaC CI to ssm"
+        }
+
+        self._insert("aws_ssm_params",
+                     state_lookup={"resource_type": "ssm_parameters",
+                                   "provider": "aws",
+                                   "name": arguments["ssm_name"]},
+                     **inputargs)
 
     def _get_dynamodb_item(self):
         """
@@ -318,6 +378,10 @@ class Main(newSchedStack):
                 "S": str(self.stack.ssm_slack_webhook_hash)
             }
 
+        # process-webhook returns it to cap the parallel folder builds
+        if self.stack.get_attr("parallel_max_concurrency") is not None:
+            item["parallel_max_concurrency"] = {"N": str(int(self.stack.parallel_max_concurrency))}
+
         # config0 settings
         if self.stack.get_attr("sched_name"):
             item["sched_name"] = {"S": str(self.stack.sched_name)}
@@ -336,112 +400,71 @@ class Main(newSchedStack):
             item["cluster"] = {"S": str(self.stack.cluster)}
             item["project"] = {"S": str(self.stack.cluster)}
 
-        return self.stack.b64_encode(item)
+        return self.stack.b64_encode(self._set_settings_version(item))
 
-    def _add_ssm_iac_ci_github_token(self):
+    # dup 5817211
+    def _set_settings_version(self, item):
         """
-        Adds the IaC CI GitHub token to AWS SSM if it exists.
-        """
-        if not self.stack.get_attr("ssm_iac_ci_github_token"):
-            return
+        Set settings_version of a settings item to the sha256 of its
+        other attributes, so it changes whenever the item does.
 
-        arguments = {
-            "ssm_key": self.stack.ssm_iac_ci_github_token,
-            "ssm_value": self.stack.iac_ci_github_token,
-            "aws_default_region": self.stack.aws_default_region
-        }
+        Args:
+            item (dict): DynamoDB item
 
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Repo IaC CI Token to ssm"
-        }
+        Returns:
+            dict: The item with settings_version set
+        """
+        item.pop(self.SETTINGS_VERSION_ATTRIBUTE, None)
 
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
+        content = json.dumps(item, sort_keys=True).encode()
+        item[self.SETTINGS_VERSION_ATTRIBUTE] = {"S": hashlib.sha256(content).hexdigest()}
 
-    def _add_ssm_infracost(self):
+        return item
+
+    def _get_ssm_iac_ci_github_token(self):
         """
-        Adds the Infracost API key to AWS SSM if it exists.
+        Returns the IaC CI GitHub token SSM parameter if it exists.
         """
-        if not self.stack.get_attr("ssm_infracost_api_key"):
-            return
+        if not self.stack.get_attr("ssm_iac_ci_github_token"):
+            return {}
 
-        arguments = {
-            "ssm_key": self.stack.ssm_infracost_api_key,
-            "ssm_value": self.stack.infracost_api_key,
-            "aws_default_region": self.stack.aws_default_region
-        }
+        return {self.stack.ssm_iac_ci_github_token: self.stack.iac_ci_github_token}
 
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Infracost token to ssm"
-        }
+    def _get_ssm_infracost(self):
+        """
+        Returns the Infracost API key SSM parameter if it exists.
+        """
+        if not self.stack.get_attr("ssm_infracost_api_key"):
+            return {}
 
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
+        return {self.stack.ssm_infracost_api_key: self.stack.infracost_api_key}
 
-    def _add_ssm_callback_token(self):
+    def _get_ssm_callback_token(self):
         """
-        Adds the callback token to AWS SSM.
+        Returns the callback token SSM parameter.
         """
         self.stack.set_variable("ssm_callback_token",
                                 f"/config0-iac/imported/{self.stack.app_name_iac}/{self.stack.iac_ci_repo}/config0/callback_token")
 
-        # add config0 token
-        arguments = {
-            "ssm_key": self.stack.ssm_callback_token,
-            "ssm_value": self._get_token(),
-            "aws_default_region": self.stack.aws_default_region
-        }
-
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Config0 callback token to ssm"
-        }
+        return {self.stack.ssm_callback_token: self._get_token()}
 
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
-
-    def _add_ssm_ssh_key(self):
+    def _get_ssm_ssh_key(self):
         """
-        Adds the SSH private key to AWS SSM.
+        Returns the SSH private key SSM parameter.
         """
         self.stack.set_variable("ssm_ssh_key",
                                 f"/config0-iac/imported/{self.stack.app_name_iac}/{self.stack.iac_ci_repo}/sshkeys/private_key")
 
-        # add ssh key
-        arguments = {
-            "ssm_key": self.stack.ssm_ssh_key,
-            "ssm_value": self._get_ssh_private_key(),
-            "aws_default_region": self.stack.aws_default_region
-        }
-
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Upload private ssh key to ssm"
-        }
-
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
-
-    def _add_ssm_slack(self):
+        return {self.stack.ssm_ssh_key: self._get_ssh_private_key()}
 
+    def _get_ssm_slack(self):
+        """
+        Returns the Slack webhook SSM parameter if it exists.
+        """
         if not self.stack.get_attr("slack_webhook_hash"):
-            return
+            return {}
 
-        arguments = {
-            "ssm_key": self.stack.ssm_slack_webhook_hash,
-            "ssm_value": self.stack.slack_webhook_hash,
-            "aws_default_region": self.stack.aws_default_region
-        }
-
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "continuous_delivery",
-            "human_description": "Upload slack webhook url to ssm"
-        }
-
-        self.stack.aws_ssm_param.insert(display=True, **inputargs)
+        return {self.stack.ssm_slack_webhook_hash: self.stack.slack_webhook_hash}
 
     def _dynamodb_item(self):
 
@@ -458,8 +481,17 @@ class Main(newSchedStack):
             "human_description": f'Add register repo for iac ci {self.stack.app_name_iac}'
         }
 
-        return self.stack.dynamodb_item.insert(display=True,
-                                               **inputargs)
+        if self.stack.settings_write_mode not in ["put", "upsert"]:
+            raise Exception(f'settings_write_mode "{self.stack.settings_write_mode}" needs to be put or upsert')
+
+        if self.stack.settings_write_mode == "upsert":
+            return self._insert("aws_dynamodb_upsert",
+                                state_lookup={"resource_type": "dynamodb_item",
+                                              "provider": "aws",
+                                              "name": f"{self.stack.dynamodb_name_settings}-{self.stack.trigger_id}"},
+                                **inputargs)
+
+        return self._insert("dynamodb_item", **inputargs)
 
     def _add_iac_ci_to_db(self):
 
@@ -517,32 +549,366 @@ class Main(newSchedStack):
         self._sshdeploy()
         return self._token()
 
+    def _get_fingerprint_scope(self):
+        return f"register_repo_iac_ci.{self.stack.app_name_iac}.{self.stack.iac_ci_repo}"
+
+    def _insert(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack unless it is unchanged since its last
+        successful insert (see _insert_if_changed).
+        Returns None when the insert is skipped.
+        """
+        return self._insert_if_changed(substack_name,
+                                       state_lookup=state_lookup,
+                                       **inputargs)
+
+    # dup 5817205
+    def _get_insert_record(self, resource_type, name):
+
+        try:
+            records = self.stack.get_resource(resource_type=resource_type,
+                                              provider="config0",
+                                              name=name)
+        except Exception:
+            records = None
+
+        if not records:
+            return
+
+        return records[0]
+
+    # dup 5817206
+    def _add_insert_record(self, resource_type, name, values):
+
+        values = dict(values,
+                      _id=self.stack.get_hash(f"{resource_type}.{name}"),
+                      resource_type=resource_type,
+                      provider="config0",
+                      name=name)
+
+        self.stack.add_resource(values=values,
+                                name=name)
+
+    # dup 5817207
+    def _get_state_hash(self, state_lookup):
+        """
+        Hash of the resource an insert produced, so a resource that was
+        changed, replaced or removed since the insert is inserted again.
+        """
+        if not state_lookup:
+            return
+
+        try:
+            resources = self.stack.get_resource(**state_lookup)
+        except Exception:
+            resources = None
+
+        if not resources:
+            return "absent"
+
+        return self.stack.get_hash(json.dumps(resources[0],
+                                              sort_keys=True,
+                                              default=str))
+
+    # dup 5817208
+    def _insert_if_changed(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack, skipping it when the same arguments were
+        already inserted successfully and the resource it produced is
+        unchanged.
+
+        The fingerprint is a canonical hash of the substack reference
+        and the arguments.  It is first recorded as pending with the
+        run_id and job of the insert; the commit_<job> jobs (see
+        _add_commit_jobs) only run after the jobs before them succeeded
+        and promote the pending fingerprints of the current run.  A
+        failed insert is therefore never skipped on the next run.
+
+        With state_lookup, the resource produced by the substack is
+        hashed when the fingerprint is committed, and the insert is
+        only skipped while that resource is unchanged.
+
+        The substack references are not versioned, so the fingerprint
+        does not change with a new substack release.  Substacks
+        deploying code (lambda functions, state machines) are inserted
+        directly instead; for the others a new release is picked up
+        with "force".
+
+        Args:
+            substack_name (str): Key of the substack in SUBSTACKS
+            state_lookup (dict): get_resource arguments of the resource
+                the substack produces
+            **inputargs: Arguments for the substack insert
+
+        Returns:
+            dict: Result of the insert, or None when it was skipped
+        """
+        scope = self._get_fingerprint_scope()
+        substack_ref = self.SUBSTACKS[substack_name]
+
+        fingerprint = self.stack.get_hash(json.dumps({"substack": substack_ref,
+                                                      "arguments": inputargs["arguments"]},
+                                                     sort_keys=True,
+                                                     default=str))
+
+        name = self.stack.get_hash(f'{scope}.{substack_name}.{inputargs["human_description"]}')
+        committed = self._get_insert_record(self.INSERT_RESOURCE_TYPE, name)
+
+        if (committed and
+                committed.get("fingerprint") == fingerprint and
+                committed.get("state_hash") == self._get_state_hash(state_lookup) and
+                self.stack.get_attr("force") not in ["True", True, "true"]):
+            self.stack.logger.debug(f'skipping unchanged insert "{inputargs["human_description"]}"')
+            return
+
+        results = getattr(self.stack, substack_name).insert(display=True, **inputargs)
+
+        # without a run_id the insert cannot be confirmed and is
+        # never skipped
+        if not self.stack.get_attr("run_id"):
+            return results
+
+        self._add_insert_record(self.PENDING_RESOURCE_TYPE, name, {
+            "scope": scope,
+            "run_id": str(self.stack.run_id),
+            "job": str(self.stack.get_attr("sched_name")),
+            "substack": substack_ref,
+            "fingerprint": fingerprint,
+            "state_lookup": json.dumps(state_lookup or {}, sort_keys=True)
+        })
+
+        return results
+
     def run(self):
 
         self.stack.unset_parallel(sched_init=True)
         self.add_job("setup")
         self.add_job("connect_repo")
+        self.add_job("commit_connect_repo")
 
         return self.finalize_jobs()
 
-    def schedule(self):
+    # dup 5817209
+    def _add_commit_jobs(self, jobs):
+        """
+        Job specs with a commit_<job> job after every job nothing
+        depends on.  A commit job starts only when the jobs before it
+        succeeded, so it can confirm their inserts (see
+        _commit_confirmed_inserts).
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: jobs followed by the commit jobs
+        """
+        parents = {parent for job in jobs for parent in job.get("depends_on") or []}
+
+        commit_jobs = [{"job": f'commit_{job["job"]}',
+                        "timeout": self.COMMIT_JOB_TIMEOUT,
+                        "automation_phase": job["automation_phase"],
+                        "human_description": f'Record the inserts up to "{job["job"]}"',
+                        "depends_on": [job["job"]]}
+                       for job in jobs if job["job"] not in parents]
+
+        return jobs + commit_jobs
+
+    # dup 5817210
+    def _commit_confirmed_inserts(self, commit_job):
+        """
+        Commit the pending fingerprints that commit_job confirms - those
+        inserted by the current run in every job it depends on, directly
+        or through other jobs.
+
+        Args:
+            commit_job (str): Name of the running commit job
+
+        Returns:
+            list: Names of the committed fingerprints
+        """
+        scope = self._get_fingerprint_scope()
+        parents = {job["job"]: job.get("depends_on") or [] for job in self._get_jobs()}
+        confirmed = []
+        pending = list(parents.get(commit_job, []))
+
+        while pending:
+            job_name = pending.pop(0)
+
+            if job_name in confirmed:
+                continue
+
+            confirmed.append(job_name)
+            pending.extend(parents.get(job_name, []))
+
+        run_id = str(self.stack.get_attr("run_id"))
+
+        try:
+            records = self.stack.get_resource(resource_type=self.PENDING_RESOURCE_TYPE,
+                                              provider="config0") or []
+        except Exception:
+            records = []
+
+        committed = []
+
+        for record in records:
+            if record.get("scope") != scope or record.get("run_id") != run_id:
+                continue
+
+            if record.get("job") not in confirmed:
+                continue
+
+            self._add_insert_record(self.INSERT_RESOURCE_TYPE, record["name"], {
+                "scope": scope,
+                "substack": record["substack"],
+                "fingerprint": record["fingerprint"],
+                "state_hash": self._get_state_hash(json.loads(record.get("state_lookup") or "{}"))
+            })
 
-        sched = self.new_schedule()
-        sched.job = "setup"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.conditions.retries = 1
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Setup repo deploy key and token"
-        sched.on_success = ["connect_repo"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "connect_repo"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "continuous_delivery"
-        sched.human_description = "Connect repo with api gateway"
-        self.add_schedule()
+            committed.append(record["name"])
+
+        self.stack.logger.debug(f'committed {len(committed)} inserts of jobs {confirmed}')
+
+        return committed
+
+    def _commit_inserts(self, commit_job):
+        self.stack.init_variables()
+
+        return self._commit_confirmed_inserts(commit_job)
+
+    def run_commit_connect_repo(self):
+        return self._commit_inserts("commit_connect_repo")
+
+    def _get_jobs(self):
+
+        jobs = [
+            {"job": "setup",
+             "timeout": 1800,
+             "automation_phase": "infrastructure",
+             "human_description": "Setup repo deploy key and token",
+             "retries": 1},
+            # connect_repo uses the deploy key and token created by setup
+            {"job": "connect_repo",
+             "timeout": 1800,
+             "automation_phase": "continuous_delivery",
+             "human_description": "Connect repo with api gateway",
+             "depends_on": ["setup"]}
+        ]
+
+        return self._add_commit_jobs(jobs)
+
+    # dup 5817203
+    def _add_dag_schedules(self, jobs):
+        """
+        Add schedules for jobs that declare their dependencies with
+        "depends_on" instead of a hand wired on_success chain.
+
+        Jobs without a dependency between them are started together
+        through on_success fan out.  on_success can fan out but not
+        join, so a job listing more than one job in depends_on is
+        refused rather than started after only one of them.
+
+        Args:
+            jobs (list): Job specs with keys "job", "timeout",
+                "automation_phase", "human_description" and optionally
+                "depends_on" (list), "retries" (int) and "timewait"
+                (int, defaults to DEFAULT_TIMEWAIT)
+
+        Returns:
+            list: Jobs of the critical path, see _get_critical_path
+
+        Raises:
+            Exception: If a dependency is unknown or cyclic, or a job
+                depends on more than one job
+        """
+        children = {job["job"]: [] for job in jobs}
+
+        for job in jobs:
+            depends_on = job.get("depends_on") or []
+
+            if len(depends_on) > 1:
+                raise Exception(f'job "{job["job"]}" depends on {depends_on} - on_success can not join jobs, '
+                                f'so a job can only depend on one job; chain {depends_on} instead')
+
+            for parent in depends_on:
+                if parent not in children:
+                    raise Exception(f'job "{job["job"]}" depends on unknown job "{parent}"')
+                children[parent].append(job["job"])
+
+        critical_path = self._get_critical_path(jobs)
+
+        for job in jobs:
+            sched = self.new_schedule()
+            sched.job = job["job"]
+            sched.archive.timeout = job["timeout"]
+            sched.archive.timewait = job.get("timewait", self.DEFAULT_TIMEWAIT)
+            sched.automation_phase = job["automation_phase"]
+            sched.human_description = job["human_description"]
+
+            if job.get("retries"):
+                sched.conditions.retries = job["retries"]
+
+            if children[job["job"]]:
+                sched.on_success = children[job["job"]]
+
+            self.add_schedule()
+
+        return critical_path
+
+    # dup 5817204
+    def _get_critical_path(self, jobs):
+        """
+        Get the longest chain of depends_on, weighted by the timeout of
+        each job - the worst case time of the schedule.  The path and
+        its seconds are logged so the job to split or speed up is known.
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: Job names of the critical path, first job first
+
+        Raises:
+            Exception: If the depends_on of the jobs are cyclic
+        """
+        specs = {job["job"]: job for job in jobs}
+        finish = {}
+        via = {}
+
+        def _finish(job_name, seen):
+
+            if job_name in seen:
+                raise Exception(f'job "{job_name}" has a cyclic depends_on')
+
+            if job_name not in finish:
+                parents = specs[job_name].get("depends_on") or []
+                start = 0
+
+                for parent in parents:
+                    if _finish(parent, seen + [job_name]) > start:
+                        start = finish[parent]
+                        via[job_name] = parent
+
+                finish[job_name] = start + int(specs[job_name]["timeout"])
+
+            return finish[job_name]
+
+        for job_name in specs:
+            _finish(job_name, [])
+
+        if not finish:
+            return []
+
+        critical_path = [max(finish, key=finish.get)]
+        seconds = finish[critical_path[0]]
+
+        while critical_path[0] in via:
+            critical_path.insert(0, via[critical_path[0]])
+
+        self.stack.logger.debug(f'critical path {" -> ".join(critical_path)} - {seconds} seconds of timeouts')
+
+        return critical_path
+
+    def schedule(self):
+        self._add_dag_schedules(self._get_jobs())
 
         return self.get_schedules()
@@ -15,8 +15,22 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+# CI lambdas, without the ci_environment prefix
+CI_LAMBDAS = ["process-webhook",
+              "trigger-codebuild",
+              "pkgcode-to-s3",
+              "check-codebuild",
+              "lambda_trigger_stepf"]
+
+# deployed as container images, which do not support SnapStart -
+# none of the lambdas of this stack
+IMAGE_LAMBDAS = []
+
 class Main(newSchedStack):
 
+    # seconds between the retries of a scheduled job
+    DEFAULT_TIMEWAIT = 120
+
     def __init__(self, stackargs):
         newSchedStack.__init__(self, stackargs)
 
@@ -48,14 +62,61 @@ class Main(newSchedStack):
                                 types="int",
                                 default="7")
 
+        # import the buckets created before by the per bucket
+        # aws_s3_bucket substack
+        self.parse.add_optional(key="import_existing_buckets",
+                                types="bool",
+                                default="true")
+
         self.parse.add_optional(key="runtime",
                                 types="str",
                                 default="python3.11")
 
+        # b64 map of function (e.g. process-webhook) or "default" to
+        # provisioned_concurrency, reserved_concurrency, alias_name
+        # and snap_start
+        self.parse.add_optional(key="lambda_concurrency_hash",
+                                types="str")
+
+        # bounds of the wait between checks, doubling from the minimum
+        self.parse.add_optional(key="check_wait_min_seconds",
+                                types="int",
+                                default="10")
+
+        self.parse.add_optional(key="check_wait_max_seconds",
+                                types="int",
+                                default="120")
+
+        # seconds a push waits for newer pushes to the same
+        # trigger_id and branch - 0 disables coalescing
+        self.parse.add_optional(key="coalesce_window_seconds",
+                                types="int",
+                                default="0")
+
+        # STANDARD or EXPRESS - webhooks are processed by an express
+        # workflow that starts a STANDARD build tracking child
+        self.parse.add_optional(key="workflow_type",
+                                types="str",
+                                default="STANDARD")
+
+        # PAY_PER_REQUEST or PROVISIONED for ci-shared-runs/settings
+        self.parse.add_optional(key="dynamodb_billing_mode",
+                                types="str",
+                                default="PAY_PER_REQUEST")
+
+        # epoch seconds attribute run records expire on
+        self.parse.add_optional(key="runs_ttl_attribute",
+                                types="str",
+                                default="expire_at")
+
         # Add substack
-        self.stack.add_substack("config0-hub:::aws_storage::aws_s3_bucket")
+        self.stack.add_substack("config0-hub:::devops-solutions::aws_s3_buckets")
         self.stack.add_substack("config0-hub:::aws_storage::aws_dynamodb")
+        self.stack.add_substack("config0-hub:::devops-solutions::aws_dynamodb_table_settings",
+                                "dynamodb_table_settings")
         self.stack.add_substack("config0-hub:::aws::aws-lambda-python-codebuild", "py_lambda")
+        self.stack.add_substack("config0-hub:::devops-solutions::aws_lambda_concurrency",
+                                "lambda_concurrency")
         self.stack.add_substack("config0-hub:::aws_networking::apigw_lambda-integ", "apigw")
         self.stack.add_substack("config0-hub:::devops-solutions::codebuild_stepf_ci")
         self.stack.add_substack("config0-hub:::devops-solutions::codebuild_complete_trigger",
@@ -114,47 +175,40 @@ class Main(newSchedStack):
         # perm shared bucket
         s3_bucket = f"ci-shared-{self.stack.ci_environment}-{suffix_id}"
 
-        arguments = {
-            "bucket": s3_bucket,
-            "acl": self.stack.bucket_acl,
-            "cloud_tags_hash": cloud_tags_hash,
-            "force_destroy": "true",
-            "enable_lifecycle": "false",
-            "aws_default_region": self.stack.aws_default_region
-        }
-
-        human_description = f"Create s3 bucket {s3_bucket}"
-        inputargs = {
-            "arguments": arguments,
-            "automation_phase": "infrastructure",
-            "human_description": human_description
-        }
-
-        self.stack.aws_s3_bucket.insert(display=True, 
-                                        **inputargs)
-
-        # temp shared bucket
-        s3_bucket = f"ci-shared-{self.stack.ci_environment}-{suffix_id}-tmp"
+        bucket_specs = [
+            {
+                "bucket": s3_bucket,
+                "acl": self.stack.bucket_acl,
+                "force_destroy": "true",
+                "enable_lifecycle": "false"
+            },
+            # temp shared bucket
+            {
+                "bucket": f"{s3_bucket}-tmp",
+                "acl": self.stack.bucket_acl,
+                "expire_days": self.stack.bucket_expire_days,
+                "force_destroy": "true",
+                "enable_lifecycle": "true"
+            }
+        ]
 
         arguments = {
-            "bucket": s3_bucket,
-            "acl": self.stack.bucket_acl,
+            "buckets_name": s3_bucket,
+            "buckets_hash": self.stack.b64_encode(bucket_specs),
+            "import_existing": self.stack.import_existing_buckets,
             "cloud_tags_hash": cloud_tags_hash,
-            "expire_days": self.stack.bucket_expire_days,
-            "force_destroy": "true",
-            "enable_lifecycle": "true",
             "aws_default_region": self.stack.aws_default_region
         }
 
-        human_description = f"Create s3 bucket {s3_bucket}"
+        human_description = f"Create s3 buckets {s3_bucket} and {s3_bucket}-tmp"
         inputargs = {
             "arguments": arguments,
             "automation_phase": "infrastructure",
             "human_description": human_description
         }
 
-        self.stack.aws_s3_bucket.insert(display=True,
-                                       **inputargs)
+        self.stack.aws_s3_buckets.insert(display=True,
+                                         **inputargs)
 
     def _dynamodb(self, cloud_tags_hash):
         dynamodb_names = [
@@ -178,6 +232,69 @@ class Main(newSchedStack):
 
             self.stack.aws_dynamodb.insert(display=True, **inputargs)
 
+    def _dynamodb_settings(self):
+        dynamodb_names = {
+            "ci-shared-runs": "runs",
+            "ci-shared-settings": "settings"
+        }
+
+        for dynamodb_name, table_type in dynamodb_names.items():
+            arguments = self._get_dynamodb_table_settings(table_type)
+            arguments["table_name"] = dynamodb_name
+
+            human_description = f"Set billing mode, ttl and indexes of dynamodb {dynamodb_name}"
+            inputargs = {
+                "arguments": arguments,
+                "automation_phase": "infrastructure",
+                "human_description": human_description
+            }
+
+            self.stack.dynamodb_table_settings.insert(display=True, **inputargs)
+
+    # dup 5817212
+    def _get_dynamodb_table_settings(self, table_type):
+        """
+        Get the dynamodb_table_settings arguments of a CI table.
+
+        Runs get a trigger_id-branch-index and expire on
+        runs_ttl_attribute; settings also get a type-repo_name-index
+        (registered repos).  TTL only removes the items that carry the
+        attribute - in these stacks the state machine writes it on
+        coalescing keys, other run records need it from the lambdas
+        writing them.
+        The indexes are there for Query; the lambdas outside this repo
+        keep Scan until they use them.
+
+        Args:
+            table_type (str): "runs" or "settings"
+
+        Returns:
+            dict: Arguments for dynamodb_table_settings without the table name
+        """
+        if self.stack.dynamodb_billing_mode not in ["PAY_PER_REQUEST", "PROVISIONED"]:
+            raise Exception(f'dynamodb_billing_mode "{self.stack.dynamodb_billing_mode}" needs to be PAY_PER_REQUEST or PROVISIONED')
+
+        indexes = [{"name": "trigger_id-branch-index",
+                    "hash_key": "trigger_id",
+                    "range_key": "branch"}]
+
+        arguments = {
+            "billing_mode": self.stack.dynamodb_billing_mode,
+            "aws_default_region": self.stack.aws_default_region
+        }
+
+        if table_type == "runs" and self.stack.get_attr("runs_ttl_attribute"):
+            arguments["ttl_attribute"] = self.stack.runs_ttl_attribute
+
+        if table_type == "settings":
+            indexes.append({"name": "type-repo_name-index",
+                            "hash_key": "type",
+                            "range_key": "repo_name"})
+
+        arguments["indexes_hash"] = self.stack.b64_encode(indexes)
+
+        return arguments
+
     def _get_log_policy(self):
         _statement = {
             "Action": [
@@ -208,6 +325,7 @@ class Main(newSchedStack):
                 "dynamodb:UpdateTimeToLive",
                 "dynamodb:PutItem",
                 "dynamodb:PartiQLUpdate",
+                # kept until the lambdas query the indexes below
                 "dynamodb:Scan",
                 "dynamodb:UpdateItem",
                 "dynamodb:UpdateTable",
@@ -223,7 +341,9 @@ class Main(newSchedStack):
                 "dynamodb:PartiQLDelete"
             ],
             "Resource": [arn_dynamodb_name_runs, 
-                        arn_dynamodb_name_settings]
+                        arn_dynamodb_name_settings,
+                        f"{arn_dynamodb_name_runs}/index/*",
+                        f"{arn_dynamodb_name_settings}/index/*"]
         }
 
         return _statement
@@ -397,13 +517,27 @@ class Main(newSchedStack):
     def _stepf(self, cloud_tags_hash):
         stepf_name = self._get_stepf_name()
 
+        if self.stack.workflow_type not in ["STANDARD", "EXPRESS"]:
+            raise Exception(f'workflow_type "{self.stack.workflow_type}" needs to be STANDARD or EXPRESS')
+
         arguments = {
             "step_function_name": stepf_name,
             "ci_environment": self.stack.ci_environment,
+            "coalesce_window_seconds": self.stack.coalesce_window_seconds,
+            "runs_ttl_attribute": self.stack.get_attr("runs_ttl_attribute") or "",
+            "check_wait_min_seconds": self.stack.check_wait_min_seconds,
+            "check_wait_max_seconds": self.stack.check_wait_max_seconds,
+            "workflow_type": self.stack.workflow_type,
             "cloud_tags_hash": cloud_tags_hash,
             "aws_default_region": self.stack.aws_default_region
         }
 
+        # state machine invokes the lambdas through their aliases
+        lambda_aliases = self._get_lambda_aliases()
+
+        if lambda_aliases:
+            arguments["lambda_aliases_hash"] = self.stack.b64_encode(lambda_aliases)
+
         human_description = f"Create step function {stepf_name}"
 
         inputargs = {
@@ -489,6 +623,14 @@ class Main(newSchedStack):
 
         self.stack.unset_parallel()
 
+        # publish the functions and set their concurrency once deployed
+        self.stack.set_parallel()
+
+        for function_name in ["process-webhook", "trigger-codebuild", "pkgcode-to-s3", "check-codebuild"]:
+            self._lambda_concurrency(function_name)
+
+        self.stack.unset_parallel()
+
     # job definitions are prefixed with run_
     def run_setup(self):
         self._setup_vars()
@@ -504,6 +646,10 @@ class Main(newSchedStack):
         # create dynamodb table
         self._dynamodb(cloud_tags_hash)
 
+        # indexes and ttl once the tables exist
+        self.stack.unset_parallel()
+        self._dynamodb_settings()
+
         return True
 
     def run_lambda_stepf(self):
@@ -564,6 +710,7 @@ class Main(newSchedStack):
         }
 
         self.stack.py_lambda.insert(display=True, **inputargs)
+        self._lambda_concurrency("lambda_trigger_stepf")
 
     def run_apigw(self):
         self._setup_vars()
@@ -573,7 +720,7 @@ class Main(newSchedStack):
         apigateway_name = f"ci-shared-{self.stack.ci_environment}"
         
         # will trigger the lambda function that will trigger the step function
-        lambda_name = f"{self.stack.ci_environment}-lambda_trigger_stepf"
+        lambda_name = self._get_lambda_target("lambda_trigger_stepf")
 
         arguments = {
             "apigateway_name": apigateway_name,
@@ -595,7 +742,7 @@ class Main(newSchedStack):
         self._setup_vars()
         self.stack.verify_variables()
 
-        lambda_name = f"{self.stack.ci_environment}-check-codebuild"
+        lambda_name = self._get_lambda_target("check-codebuild")
         topic_name = f"{self.stack.ci_environment}-codebuild-complete-trigger"
 
         cloud_tags_hash = self._set_cloud_tag_hash()
@@ -616,6 +763,152 @@ class Main(newSchedStack):
 
         return self.stack.sns_subscription.insert(display=True, **inputargs)
 
+    # dup 5817213
+    def _get_lambda_concurrency_arguments(self, function_name):
+        """
+        Get the aws_lambda_concurrency arguments of a CI Lambda.
+
+        lambda_concurrency_hash is a base64 encoded map of function
+        name suffix (e.g. "process-webhook") or "default" to settings
+        with the keys provisioned_concurrency, reserved_concurrency,
+        alias_name and snap_start.  Provisioned concurrency and
+        SnapStart attach to a published version behind an alias.
+        Settings for a function outside CI_LAMBDAS are refused, and so
+        is SnapStart for the container image functions of IMAGE_LAMBDAS.
+
+        Args:
+            function_name (str): Function name without the environment prefix
+
+        Returns:
+            dict: Arguments of the aws_lambda_concurrency insert, empty
+                when the function has no settings
+
+        Raises:
+            Exception: If lambda_concurrency_hash can not be decoded or
+                the settings are not valid
+        """
+        if not self.stack.get_attr("lambda_concurrency_hash"):
+            return {}
+
+        try:
+            concurrency = self.stack.b64_decode(self.stack.lambda_concurrency_hash)
+        except Exception as e:
+            raise Exception(f"lambda_concurrency_hash is not a base64 encoded map - {e}")
+
+        if not isinstance(concurrency, dict):
+            raise Exception("lambda_concurrency_hash needs to be a map of function name to settings")
+
+        unknown = sorted(set(concurrency) - set(CI_LAMBDAS) - {"default"})
+
+        if unknown:
+            raise Exception(f"lambda_concurrency_hash has settings for {unknown} - this stack creates {CI_LAMBDAS}")
+
+        settings = dict(concurrency.get("default") or {})
+        settings.update(concurrency.get(function_name) or {})
+
+        if not settings:
+            return {}
+
+        arguments = {}
+
+        for key in ["provisioned_concurrency", "reserved_concurrency"]:
+            if settings.get(key) in [None, ""]:
+                continue
+
+            value = int(settings[key])
+
+            if value < 0:
+                raise Exception(f'{key} for {function_name} needs to be 0 or more')
+
+            arguments[key] = value
+
+        provisioned = arguments.get("provisioned_concurrency", 0)
+        snap_start = settings.get("snap_start") in ["True", True, "true"]
+
+        if provisioned and arguments.get("reserved_concurrency") is not None and \
+                arguments["reserved_concurrency"] < provisioned:
+            raise Exception(f'reserved_concurrency for {function_name} needs to be at least provisioned_concurrency')
+
+        if snap_start and provisioned:
+            raise Exception(f'{function_name} can use snap_start or provisioned_concurrency but not both')
+
+        if snap_start and function_name in IMAGE_LAMBDAS:
+            raise Exception(f'{function_name} is a container image function - snap_start does not support container images')
+
+        if snap_start:
+            _version = self.stack.runtime.replace("python", "").split(".")
+
+            if len(_version) != 2 or (int(_version[0]), int(_version[1])) < (3, 12):
+                raise Exception(f'snap_start for {function_name} needs runtime python3.12 or later - runtime {self.stack.runtime}')
+
+            arguments["snap_start"] = True
+
+        # invocations go through the alias so the published
+        # version keeps its provisioned environments
+        if provisioned or snap_start or settings.get("alias_name"):
+            arguments["alias_name"] = settings.get("alias_name") or "live"
+
+        return arguments
+
+    # dup 5817214
+    def _get_lambda_aliases(self):
+        """
+        Aliases the callers of CI_LAMBDAS invoke, from
+        lambda_concurrency_hash.
+
+        Returns:
+            dict: Function name to alias, for the functions with one
+        """
+        aliases = {}
+
+        for function_name in CI_LAMBDAS:
+            alias_name = self._get_lambda_concurrency_arguments(function_name).get("alias_name")
+
+            if alias_name:
+                aliases[function_name] = alias_name
+
+        return aliases
+
+    def _lambda_concurrency(self, function_name):
+        """
+        Publish function_name behind its alias and set its concurrency
+        when lambda_concurrency_hash has settings for it.  py_lambda
+        changes $LATEST, so this follows every py_lambda insert.
+        """
+        arguments = self._get_lambda_concurrency_arguments(function_name)
+
+        if not arguments:
+            return
+
+        lambda_name = f"{self.stack.ci_environment}-{function_name}"
+
+        arguments.update({
+            "function_name": lambda_name,
+            "aws_default_region": self.stack.aws_default_region
+        })
+
+        inputargs = {
+            "arguments": arguments,
+            "automation_phase": "infrastructure",
+            "human_description": f"Set concurrency of lambda function {lambda_name}"
+        }
+
+        return self.stack.lambda_concurrency.insert(display=True, **inputargs)
+
+    def _get_lambda_target(self, function_name):
+        """
+        Name the callers invoke function_name by - qualified with its
+        alias when it has one, so invocations reach the published
+        version with the provisioned environments.
+        """
+        lambda_name = f"{self.stack.ci_environment}-{function_name}"
+        alias_name = self._get_lambda_aliases().get(function_name)
+
+        if not alias_name:
+            return lambda_name
+
+        return f"{lambda_name}:{alias_name}"
+
     def run(self):
         self.stack.unset_parallel(sched_init=True)
         self.add_job("setup")
@@ -626,50 +919,147 @@ class Main(newSchedStack):
 
         return self.finalize_jobs()
 
+    # dup 5817203
+    def _add_dag_schedules(self, jobs):
+        """
+        Add schedules for jobs that declare their dependencies with
+        "depends_on" instead of a hand wired on_success chain.
+
+        Jobs without a dependency between them are started together
+        through on_success fan out.  on_success can fan out but not
+        join, so a job listing more than one job in depends_on is
+        refused rather than started after only one of them.
+
+        Args:
+            jobs (list): Job specs with keys "job", "timeout",
+                "automation_phase", "human_description" and optionally
+                "depends_on" (list), "retries" (int) and "timewait"
+                (int, defaults to DEFAULT_TIMEWAIT)
+
+        Returns:
+            list: Jobs of the critical path, see _get_critical_path
+
+        Raises:
+            Exception: If a dependency is unknown or cyclic, or a job
+                depends on more than one job
+        """
+        children = {job["job"]: [] for job in jobs}
+
+        for job in jobs:
+            depends_on = job.get("depends_on") or []
+
+            if len(depends_on) > 1:
+                raise Exception(f'job "{job["job"]}" depends on {depends_on} - on_success can not join jobs, '
+                                f'so a job can only depend on one job; chain {depends_on} instead')
+
+            for parent in depends_on:
+                if parent not in children:
+                    raise Exception(f'job "{job["job"]}" depends on unknown job "{parent}"')
+                children[parent].append(job["job"])
+
+        critical_path = self._get_critical_path(jobs)
+
+        for job in jobs:
+            sched = self.new_schedule()
+            sched.job = job["job"]
+            sched.archive.timeout = job["timeout"]
+            sched.archive.timewait = job.get("timewait", self.DEFAULT_TIMEWAIT)
+            sched.automation_phase = job["automation_phase"]
+            sched.human_description = job["human_description"]
+
+            if job.get("retries"):
+                sched.conditions.retries = job["retries"]
+
+            if children[job["job"]]:
+                sched.on_success = children[job["job"]]
+
+            self.add_schedule()
+
+        return critical_path
+
+    # dup 5817204
+    def _get_critical_path(self, jobs):
+        """
+        Get the longest chain of depends_on, weighted by the timeout of
+        each job - the worst case time of the schedule.  The path and
+        its seconds are logged so the job to split or speed up is known.
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: Job names of the critical path, first job first
+
+        Raises:
+            Exception: If the depends_on of the jobs are cyclic
+        """
+        specs = {job["job"]: job for job in jobs}
+        finish = {}
+        via = {}
+
+        def _finish(job_name, seen):
+
+            if job_name in seen:
+                raise Exception(f'job "{job_name}" has a cyclic depends_on')
+
+            if job_name not in finish:
+                parents = specs[job_name].get("depends_on") or []
+                start = 0
+
+                for parent in parents:
+                    if _finish(parent, seen + [job_name]) > start:
+                        start = finish[parent]
+                        via[job_name] = parent
+
+                finish[job_name] = start + int(specs[job_name]["timeout"])
+
+            return finish[job_name]
+
+        for job_name in specs:
+            _finish(job_name, [])
+
+        if not finish:
+            return []
+
+        critical_path = [max(finish, key=finish.get)]
+        seconds = finish[critical_path[0]]
+
+        while critical_path[0] in via:
+            critical_path.insert(0, via[critical_path[0]])
+
+        self.stack.logger.debug(f'critical path {" -> ".join(critical_path)} - {seconds} seconds of timeouts')
+
+        return critical_path
+
     def schedule(self):
-        sched = self.new_schedule()
-        sched.job = "setup"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Setup s3 and dynamodb"
-        sched.conditions.retries = 1
-        sched.on_success = ["lambda_stepf"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "lambda_stepf"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Setup lambdas and stepf"
-        sched.on_success = ["trigger_stepf"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "trigger_stepf"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create Lambda Trigger Step function"
-        sched.on_success = ["apigw"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "apigw"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create apigateway"
-        sched.on_success = ["sns_subscription"]
-        self.add_schedule()
-
-        sched = self.new_schedule()
-        sched.job = "sns_subscription"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create Codebuild Complete Trigger"
-        self.add_schedule()
+        jobs = [
+            {"job": "setup",
+             "timeout": 1800,
+             "automation_phase": "infrastructure",
+             "human_description": "Setup s3 and dynamodb",
+             "retries": 1},
+            {"job": "lambda_stepf",
+             "timeout": 1800,
+             "automation_phase": "infrastructure",
+             "human_description": "Setup lambdas and stepf",
+             "depends_on": ["setup"]},
+            {"job": "trigger_stepf",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create Lambda Trigger Step function",
+             "depends_on": ["lambda_stepf"]},
+            {"job": "apigw",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create apigateway",
+             "depends_on": ["trigger_stepf"]},
+            {"job": "sns_subscription",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create Codebuild Complete Trigger",
+             "depends_on": ["lambda_stepf"]}
+        ]
+
+        self._add_dag_schedules(jobs)
 
         return self.get_schedules()
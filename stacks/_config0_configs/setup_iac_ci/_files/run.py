@@ -15,8 +15,40 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import json
+
+# CI lambdas this stack creates, without the app_name prefix -
+# add the others here when their creation below is re-enabled
+CI_LAMBDAS = ["process-webhook",
+              "lambda_trigger_stepf"]
+
+# deployed as container images, which do not support SnapStart
+IMAGE_LAMBDAS = ["process-webhook"]
+
 class Main(newSchedStack):
 
+    # seconds between the retries of a scheduled job
+    DEFAULT_TIMEWAIT = 120
+
+    # fingerprints of inserts that succeeded, and of inserts submitted
+    # by a run that has not been confirmed yet
+    INSERT_RESOURCE_TYPE = "insert_fingerprint"
+
+    PENDING_RESOURCE_TYPE = "insert_fingerprint_pending"
+
+    # timeout of the commit_<job> jobs added by _add_commit_jobs
+    COMMIT_JOB_TIMEOUT = 600
+
+    SUBSTACKS = {
+        "aws_dynamodb": "config0-hub:::aws_storage::aws_dynamodb",
+        "dynamodb_table_settings": "config0-hub:::devops-solutions::aws_dynamodb_table_settings",
+        "apigw": "config0-hub:::aws_networking::apigw_lambda-integ",
+        "py_lambda": "config0-hub:::aws::aws-lambda-python-codebuild",
+        "lambda_concurrency": "config0-hub:::devops-solutions::aws_lambda_concurrency",
+        "iac_ci_stepf": "config0-hub:::devops-solutions::iac_ci_stepf",
+        "sns_subscription": "config0-hub:::devops-solutions::iac_ci_complete_trigger"
+    }
+
     def __init__(self, stackargs):
         """
         Initialize the Main class with the provided stack arguments.
@@ -29,14 +61,46 @@ class Main(newSchedStack):
         self.parse.add_required(key="app_name", types="str", default="iac-ci")
         self.parse.add_optional(key="cloud_tags_hash", types="str")
         self.parse.add_optional(key="runtime", types="str", default="python3.11")
+
+        # b64 map of function (e.g. process-webhook) or "default" to
+        # provisioned_concurrency, reserved_concurrency, alias_name
+        # and snap_start
+        self.parse.add_optional(key="lambda_concurrency_hash", types="str")
         self.parse.add_optional(key="aws_default_region", types="str", default="us-east-1")
 
+        # insert substacks even when their arguments are unchanged
+        self.parse.add_optional(key="force", types="bool", default="false")
+
+        # poll - check-codebuild every 30 seconds
+        # task_token - park the execution until the build state change event
+        self.parse.add_optional(key="codebuild_wait", types="str", default="poll")
+
+        # task_token needs trigger-codebuild and check-codebuild
+        # releases that handle task tokens
+        self.parse.add_optional(key="task_token_lambda_support", types="bool", default="false")
+
+        # bounds of the wait between checks, doubling from the minimum
+        self.parse.add_optional(key="check_wait_min_seconds", types="int", default="10")
+        self.parse.add_optional(key="check_wait_max_seconds", types="int", default="120")
+
+        # STANDARD or EXPRESS - webhooks are processed by an express
+        # workflow that starts a STANDARD build tracking child
+        self.parse.add_optional(key="workflow_type", types="str", default="STANDARD")
+
+        # PAY_PER_REQUEST or PROVISIONED for the runs/settings tables
+        self.parse.add_optional(key="dynamodb_billing_mode", types="str", default="PAY_PER_REQUEST")
+
+        # epoch seconds attribute run records expire on
+        self.parse.add_optional(key="runs_ttl_attribute", types="str", default="expire_at")
+
+        # folder builds at once (unless set per repo) and the folder
+        # count from which they run in a distributed map
+        self.parse.add_optional(key="parallel_max_concurrency", types="int", default="10")
+        self.parse.add_optional(key="parallel_distributed_threshold", types="int", default="100")
+
         # Initialize substacks
-        self.stack.add_substack("config0-hub:::aws_storage::aws_dynamodb")
-        self.stack.add_substack("config0-hub:::aws_networking::apigw_lambda-integ", "apigw")
-        self.stack.add_substack("config0-hub:::aws::aws-lambda-python-codebuild", "py_lambda")
-        self.stack.add_substack("config0-hub:::devops-solutions::iac_ci_stepf")
-        self.stack.add_substack("config0-hub:::devops-solutions::iac_ci_complete_trigger", "sns_subscription")
+        for substack_name, substack in self.SUBSTACKS.items():
+            self.stack.add_substack(substack, substack_name)
 
         # Initialize execution groups
         self.stack.add_execgroup("config0-hub:::github::lambda_trigger_stepf")
@@ -76,7 +140,8 @@ class Main(newSchedStack):
         env_vars = {
             "ENV": "build",
             "DEBUG_IAC_CI": "true",
-            "BUILD_TTL": "60"
+            "BUILD_TTL": "60",
+            "CODEBUILD_WAIT": self.stack.codebuild_wait
         }
         webhook_hash = self.stack.b64_encode(env_vars)
 
@@ -107,7 +172,76 @@ class Main(newSchedStack):
                 "human_description": f"Create DynamoDB {dynamodb_name}"
             }
 
-            self.stack.aws_dynamodb.insert(display=True, **inputargs)
+            self._insert("aws_dynamodb", **inputargs)
+
+    def _dynamodb_settings(self):
+        """
+        Set billing mode, ttl and indexes of the DynamoDB tables.
+        """
+        dynamodb_names = {
+            self.stack.dynamodb_name_runs: "runs",
+            self.stack.dynamodb_name_settings: "settings"
+        }
+
+        for dynamodb_name, table_type in dynamodb_names.items():
+            arguments = self._get_dynamodb_table_settings(table_type)
+            arguments["table_name"] = dynamodb_name
+
+            inputargs = {
+                "arguments": arguments,
+                "automation_phase": "infrastructure",
+                "human_description": f"Set billing mode, ttl and indexes of DynamoDB {dynamodb_name}"
+            }
+
+            self._insert("dynamodb_table_settings",
+                         state_lookup={"resource_type": "dynamodb_table_settings",
+                                       "provider": "aws",
+                                       "name": f"{dynamodb_name}-settings"},
+                         **inputargs)
+
+    # dup 5817212
+    def _get_dynamodb_table_settings(self, table_type):
+        """
+        Get the dynamodb_table_settings arguments of a CI table.
+
+        Runs get a trigger_id-branch-index and expire on
+        runs_ttl_attribute; settings also get a type-repo_name-index
+        (registered repos).  TTL only removes the items that carry the
+        attribute - in these stacks the state machine writes it on
+        coalescing keys, other run records need it from the lambdas
+        writing them.
+        The indexes are there for Query; the lambdas outside this repo
+        keep Scan until they use them.
+
+        Args:
+            table_type (str): "runs" or "settings"
+
+        Returns:
+            dict: Arguments for dynamodb_table_settings without the table name
+        """
+        if self.stack.dynamodb_billing_mode not in ["PAY_PER_REQUEST", "PROVISIONED"]:
+            raise Exception(f'dynamodb_billing_mode "{self.stack.dynamodb_billing_mode}" needs to be PAY_PER_REQUEST or PROVISIONED')
+
+        indexes = [{"name": "trigger_id-branch-index",
+                    "hash_key": "trigger_id",
+                    "range_key": "branch"}]
+
+        arguments = {
+            "billing_mode": self.stack.dynamodb_billing_mode,
+            "aws_default_region": self.stack.aws_default_region
+        }
+
+        if table_type == "runs" and self.stack.get_attr("runs_ttl_attribute"):
+            arguments["ttl_attribute"] = self.stack.runs_ttl_attribute
+
+        if table_type == "settings":
+            indexes.append({"name": "type-repo_name-index",
+                            "hash_key": "type",
+                            "range_key": "repo_name"})
+
+        arguments["indexes_hash"] = self.stack.b64_encode(indexes)
+
+        return arguments
 
     @staticmethod
     def _get_log_policy():
@@ -152,6 +286,7 @@ class Main(newSchedStack):
                 "dynamodb:UpdateTimeToLive",
                 "dynamodb:PutItem",
                 "dynamodb:PartiQLUpdate",
+                # kept until the lambdas query the indexes below
                 "dynamodb:Scan",
                 "dynamodb:UpdateItem",
                 "dynamodb:UpdateTable",
@@ -168,7 +303,9 @@ class Main(newSchedStack):
             ],
             "Resource": [
                 arn_dynamodb_name_runs,
-                arn_dynamodb_name_settings
+                arn_dynamodb_name_settings,
+                f"{arn_dynamodb_name_runs}/index/*",
+                f"{arn_dynamodb_name_settings}/index/*"
             ]
         }
         return _statement
@@ -332,6 +469,33 @@ class Main(newSchedStack):
 
         return _statement
 
+    def _get_task_token_policy(self):
+        """
+        Get the IAM policy for resuming executions waiting on a task token.
+
+        Returns:
+            dict: IAM policy for Step Functions task tokens of the
+                state machine and its build tracking child.
+        """
+        _action = [
+            "states:SendTaskSuccess",
+            "states:SendTaskFailure",
+            "states:SendTaskHeartbeat"
+        ]
+
+        arn_stepf = f"arn:aws:states:{self.stack.aws_default_region}:${{aws_account_id}}:stateMachine:{self._get_stepf_name()}"
+
+        _statement = {
+            "Action": _action,
+            "Resource": [
+                arn_stepf,
+                f"{arn_stepf}-build"
+            ],
+            "Effect": "Allow"
+        }
+
+        return _statement
+
     def _get_policy_template_hash(self):
         """
         Generate a base64-encoded IAM policy template.
@@ -354,6 +518,9 @@ class Main(newSchedStack):
         statements.append(self._get_lambda_policy())
         statements.append(self._get_codebuild_policy())
 
+        if self.stack.codebuild_wait == "task_token":
+            statements.append(self._get_task_token_policy())
+
         policy = {
             "Version": "2012-10-17",
             "Statement": statements
@@ -409,18 +576,45 @@ class Main(newSchedStack):
             cloud_tags_hash (str): Encoded cloud tags hash.
         """
         stepf_name = self._get_stepf_name()
+
+        if self.stack.codebuild_wait not in ["poll", "task_token"]:
+            raise Exception(f'codebuild_wait "{self.stack.codebuild_wait}" needs to be poll or task_token')
+
+        if self.stack.codebuild_wait == "task_token" and self.stack.task_token_lambda_support not in ["True", True, "true"]:
+            raise Exception("codebuild_wait task_token requires task_token_lambda_support - "
+                            "trigger-codebuild and check-codebuild need to handle task tokens")
+
+        if self.stack.workflow_type not in ["STANDARD", "EXPRESS"]:
+            raise Exception(f'workflow_type "{self.stack.workflow_type}" needs to be STANDARD or EXPRESS')
+
         arguments = {
             "step_function_name": stepf_name,
+            "codebuild_wait": self.stack.codebuild_wait,
+            "task_token_lambda_support": self.stack.task_token_lambda_support,
+            "workflow_type": self.stack.workflow_type,
+            "check_wait_min_seconds": self.stack.check_wait_min_seconds,
+            "check_wait_max_seconds": self.stack.check_wait_max_seconds,
+            "parallel_max_concurrency": self.stack.parallel_max_concurrency,
+            "parallel_distributed_threshold": self.stack.parallel_distributed_threshold,
+            "map_results_bucket": self.stack.tmp_bucket,
             "cloud_tags_hash": cloud_tags_hash,
             "aws_default_region": self.stack.aws_default_region
         }
 
+        # state machine invokes the lambdas through their aliases
+        lambda_aliases = self._get_lambda_aliases()
+
+        if lambda_aliases:
+            arguments["lambda_aliases_hash"] = self.stack.b64_encode(lambda_aliases)
+
         inputargs = {
             "arguments": arguments,
             "automation_phase": "infrastructure",
             "human_description": f"Create Step Function {stepf_name}"
         }
 
+        # deploys the state machine definition of the iac_ci_stepf
+        # release, so it is never skipped
         self.stack.iac_ci_stepf.insert(display=True, **inputargs)
 
     def _lambda(self, cloud_tags_hash):
@@ -463,6 +657,7 @@ class Main(newSchedStack):
             "human_description": f"Create Lambda function {lambda_name}"
         }
 
+        # deploys the function code, so it is never skipped
         self.stack.py_lambda.insert(display=True, **inputargs)
 
         ##############################################################
@@ -495,6 +690,9 @@ class Main(newSchedStack):
 
         self.stack.unset_parallel()
 
+        # publish the function and set its concurrency once deployed
+        self._lambda_concurrency("process-webhook")
+
     def _init_common(self):
         """
         Initialize common variables required for the infrastructure setup.
@@ -520,6 +718,10 @@ class Main(newSchedStack):
         self.stack.verify_variables()
         self._init_common()
         self._dynamodb(self._set_cloud_tag_hash())
+
+        # indexes and ttl once the tables exist
+        self.stack.unset_parallel()
+        self._dynamodb_settings()
         return True
 
     def run_lambda_stepf(self):
@@ -585,6 +787,7 @@ class Main(newSchedStack):
         }
 
         self.stack.py_lambda.insert(display=True, **inputargs)
+        self._lambda_concurrency("lambda_trigger_stepf")
 
     def run_apigw(self):
         """
@@ -598,7 +801,7 @@ class Main(newSchedStack):
         self._init_common()
 
         cloud_tags_hash = self._set_cloud_tag_hash()
-        lambda_name = f"{self.stack.app_name}-lambda_trigger_stepf"
+        lambda_name = self._get_lambda_target("lambda_trigger_stepf")
 
         arguments = {
             "apigateway_name": self.stack.app_name,
@@ -613,7 +816,7 @@ class Main(newSchedStack):
             "human_description": f"Create API Gateway {self.stack.app_name}"
         }
 
-        return self.stack.apigw.insert(display=True, **inputargs)
+        return self._insert("apigw", **inputargs)
 
     def run_sns_subscription(self):
         """
@@ -644,7 +847,283 @@ class Main(newSchedStack):
             "human_description": f"Codebuild SNS subscription {self.stack.app_name}"
         }
 
-        return self.stack.sns_subscription.insert(display=True, **inputargs)
+        return self._insert("sns_subscription", **inputargs)
+
+    # dup 5817213
+    def _get_lambda_concurrency_arguments(self, function_name):
+        """
+        Get the aws_lambda_concurrency arguments of a CI Lambda.
+
+        lambda_concurrency_hash is a base64 encoded map of function
+        name suffix (e.g. "process-webhook") or "default" to settings
+        with the keys provisioned_concurrency, reserved_concurrency,
+        alias_name and snap_start.  Provisioned concurrency and
+        SnapStart attach to a published version behind an alias.
+        Settings for a function outside CI_LAMBDAS are refused, and so
+        is SnapStart for the container image functions of IMAGE_LAMBDAS.
+
+        Args:
+            function_name (str): Function name without the environment prefix
+
+        Returns:
+            dict: Arguments of the aws_lambda_concurrency insert, empty
+                when the function has no settings
+
+        Raises:
+            Exception: If lambda_concurrency_hash can not be decoded or
+                the settings are not valid
+        """
+        if not self.stack.get_attr("lambda_concurrency_hash"):
+            return {}
+
+        try:
+            concurrency = self.stack.b64_decode(self.stack.lambda_concurrency_hash)
+        except Exception as e:
+            raise Exception(f"lambda_concurrency_hash is not a base64 encoded map - {e}")
+
+        if not isinstance(concurrency, dict):
+            raise Exception("lambda_concurrency_hash needs to be a map of function name to settings")
+
+        unknown = sorted(set(concurrency) - set(CI_LAMBDAS) - {"default"})
+
+        if unknown:
+            raise Exception(f"lambda_concurrency_hash has settings for {unknown} - this stack creates {CI_LAMBDAS}")
+
+        settings = dict(concurrency.get("default") or {})
+        settings.update(concurrency.get(function_name) or {})
+
+        if not settings:
+            return {}
+
+        arguments = {}
+
+        for key in ["provisioned_concurrency", "reserved_concurrency"]:
+            if settings.get(key) in [None, ""]:
+                continue
+
+            value = int(settings[key])
+
+            if value < 0:
+                raise Exception(f'{key} for {function_name} needs to be 0 or more')
+
+            arguments[key] = value
+
+        provisioned = arguments.get("provisioned_concurrency", 0)
+        snap_start = settings.get("snap_start") in ["True", True, "true"]
+
+        if provisioned and arguments.get("reserved_concurrency") is not None and \
+                arguments["reserved_concurrency"] < provisioned:
+            raise Exception(f'reserved_concurrency for {function_name} needs to be at least provisioned_concurrency')
+
+        if snap_start and provisioned:
+            raise Exception(f'{function_name} can use snap_start or provisioned_concurrency but not both')
+
+        if snap_start and function_name in IMAGE_LAMBDAS:
+            raise Exception(f'{function_name} is a container image function - snap_start does not support container images')
+
+        if snap_start:
+            _version = self.stack.runtime.replace("python", "").split(".")
+
+            if len(_version) != 2 or (int(_version[0]), int(_version[1])) < (3, 12):
+                raise Exception(f'snap_start for {function_name} needs runtime python3.12 or later - runtime {self.stack.runtime}')
+
+            arguments["snap_start"] = True
+
+        # invocations go through the alias so the published
+        # version keeps its provisioned environments
+        if provisioned or snap_start or settings.get("alias_name"):
+            arguments["alias_name"] = settings.get("alias_name") or "live"
+
+        return arguments
+
+    # dup 5817214
+    def _get_lambda_aliases(self):
+        """
+        Aliases the callers of CI_LAMBDAS invoke, from
+        lambda_concurrency_hash.
+
+        Returns:
+            dict: Function name to alias, for the functions with one
+        """
+        aliases = {}
+
+        for function_name in CI_LAMBDAS:
+            alias_name = self._get_lambda_concurrency_arguments(function_name).get("alias_name")
+
+            if alias_name:
+                aliases[function_name] = alias_name
+
+        return aliases
+
+    def _lambda_concurrency(self, function_name):
+        """
+        Publish function_name behind its alias and set its concurrency
+        when lambda_concurrency_hash has settings for it.  py_lambda
+        changes $LATEST, so this follows every py_lambda insert.
+        """
+        arguments = self._get_lambda_concurrency_arguments(function_name)
+
+        if not arguments:
+            return
+
+        lambda_name = f"{self.stack.app_name}-{function_name}"
+
+        arguments.update({
+            "function_name": lambda_name,
+            "aws_default_region": self.stack.aws_default_region
+        })
+
+        inputargs = {
+            "arguments": arguments,
+            "automation_phase": "infrastructure",
+            "human_description": f"Set concurrency of lambda function {lambda_name}"
+        }
+
+        return self.stack.lambda_concurrency.insert(display=True, **inputargs)
+
+    def _get_lambda_target(self, function_name):
+        """
+        Name the callers invoke function_name by - qualified with its
+        alias when it has one, so invocations reach the published
+        version with the provisioned environments.
+        """
+        lambda_name = f"{self.stack.app_name}-{function_name}"
+        alias_name = self._get_lambda_aliases().get(function_name)
+
+        if not alias_name:
+            return lambda_name
+
+        return f"{lambda_name}:{alias_name}"
+
+    def _get_fingerprint_scope(self):
+        return f"setup_iac_ci.{self.stack.app_name}.{self.stack.aws_default_region}"
+
+    def _insert(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack unless it is unchanged since its last
+        successful insert (see _insert_if_changed).
+        Returns None when the insert is skipped.
+        """
+        return self._insert_if_changed(substack_name,
+                                       state_lookup=state_lookup,
+                                       **inputargs)
+
+    # dup 5817205
+    def _get_insert_record(self, resource_type, name):
+
+        try:
+            records = self.stack.get_resource(resource_type=resource_type,
+                                              provider="config0",
+                                              name=name)
+        except Exception:
+            records = None
+
+        if not records:
+            return
+
+        return records[0]
+
+    # dup 5817206
+    def _add_insert_record(self, resource_type, name, values):
+
+        values = dict(values,
+                      _id=self.stack.get_hash(f"{resource_type}.{name}"),
+                      resource_type=resource_type,
+                      provider="config0",
+                      name=name)
+
+        self.stack.add_resource(values=values,
+                                name=name)
+
+    # dup 5817207
+    def _get_state_hash(self, state_lookup):
+        """
+        Hash of the resource an insert produced, so a resource that was
+        changed, replaced or removed since the insert is inserted again.
+        """
+        if not state_lookup:
+            return
+
+        try:
+            resources = self.stack.get_resource(**state_lookup)
+        except Exception:
+            resources = None
+
+        if not resources:
+            return "absent"
+
+        return self.stack.get_hash(json.dumps(resources[0],
+                                              sort_keys=True,
+                                              default=str))
+
+    # dup 5817208
+    def _insert_if_changed(self, substack_name, state_lookup=None, **inputargs):
+        """
+        Insert a substack, skipping it when the same arguments were
+        already inserted successfully and the resource it produced is
+        unchanged.
+
+        The fingerprint is a canonical hash of the substack reference
+        and the arguments.  It is first recorded as pending with the
+        run_id and job of the insert; the commit_<job> jobs (see
+        _add_commit_jobs) only run after the jobs before them succeeded
+        and promote the pending fingerprints of the current run.  A
+        failed insert is therefore never skipped on the next run.
+
+        With state_lookup, the resource produced by the substack is
+        hashed when the fingerprint is committed, and the insert is
+        only skipped while that resource is unchanged.
+
+        The substack references are not versioned, so the fingerprint
+        does not change with a new substack release.  Substacks
+        deploying code (lambda functions, state machines) are inserted
+        directly instead; for the others a new release is picked up
+        with "force".
+
+        Args:
+            substack_name (str): Key of the substack in SUBSTACKS
+            state_lookup (dict): get_resource arguments of the resource
+                the substack produces
+            **inputargs: Arguments for the substack insert
+
+        Returns:
+            dict: Result of the insert, or None when it was skipped
+        """
+        scope = self._get_fingerprint_scope()
+        substack_ref = self.SUBSTACKS[substack_name]
+
+        fingerprint = self.stack.get_hash(json.dumps({"substack": substack_ref,
+                                                      "arguments": inputargs["arguments"]},
+                                                     sort_keys=True,
+                                                     default=str))
+
+        name = self.stack.get_hash(f'{scope}.{substack_name}.{inputargs["human_description"]}')
+        committed = self._get_insert_record(self.INSERT_RESOURCE_TYPE, name)
+
+        if (committed and
+                committed.get("fingerprint") == fingerprint and
+                committed.get("state_hash") == self._get_state_hash(state_lookup) and
+                self.stack.get_attr("force") not in ["True", True, "true"]):
+            self.stack.logger.debug(f'skipping unchanged insert "{inputargs["human_description"]}"')
+            return
+
+        results = getattr(self.stack, substack_name).insert(display=True, **inputargs)
+
+        # without a run_id the insert cannot be confirmed and is
+        # never skipped
+        if not self.stack.get_attr("run_id"):
+            return results
+
+        self._add_insert_record(self.PENDING_RESOURCE_TYPE, name, {
+            "scope": scope,
+            "run_id": str(self.stack.run_id),
+            "job": str(self.stack.get_attr("sched_name")),
+            "substack": substack_ref,
+            "fingerprint": fingerprint,
+            "state_lookup": json.dumps(state_lookup or {}, sort_keys=True)
+        })
+
+        return results
 
     def run(self):
         """
@@ -659,58 +1138,248 @@ class Main(newSchedStack):
         self.add_job("trigger_stepf")
         self.add_job("apigw")
         self.add_job("sns_subscription")
+        self.add_job("commit_apigw")
+        self.add_job("commit_sns_subscription")
 
         return self.finalize_jobs()
 
+    # dup 5817209
+    def _add_commit_jobs(self, jobs):
+        """
+        Job specs with a commit_<job> job after every job nothing
+        depends on.  A commit job starts only when the jobs before it
+        succeeded, so it can confirm their inserts (see
+        _commit_confirmed_inserts).
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: jobs followed by the commit jobs
+        """
+        parents = {parent for job in jobs for parent in job.get("depends_on") or []}
+
+        commit_jobs = [{"job": f'commit_{job["job"]}',
+                        "timeout": self.COMMIT_JOB_TIMEOUT,
+                        "automation_phase": job["automation_phase"],
+                        "human_description": f'Record the inserts up to "{job["job"]}"',
+                        "depends_on": [job["job"]]}
+                       for job in jobs if job["job"] not in parents]
+
+        return jobs + commit_jobs
+
+    # dup 5817210
+    def _commit_confirmed_inserts(self, commit_job):
+        """
+        Commit the pending fingerprints that commit_job confirms - those
+        inserted by the current run in every job it depends on, directly
+        or through other jobs.
+
+        Args:
+            commit_job (str): Name of the running commit job
+
+        Returns:
+            list: Names of the committed fingerprints
+        """
+        scope = self._get_fingerprint_scope()
+        parents = {job["job"]: job.get("depends_on") or [] for job in self._get_jobs()}
+        confirmed = []
+        pending = list(parents.get(commit_job, []))
+
+        while pending:
+            job_name = pending.pop(0)
+
+            if job_name in confirmed:
+                continue
+
+            confirmed.append(job_name)
+            pending.extend(parents.get(job_name, []))
+
+        run_id = str(self.stack.get_attr("run_id"))
+
+        try:
+            records = self.stack.get_resource(resource_type=self.PENDING_RESOURCE_TYPE,
+                                              provider="config0") or []
+        except Exception:
+            records = []
+
+        committed = []
+
+        for record in records:
+            if record.get("scope") != scope or record.get("run_id") != run_id:
+                continue
+
+            if record.get("job") not in confirmed:
+                continue
+
+            self._add_insert_record(self.INSERT_RESOURCE_TYPE, record["name"], {
+                "scope": scope,
+                "substack": record["substack"],
+                "fingerprint": record["fingerprint"],
+                "state_hash": self._get_state_hash(json.loads(record.get("state_lookup") or "{}"))
+            })
+
+            committed.append(record["name"])
+
+        self.stack.logger.debug(f'committed {len(committed)} inserts of jobs {confirmed}')
+
+        return committed
+
+    def _commit_inserts(self, commit_job):
+        self.stack.init_variables()
+
+        return self._commit_confirmed_inserts(commit_job)
+
+    def run_commit_apigw(self):
+        return self._commit_inserts("commit_apigw")
+
+    def run_commit_sns_subscription(self):
+        return self._commit_inserts("commit_sns_subscription")
+
+    def _get_jobs(self):
+        jobs = [
+            {"job": "setup",
+             "timeout": 1800,
+             "automation_phase": "infrastructure",
+             "human_description": "Setup S3 and DynamoDB",
+             "retries": 1},
+            {"job": "lambda_stepf",
+             "timeout": 2700,
+             "automation_phase": "infrastructure",
+             "human_description": "Setup Lambdas and Step Functions",
+             "depends_on": ["setup"]},
+            {"job": "trigger_stepf",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create Lambda Trigger for Step Function",
+             "depends_on": ["lambda_stepf"]},
+            {"job": "apigw",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create API Gateway",
+             "depends_on": ["trigger_stepf"]},
+            {"job": "sns_subscription",
+             "timeout": 1200,
+             "automation_phase": "infrastructure",
+             "human_description": "Create CodeBuild Complete Trigger",
+             "depends_on": ["lambda_stepf"]}
+        ]
+
+        return self._add_commit_jobs(jobs)
+
+    # dup 5817203
+    def _add_dag_schedules(self, jobs):
+        """
+        Add schedules for jobs that declare their dependencies with
+        "depends_on" instead of a hand wired on_success chain.
+
+        Jobs without a dependency between them are started together
+        through on_success fan out.  on_success can fan out but not
+        join, so a job listing more than one job in depends_on is
+        refused rather than started after only one of them.
+
+        Args:
+            jobs (list): Job specs with keys "job", "timeout",
+                "automation_phase", "human_description" and optionally
+                "depends_on" (list), "retries" (int) and "timewait"
+                (int, defaults to DEFAULT_TIMEWAIT)
+
+        Returns:
+            list: Jobs of the critical path, see _get_critical_path
+
+        Raises:
+            Exception: If a dependency is unknown or cyclic, or a job
+                depends on more than one job
+        """
+        children = {job["job"]: [] for job in jobs}
+
+        for job in jobs:
+            depends_on = job.get("depends_on") or []
+
+            if len(depends_on) > 1:
+                raise Exception(f'job "{job["job"]}" depends on {depends_on} - on_success can not join jobs, '
+                                f'so a job can only depend on one job; chain {depends_on} instead')
+
+            for parent in depends_on:
+                if parent not in children:
+                    raise Exception(f'job "{job["job"]}" depends on unknown job "{parent}"')
+                children[parent].append(job["job"])
+
+        critical_path = self._get_critical_path(jobs)
+
+        for job in jobs:
+            sched = self.new_schedule()
+            sched.job = job["job"]
+            sched.archive.timeout = job["timeout"]
+            sched.archive.timewait = job.get("timewait", self.DEFAULT_TIMEWAIT)
+            sched.automation_phase = job["automation_phase"]
+            sched.human_description = job["human_description"]
+
+            if job.get("retries"):
+                sched.conditions.retries = job["retries"]
+
+            if children[job["job"]]:
+                sched.on_success = children[job["job"]]
+
+            self.add_schedule()
+
+        return critical_path
+
+    # dup 5817204
+    def _get_critical_path(self, jobs):
+        """
+        Get the longest chain of depends_on, weighted by the timeout of
+        each job - the worst case time of the schedule.  The path and
+        its seconds are logged so the job to split or speed up is known.
+
+        Args:
+            jobs (list): Job specs as passed to _add_dag_schedules
+
+        Returns:
+            list: Job names of the critical path, first job first
+
+        Raises:
+            Exception: If the depends_on of the jobs are cyclic
+        """
+        specs = {job["job"]: job for job in jobs}
+        finish = {}
+        via = {}
+
+        def _finish(job_name, seen):
+
+            if job_name in seen:
+                raise Exception(f'job "{job_name}" has a cyclic depends_on')
+
+            if job_name not in finish:
+                parents = specs[job_name].get("depends_on") or []
+                start = 0
+
+                for parent in parents:
+                    if _finish(parent, seen + [job_name]) > start:
+                        start = finish[parent]
+                        via[job_name] = parent
+
+                finish[job_name] = start + int(specs[job_name]["timeout"])
+
+            return finish[job_name]
+
+        for job_name in specs:
+            _finish(job_name, [])
+
+        if not finish:
+            return []
+
+        critical_path = [max(finish, key=finish.get)]
+        seconds = finish[critical_path[0]]
+
+        while critical_path[0] in via:
+            critical_path.insert(0, via[critical_path[0]])
+
+        self.stack.logger.debug(f'critical path {" -> ".join(critical_path)} - {seconds} seconds of timeouts')
+
+        return critical_path
+
     def schedule(self):
-        # Schedule for "setup" job
-        sched = self.new_schedule()
-        sched.job = "setup"
-        sched.archive.timeout = 1800
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Setup S3 and DynamoDB"
-        sched.conditions.retries = 1
-        sched.on_success = ["lambda_stepf"]
-        self.add_schedule()
-    
-        # Schedule for "lambda_stepf" job
-        sched = self.new_schedule()
-        sched.job = "lambda_stepf"
-        sched.archive.timeout = 2700
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Setup Lambdas and Step Functions"
-        sched.on_success = ["trigger_stepf"]
-        self.add_schedule()
-    
-        # Schedule for "trigger_stepf" job
-        sched = self.new_schedule()
-        sched.job = "trigger_stepf"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create Lambda Trigger for Step Function"
-        sched.on_success = ["apigw"]
-        self.add_schedule()
-    
-        # Schedule for "apigw" job
-        sched = self.new_schedule()
-        sched.job = "apigw"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create API Gateway"
-        sched.on_success = ["sns_subscription"]
-        self.add_schedule()
-    
-        # Schedule for "sns_subscription" job
-        sched = self.new_schedule()
-        sched.job = "sns_subscription"
-        sched.archive.timeout = 1200
-        sched.archive.timewait = 120
-        sched.automation_phase = "infrastructure"
-        sched.human_description = "Create CodeBuild Complete Trigger"
-        self.add_schedule()
-    
+        self._add_dag_schedules(self._get_jobs())
+
         return self.get_schedules()